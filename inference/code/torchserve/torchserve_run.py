@@ -1,6 +1,8 @@
 from utils.inference_utils import get_inference, get_inference_with_mar, error_msg_print
 from utils.shell_utils import rm_dir, rm_file
 from utils import tsutils as ts
+from utils import load_generator as lg
+from utils import autotune as at
 from utils.system_utils import check_if_path_exists, create_folder_if_not_exits
 import os
 import argparse
@@ -71,17 +73,79 @@ def set_default_values(data_model, model_name, model_path, model_arch_path, clas
             data_model.handler_path = handler
         
 
+def set_benchmark_values(data_model, args):
+    # a recorded trace is replayed from its first request unless a warmup is asked for
+    warmup = args.warmup if args.warmup is not None else (0 if args.load_mode == "trace" else 10)
+    if(args.concurrency < 0 or args.num_requests < 0 or args.duration <= 0 or warmup < 0 or args.trace_speedup <= 0
+            or args.knee_latency_factor < 0):
+        print("Load parameters can not be negative, --duration and --trace_speedup have to be above 0")
+        error_msg_print()
+        sys.exit(1)
+
+    # --concurrency alone keeps the closed loop run
+    load_mode = args.load_mode or ("closed" if args.concurrency > 0 else "")
+    concurrency = args.concurrency or (1 if load_mode == "closed" else 64)
+    ramp = [float(rate) for rate in args.ramp.split(',') if rate.strip()]
+
+    if(load_mode == "open" and args.rate <= 0):
+        print("--load_mode open needs --rate")
+        error_msg_print()
+        sys.exit(1)
+
+    if(load_mode == "trace"):
+        if(not args.trace):
+            print("--load_mode trace needs --trace")
+            error_msg_print()
+            sys.exit(1)
+        check_if_path_exists(args.trace)
+
+    if(load_mode == "ramp" and (not ramp or min(ramp) <= 0)):
+        print("--load_mode ramp needs positive comma separated rates in --ramp")
+        error_msg_print()
+        sys.exit(1)
+
+    dm.set_load_params(data_model, concurrency, args.duration, args.num_requests, warmup, args.load_report,
+        load_mode, args.rate, args.arrival, args.trace, args.trace_speedup, ramp, args.knee_latency_factor)
+    data_model.client_backend = args.client
+
+    try:
+        tune_workers = at.parse_values(args.tune_workers)
+        tune_batch_sizes = at.parse_values(args.tune_batch_sizes)
+        tune_batch_delays = at.parse_values(args.tune_batch_delays)
+        slo = at.parse_slo(args.slo)
+    except ValueError as e:
+        print(f"Invalid autotune parameters - {e}")
+        error_msg_print()
+        sys.exit(1)
+
+    if(args.autotune and (not tune_workers or not tune_batch_sizes or not tune_batch_delays
+            or min(tune_workers + tune_batch_sizes) <= 0 or min(tune_batch_delays) < 0)):
+        print("--autotune needs positive comma separated values in --tune_workers, --tune_batch_sizes and --tune_batch_delays")
+        error_msg_print()
+        sys.exit(1)
+
+    if(args.autotune and args.client == "grpc" and 0 in tune_batch_delays):
+        # protobuf can not tell 0 from a missing field, TorchServe registers those with its default delay
+        print("--tune_batch_delays 0 can not be registered over grpc, use --client http or a delay of at least 1 ms")
+        error_msg_print()
+        sys.exit(1)
+
+    dm.set_autotune_params(data_model, bool(args.autotune), tune_workers, tune_batch_sizes, tune_batch_delays, slo)
+
+
 def run_inference_with_mar(args):
     check_if_path_exists(args.mar)
     data_model = dm.set_data_model(args.data, args.gpus, args.gen_folder_name, model_name=args.model_name, mar_filepath=args.mar)
-    
+    set_benchmark_values(data_model, args)
+
     get_inference_with_mar(data_model, args.debug_mode)
 
 
 def run_inference_with_custom_params(args):
     data_model = dm.set_data_model(args.data, args.gpus, args.gen_folder_name, args.model_name, args.model_path, args.handler_path, args.classes,  
         args.model_arch_path, args.extra_files)
-    
+    set_benchmark_values(data_model, args)
+
     if(not args.model_path or not args.model_arch_path or not args.classes or not args.handler_path):
         set_default_values(data_model, args.model_name, args.model_path, args.model_arch_path, args.classes, args.handler_path, args.gen_folder_name)
 
@@ -181,5 +245,59 @@ if __name__ == '__main__':
     parser.add_argument('--mar', type=str, default="", 
                         metavar='mar', help='absolute path to the model archive file')
 
+    parser.add_argument('--client', type=str, default="http", choices=ts.CLIENT_BACKENDS,
+                        metavar='client', help='talk to TorchServe over the REST (http) or the gRPC (grpc) APIs, for registration and inference')
+
+    parser.add_argument('--load_mode', type=str, default="", choices=lg.LOAD_MODES,
+                        metavar='load', help='load to send after the inference check, reporting throughput and latency percentiles: closed (--concurrency requests in flight), open (--rate requests per second), trace (replay of --trace) or ramp (open loop at every rate of --ramp)')
+
+    parser.add_argument('--concurrency', type=int, default=0,
+                        metavar='conc', help='requests in flight of the closed loop, sets --load_mode closed when no mode is given. Client threads of the open loop modes, default 64')
+
+    parser.add_argument('--duration', type=float, default=60,
+                        metavar='sec', help='seconds of measured load, per rate for --load_mode ramp')
+
+    parser.add_argument('--rate', type=float, default=0,
+                        metavar='rps', help='requests per second of --load_mode open')
+
+    parser.add_argument('--arrival', type=str, default="fixed", choices=lg.ARRIVALS,
+                        metavar='arrival', help='open loop arrivals: fixed spacing or poisson')
+
+    parser.add_argument('--trace', type=str, default="",
+                        metavar='trace', help='absolute path to a json lines trace for --load_mode trace, one request per line with a "timestamp" field (seconds or ISO 8601) and an optional "input" file')
+
+    parser.add_argument('--trace_speedup', type=float, default=1.0,
+                        metavar='x', help='replay the trace this many times faster')
+
+    parser.add_argument('--ramp', type=str, default="",
+                        metavar='rates', help='comma separated requests per second of --load_mode ramp, e.g. 5,10,20,40')
+
+    parser.add_argument('--knee_latency_factor', type=float, default=0,
+                        metavar='x', help='with --load_mode ramp, also end the knee at the first rate whose p99 exceeds this multiple of the p99 at the lowest rate. 0 only uses goodput and queue growth')
+
+    parser.add_argument('--num_requests', type=int, default=0,
+                        metavar='req', help='measured requests of the closed loop, overrides --duration when set')
+
+    parser.add_argument('--warmup', type=float, default=None,
+                        metavar='sec', help='seconds of load sent before measuring starts, per rate for --load_mode ramp. Default 10, 0 for --load_mode trace')
+
+    parser.add_argument('--load_report', type=str, default="",
+                        metavar='report', help='absolute path of a json file the load results are written to')
+
+    parser.add_argument('--autotune', type=int, default=0,
+                        metavar='tune', help='re-register the model with every combination of the --tune_* values, measure each under load and write the best setting that meets --slo to the host profile in models/profiles, which later registrations use')
+
+    parser.add_argument('--tune_workers', type=str, default="1",
+                        metavar='workers', help='comma separated initial_workers values of --autotune')
+
+    parser.add_argument('--tune_batch_sizes', type=str, default="1,4,8,16",
+                        metavar='sizes', help='comma separated batch_size values of --autotune')
+
+    parser.add_argument('--tune_batch_delays', type=str, default="5,20,50,100",
+                        metavar='ms', help='comma separated max_batch_delay values of --autotune, in milliseconds')
+
+    parser.add_argument('--slo', type=str, default="",
+                        metavar='slo', help='latency targets in milliseconds for --autotune, e.g. p99=200,p50=50. The setting with the highest throughput that meets them is chosen')
+
     args = parser.parse_args()
     torchserve_run(args)
@@ -0,0 +1,146 @@
+import os
+import sys
+import itertools
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+import tsutils as ts
+import load_generator as lg
+
+TUNED_PARAMS = ["initial_workers", "batch_size", "max_batch_delay"]
+# share of failed requests above which a setting does not count as serving the load
+MAX_ERROR_RATE = 0.01
+
+
+def parse_values(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def parse_slo(value):
+    """'p99=200,p50=50' -> {"p99_ms": 200.0, "p50_ms": 50.0}, latency targets in milliseconds."""
+    slo = {}
+    for part in value.split(','):
+        if not part.strip():
+            continue
+        name, target = part.split('=')
+        key = f"{name.strip()}_ms"
+        if key not in ["mean_ms"] + [f"p{q:g}_ms" for q in lg.PERCENTILES]:
+            raise ValueError(f"unknown latency target {name}, use mean or one of " + ", ".join(f"p{q:g}" for q in lg.PERCENTILES))
+        slo[key] = float(target)
+    return slo
+
+
+def latency_key(slo):
+    """The latency the settings are traded off against: the highest percentile of the SLO, p99 without one."""
+    percentiles = [key for key in slo if key != "mean_ms"]
+    return max(percentiles, key=lambda key: float(key[1:-3])) if percentiles else "p99_ms"
+
+
+def serves(result):
+    return (result["requests"] > 0 and result["errors"] <= MAX_ERROR_RATE * result["requests"]
+            and result["p99_ms"] is not None)
+
+
+def meets_slo(result, slo):
+    return serves(result) and all(result[key] is not None and result[key] <= target for key, target in slo.items())
+
+
+def pareto_front(results, key="p99_ms"):
+    """Results no other result beats on both throughput and the latency key, by increasing throughput."""
+    candidates = [r for r in results if serves(r)]
+    front = []
+    for r in candidates:
+        dominated = any(o["throughput_rps"] >= r["throughput_rps"] and o[key] <= r[key]
+                        and (o["throughput_rps"] > r["throughput_rps"] or o[key] < r[key]) for o in candidates)
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r["throughput_rps"])
+
+
+def choose(front, slo):
+    """Highest throughput setting of the front that meets the SLO, None when none does."""
+    feasible = [r for r in front if meets_slo(r, slo)]
+    return max(feasible, key=lambda r: r["throughput_rps"]) if feasible else None
+
+
+def settings_of(result):
+    return {param: result[param] for param in TUNED_PARAMS}
+
+
+def clients_for(concurrency, batch_size, initial_workers):
+    """Closed loop clients of a setting, at least two full batches per worker so that batches can fill."""
+    return max(concurrency, 2 * batch_size * initial_workers)
+
+
+def max_clients(concurrency, workers, batch_sizes, rate=0):
+    """Most requests any setting of the sweep keeps in flight, to size the connection pool of the client."""
+    if rate > 0:
+        return max(concurrency, 64)
+    return max(clients_for(concurrency, batch_size, initial_workers) for initial_workers in workers for batch_size in batch_sizes)
+
+
+def run_autotune(model_name, marfile, inputs, send, workers, batch_sizes, batch_delays, slo, concurrency=0,
+        duration=60, warmup=10, rate=0, arrival="fixed"):
+    """Re-registers the model with every combination of the settings and measures each under load.
+
+    Closed loop load keeps at least two full batches per worker in flight, so that batches can
+    fill. With a rate the load is an open loop at that rate instead. Returns the result of every
+    setting, with its settings and whether it is on the Pareto front of throughput and tail
+    latency, and the chosen result.
+    """
+    results = []
+    for initial_workers, batch_size, max_batch_delay in itertools.product(workers, batch_sizes, batch_delays):
+        settings = {"initial_workers": initial_workers, "batch_size": batch_size, "max_batch_delay": max_batch_delay}
+        print(f"## Autotune {model_name}: {initial_workers} workers, batch size {batch_size}, max batch delay {max_batch_delay} ms \n")
+        ts.unregister_model(model_name)
+        response = ts.register_model(model_name, marfile, settings=settings)
+        if not response or response.status_code != 200:
+            print(f"## Failed to register {model_name} with {settings}, skipping \n")
+            continue
+
+        if rate > 0:
+            schedule = lg.build_schedule(arrival, rate, warmup + duration)
+            result = lg.run_open_loop(model_name, inputs, schedule, warmup, max(concurrency, 64), send)
+        else:
+            clients = clients_for(concurrency, batch_size, initial_workers)
+            result = lg.run_closed_loop(model_name, inputs, clients, duration=duration, warmup=warmup, send=send)
+        result.update(settings)
+        print(lg.format_summary(result), "\n")
+        results.append(result)
+
+    key = latency_key(slo)
+    front = pareto_front(results, key)
+    best = choose(front, slo)
+    for result in results:
+        result["pareto"] = result in front
+        result["meets_slo"] = meets_slo(result, slo)
+        result["chosen"] = result is best
+    return results, best
+
+
+def format_results(results, slo):
+    key = latency_key(slo)
+    slo_text = ", ".join(f"{name[:-3]} <= {target:g} ms" for name, target in slo.items()) or "none"
+    lines = [f"## AUTOTUNE {results[0]['model_name'] if results else ''} (SLO: {slo_text})",
+             f"  {'workers':>7} {'batch':>5} {'delay ms':>8} {'req/sec':>10} {'p50 ms':>9} {key[:-3] + ' ms':>9} {'errors':>7} {'slo':>4}"]
+    for r in sorted(results, key=lambda r: (r["initial_workers"], r["batch_size"], r["max_batch_delay"])):
+        lines.append(f"  {r['initial_workers']:>7} {r['batch_size']:>5} {r['max_batch_delay']:>8} {r['throughput_rps']:>10.2f} "
+                     f"{r['p50_ms'] or 0:>9.2f} {r[key] or 0:>9.2f} {r['errors']:>7} {'yes' if r['meets_slo'] else 'no':>4}"
+                     + ("  pareto" if r["pareto"] else "") + ("  <- chosen" if r["chosen"] else ""))
+    return "\n".join(lines)
+
+
+def save_profile(model_name, results, best, slo, profile_path=None):
+    """Writes the chosen settings and the Pareto front of the model into the host profile registration reads."""
+    key = latency_key(slo)
+    entry = settings_of(best)
+    entry.update({
+        "throughput_rps": best["throughput_rps"],
+        key: best[key],
+        "slo": slo,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "pareto": [dict(settings_of(r), throughput_rps=r["throughput_rps"], **{key: r[key]}) for r in results if r["pareto"]],
+    })
+    ts.save_host_profile(model_name, entry, profile_path)
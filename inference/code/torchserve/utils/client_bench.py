@@ -0,0 +1,103 @@
+import os
+import sys
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+import requests
+import tsutils as ts
+import load_generator as lg
+
+DEFAULT_INPUT = os.path.join(REPO_ROOT, '../../../data/goldfish.JPEG')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every request like TorchServe would, after server.delay seconds, keeping connections alive."""
+    protocol_version = "HTTP/1.1"
+    # TorchServe sets TCP_NODELAY, without it every kept alive response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def reply(self, body):
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply(b'{"goldfish": 0.98}')
+
+    def do_GET(self):
+        self.reply(b'{"status": "Healthy"}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(delay=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def per_call_sender(port):
+    """The request path run_inference had before InferenceClient: a new connection and file read per call."""
+    def send(model_name, input):
+        files = {"data": (input, open(input, "rb"))}
+        return requests.post(f"http://127.0.0.1:{port}/predictions/{model_name}", files=files, timeout=120).status_code == 200
+    return send
+
+
+def benchmark(input, concurrencies, num_requests, warmup, delay):
+    server = start_stub_server(delay)
+    port = server.server_address[1]
+    print(f"## Stub server on port {port}, {delay * 1000:.1f} ms per request, input {input} ({os.path.getsize(input)} bytes) \n")
+
+    results = []
+    for concurrency in concurrencies:
+        client = ts.InferenceClient(host="127.0.0.1", inference_port=port, pool_size=max(concurrency, ts.DEFAULT_POOL_SIZE))
+        client.preload([input])
+        for name, send in [("per call", per_call_sender(port)), ("pooled", lg.client_sender(client))]:
+            summary = lg.run_closed_loop("stub", [input], concurrency, num_requests=num_requests, warmup=warmup, send=send)
+            summary["model_name"] = f"stub {name}"
+            print(lg.format_summary(summary), "\n")
+            results.append((concurrency, name, summary))
+        client.close()
+    server.shutdown()
+
+    print("## PER CALL vs POOLED")
+    print(f"  {'clients':>7} {'client':>9} {'req/sec':>10} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} {'speedup':>8}")
+    for concurrency, name, summary in results:
+        base = [s for c, n, s in results if c == concurrency and n == "per call"][0]
+        print(f"  {concurrency:>7} {name:>9} {summary['throughput_rps']:>10.1f} {summary['mean_ms']:>9.3f} {summary['p50_ms']:>9.3f} "
+              f"{summary['p99_ms']:>9.3f} {summary['p99.9_ms']:>9.3f} {summary['throughput_rps'] / base['throughput_rps']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the per call requests path with the pooled InferenceClient against a local stub server')
+    parser.add_argument('--input', type=str, default=DEFAULT_INPUT,
+                        metavar='input', help='file sent with every request')
+
+    parser.add_argument('--concurrency', type=str, default="1,8,32",
+                        metavar='conc', help='comma separated client thread counts')
+
+    parser.add_argument('--num_requests', type=int, default=2000,
+                        metavar='req', help='measured requests per run')
+
+    parser.add_argument('--warmup', type=float, default=1,
+                        metavar='sec', help='seconds of unmeasured requests per run')
+
+    parser.add_argument('--delay', type=float, default=0,
+                        metavar='sec', help='seconds the stub server takes per request')
+
+    args = parser.parse_args()
+    benchmark(args.input, [int(c) for c in args.concurrency.split(',')], args.num_requests, args.warmup, args.delay)
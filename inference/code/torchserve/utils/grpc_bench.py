@@ -0,0 +1,168 @@
+import os
+import sys
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import grpc
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+import tsutils as ts
+import grpc_client as gc
+import load_generator as lg
+from client_bench import DEFAULT_INPUT, start_stub_server
+
+STUB_PREDICTION = b'{"goldfish": 0.98}'
+
+
+def start_grpc_stand_in(delay=0.0, max_workers=64):
+    """Serves the TorchServe gRPC methods the harness calls on two local ports, after delay seconds per prediction.
+
+    Returns the server with its inference_port and management_port. Models are known once
+    they are registered, predictions of other models fail with NOT_FOUND like TorchServe.
+    """
+    models = {}
+    lock = threading.Lock()
+
+    def field(fields, number):
+        return fields.get(number, [b""])[0]
+
+    def predictions(request, context):
+        model_name = field(gc.decode_message(request), 1).decode()
+        if model_name not in models:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Model not found: {model_name}")
+        if delay:
+            time.sleep(delay)
+        return gc.encode_message([(1, STUB_PREDICTION)])
+
+    def ping(request, context):
+        return gc.encode_message([(1, '{"status": "Healthy"}')])
+
+    def register_model(request, context):
+        fields = gc.decode_message(request)
+        url = field(fields, 9).decode()
+        model_name = field(fields, 5).decode() or os.path.splitext(os.path.basename(url))[0]
+        with lock:
+            models[model_name] = url
+        return gc.encode_message([(1, json.dumps({"status": f'Model "{model_name}" Version: 1.0 registered with '
+                                                           f'{field(fields, 3) or 1} initial workers'}))])
+
+    def unregister_model(request, context):
+        model_name = field(gc.decode_message(request), 1).decode()
+        with lock:
+            if models.pop(model_name, None) is None:
+                context.abort(grpc.StatusCode.NOT_FOUND, f"Model not found: {model_name}")
+        return gc.encode_message([(1, json.dumps({"status": f'Model "{model_name}" unregistered'}))])
+
+    def list_models(request, context):
+        with lock:
+            listed = [{"modelName": name, "modelUrl": url} for name, url in sorted(models.items())]
+        return gc.encode_message([(1, json.dumps({"models": listed}))])
+
+    def handler(service, methods):
+        return grpc.method_handlers_generic_handler(service, {name: grpc.unary_unary_rpc_method_handler(method)
+                                                              for name, method in methods.items()})
+
+    server = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((
+        handler(gc.INFERENCE_SERVICE, {"Predictions": predictions, "Ping": ping}),
+        handler(gc.MANAGEMENT_SERVICE, {"RegisterModel": register_model, "UnregisterModel": unregister_model,
+                                        "ListModels": list_models}),
+    ))
+    server.inference_port = server.add_insecure_port("127.0.0.1:0")
+    server.management_port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server
+
+
+def check_management(client, model_name):
+    """Registers, lists and unregisters a model through the gRPC management API of the stand-in."""
+    params = (("url", f"{model_name}.mar"), ("initial_workers", 1), ("batch_size", 1), ("max_batch_delay", 200),
+              ("response_timeout", 2000), ("synchronous", "true"))
+    assert client.register_model(params).status_code == 200
+    assert model_name in [model["modelName"] for model in client.list_models().json()["models"]]
+    assert client.unregister_model(model_name).status_code == 200
+    assert client.unregister_model(model_name).status_code == 404
+    assert client.register_model(params).status_code == 200
+    print(f"## gRPC management calls of {model_name} succeeded \n")
+
+
+def benchmark(input, model_name, concurrencies, num_requests, warmup, delay, torchserve, host):
+    if torchserve:
+        # a running TorchServe with the model registered
+        http_client = ts.InferenceClient(host=host, pool_size=max(max(concurrencies), ts.DEFAULT_POOL_SIZE))
+        grpc_client = gc.GrpcInferenceClient(host)
+        servers = []
+        print(f"## TorchServe on {host}, model {model_name} \n")
+    else:
+        http_server = start_stub_server(delay)
+        grpc_server = start_grpc_stand_in(delay, max_workers=max(max(concurrencies), 16))
+        servers = [http_server.shutdown, lambda: grpc_server.stop(None)]
+        http_client = ts.InferenceClient(host="127.0.0.1", inference_port=http_server.server_address[1],
+            pool_size=max(max(concurrencies), ts.DEFAULT_POOL_SIZE))
+        grpc_client = gc.GrpcInferenceClient("127.0.0.1", grpc_server.inference_port, grpc_server.management_port)
+        print(f"## Stand-in servers, HTTP port {http_server.server_address[1]}, gRPC ports {grpc_server.inference_port} "
+              f"and {grpc_server.management_port}, {delay * 1000:.1f} ms per request \n")
+        check_management(grpc_client, model_name)
+
+    http_client.preload([input])
+    grpc_client.preload([input])
+    results = []
+    for concurrency in concurrencies:
+        for name, client in [("http", http_client), ("grpc", grpc_client)]:
+            summary = lg.run_closed_loop(model_name, [input], concurrency, num_requests=num_requests,
+                warmup=warmup, send=lg.client_sender(client))
+            summary["model_name"] = f"{model_name} over {name}"
+            print(lg.format_summary(summary), "\n")
+            results.append((concurrency, name, summary))
+
+    http_client.close()
+    grpc_client.close()
+    for stop in servers:
+        stop()
+
+    print(f"## HTTP vs gRPC, {os.path.getsize(input)} byte input")
+    print(f"  {'clients':>7} {'api':>5} {'req/sec':>10} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} {'vs http':>8}")
+    for concurrency, name, summary in results:
+        base = [s for c, n, s in results if c == concurrency and n == "http"][0]
+        print(f"  {concurrency:>7} {name:>5} {summary['throughput_rps']:>10.1f} {summary['mean_ms']:>9.3f} {summary['p50_ms']:>9.3f} "
+              f"{summary['p99_ms']:>9.3f} {summary['p99.9_ms']:>9.3f} {summary['throughput_rps'] / base['throughput_rps']:>7.2f}x")
+    if not torchserve:
+        # with one client the server time is known, the rest of the latency is client and protocol overhead
+        for concurrency, name, summary in results:
+            if concurrency == 1:
+                print(f"## {name} overhead per request {summary['mean_ms'] - delay * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare per request overhead and throughput of the REST and gRPC clients')
+    parser.add_argument('--input', type=str, default=DEFAULT_INPUT,
+                        metavar='input', help='file sent with every request')
+
+    parser.add_argument('--model_name', type=str, default="stub",
+                        metavar='n', help='model to send the requests to')
+
+    parser.add_argument('--concurrency', type=str, default="1,8,32",
+                        metavar='conc', help='comma separated client thread counts')
+
+    parser.add_argument('--num_requests', type=int, default=2000,
+                        metavar='req', help='measured requests per run')
+
+    parser.add_argument('--warmup', type=float, default=1,
+                        metavar='sec', help='seconds of unmeasured requests per run')
+
+    parser.add_argument('--delay', type=float, default=0,
+                        metavar='sec', help='seconds the stand-in servers take per request')
+
+    parser.add_argument('--torchserve', type=int, default=0,
+                        metavar='ts', help='send to a running TorchServe that serves --model_name instead of the stand-in servers')
+
+    parser.add_argument('--host', type=str, default="localhost",
+                        metavar='host', help='TorchServe host with --torchserve')
+
+    args = parser.parse_args()
+    benchmark(args.input, args.model_name, [int(c) for c in args.concurrency.split(',')], args.num_requests,
+        args.warmup, args.delay, args.torchserve, args.host)
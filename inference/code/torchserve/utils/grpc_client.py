@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import threading
+import grpc
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+# grpc_inference_port and grpc_management_port of config.properties
+GRPC_INFERENCE_PORT = 7075
+GRPC_MANAGEMENT_PORT = 7076
+
+INFERENCE_SERVICE = "org.pytorch.serve.grpc.inference.InferenceAPIsService"
+MANAGEMENT_SERVICE = "org.pytorch.serve.grpc.management.ManagementAPIsService"
+
+# field numbers of the TorchServe inference.proto and management.proto messages
+REGISTER_FIELDS = {
+    "batch_size": (1, int),
+    "handler": (2, str),
+    "initial_workers": (3, int),
+    "max_batch_delay": (4, int),
+    "model_name": (5, str),
+    "response_timeout": (6, int),
+    "runtime": (7, str),
+    "synchronous": (8, bool),
+    "url": (9, str),
+}
+
+STATUS_CODES = {
+    grpc.StatusCode.OK: 200,
+    grpc.StatusCode.INVALID_ARGUMENT: 400,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 408,
+    grpc.StatusCode.ALREADY_EXISTS: 409,
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 503,
+    grpc.StatusCode.UNAVAILABLE: 503,
+}
+
+
+def encode_varint(value):
+    out = bytearray()
+    value &= (1 << 64) - 1
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def encode_field(number, value):
+    """One protobuf field: varint wire type for int and bool, length delimited for str and bytes."""
+    if isinstance(value, (bool, int)):
+        return encode_varint(number << 3) + encode_varint(int(value))
+    if isinstance(value, str):
+        value = value.encode()
+    return encode_varint(number << 3 | 2) + encode_varint(len(value)) + value
+
+
+def encode_message(fields):
+    """Protobuf message from (number, value) pairs, fields with default values are left out like protobuf does."""
+    return b"".join(encode_field(number, value) for number, value in fields if value not in (None, "", b"", 0, False))
+
+
+def decode_message(data):
+    """{field number: [values]} of a protobuf message, varints as int and length delimited fields as bytes."""
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = decode_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = decode_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = decode_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def decode_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def predictions_request(model_name, inputs, model_version=""):
+    """PredictionsRequest: model_name = 1, model_version = 2, map<string, bytes> input = 3."""
+    entries = [(3, encode_message([(1, key), (2, value)])) for key, value in inputs.items()]
+    return encode_message([(1, model_name), (2, model_version)] + entries)
+
+
+def register_model_request(params):
+    """RegisterModelRequest from the query parameters of the REST register call.
+
+    Like every proto3 scalar a 0 is not sent, TorchServe registers it with its default value.
+    """
+    fields = []
+    for name, value in params:
+        if name in REGISTER_FIELDS and value is not None:
+            number, kind = REGISTER_FIELDS[name]
+            if kind is bool:
+                value = value if isinstance(value, bool) else str(value).lower() == "true"
+            fields.append((number, kind(value)))
+    return encode_message(sorted(fields))
+
+
+class GrpcResponse(object):
+    """The parts of a requests.Response the harness reads, for a gRPC call."""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode(errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __repr__(self):
+        return f"<GrpcResponse [{self.status_code}]>"
+
+
+class GrpcInferenceClient(object):
+    """TorchServe gRPC client with the interface of tsutils.InferenceClient.
+
+    One persistent channel per API carries all calls, concurrent unary calls from many threads
+    are multiplexed over its HTTP/2 connection. Messages are encoded by hand from the field
+    numbers of the TorchServe protos, so no generated stubs are needed. Failed connections are
+    retried by waiting for the channel to become ready, up to timeout seconds.
+    """
+
+    def __init__(self, host="localhost", inference_port=GRPC_INFERENCE_PORT, management_port=GRPC_MANAGEMENT_PORT,
+            timeout=120, max_message_mb=64):
+        options = [("grpc.max_send_message_length", max_message_mb * 2**20),
+                   ("grpc.max_receive_message_length", max_message_mb * 2**20)]
+        self.timeout = timeout
+        self.inference_channel = grpc.insecure_channel(f"{host}:{inference_port}", options=options)
+        self.management_channel = grpc.insecure_channel(f"{host}:{management_port}", options=options)
+        self._predictions = self.inference_channel.unary_unary(f"/{INFERENCE_SERVICE}/Predictions")
+        self._ping = self.inference_channel.unary_unary(f"/{INFERENCE_SERVICE}/Ping")
+        self._register = self.management_channel.unary_unary(f"/{MANAGEMENT_SERVICE}/RegisterModel")
+        self._unregister = self.management_channel.unary_unary(f"/{MANAGEMENT_SERVICE}/UnregisterModel")
+        self._list = self.management_channel.unary_unary(f"/{MANAGEMENT_SERVICE}/ListModels")
+        self._describe = self.management_channel.unary_unary(f"/{MANAGEMENT_SERVICE}/DescribeModel")
+        self.payloads = {}
+        self._lock = threading.Lock()
+
+    def call(self, method, request, timeout=None):
+        """Response of the unary call, its first (string or bytes) field as content."""
+        try:
+            reply = method(request, timeout=timeout or self.timeout, wait_for_ready=True)
+        except grpc.RpcError as e:
+            return GrpcResponse(STATUS_CODES.get(e.code(), 500), (e.details() or str(e.code())).encode())
+        return GrpcResponse(200, decode_message(reply).get(1, [b""])[0])
+
+    def payload(self, file_name):
+        payload = self.payloads.get(file_name)
+        if payload is None:
+            with open(file_name, "rb") as f:
+                payload = f.read()
+            with self._lock:
+                self.payloads[file_name] = payload
+        return payload
+
+    def preload(self, file_names):
+        for file_name in file_names:
+            self.payload(file_name)
+
+    def predict(self, model_name, file_name, timeout=None):
+        return self.call(self._predictions, predictions_request(model_name, {"data": self.payload(file_name)}), timeout)
+
+    def ping(self, timeout=None):
+        """Raises grpc.RpcError right away when the server is down, like the REST ping does."""
+        reply = self._ping(b"", timeout=timeout or self.timeout)
+        return GrpcResponse(200, decode_message(reply).get(1, [b""])[0])
+
+    def register_model(self, params):
+        return self.call(self._register, register_model_request(params))
+
+    def unregister_model(self, model_name):
+        return self.call(self._unregister, encode_message([(1, model_name)]))
+
+    def list_models(self):
+        return self.call(self._list, b"")
+
+    def describe_model(self, model_name):
+        return self.call(self._describe, encode_message([(1, model_name)]))
+
+    def close(self):
+        self.inference_channel.close()
+        self.management_channel.close()
@@ -14,6 +14,24 @@ class Inference_data_model(object):
     ts_config_file = str()
     ts_model_store = str()
     dir_path = str()
+    client_backend = str()
+    concurrency = int()
+    duration = float()
+    num_requests = int()
+    warmup = float()
+    load_report = str()
+    load_mode = str()
+    rate = float()
+    arrival = str()
+    trace = str()
+    trace_speedup = float()
+    ramp = list()
+    knee_latency_factor = float()
+    autotune = bool()
+    tune_workers = list()
+    tune_batch_sizes = list()
+    tune_batch_delays = list()
+    slo = dict()
 
 
 def set_data_model(data, gpus, gen_folder, model_name="", model_path="", handler_path="", 
@@ -29,6 +47,34 @@ def set_data_model(data, gpus, gen_folder, model_name="", model_path="", handler
     data_model.gpus = gpus
     data_model.gen_folder = gen_folder
     data_model.mar_filepath=mar_filepath
+    data_model.client_backend = "http"
 
     return data_model
 
+
+def set_load_params(data_model, concurrency=0, duration=60, num_requests=0, warmup=10, load_report="",
+        load_mode="", rate=0, arrival="fixed", trace="", trace_speedup=1.0, ramp=None, knee_latency_factor=0):
+    data_model.concurrency = concurrency
+    data_model.duration = duration
+    data_model.num_requests = num_requests
+    data_model.warmup = warmup
+    data_model.load_report = load_report
+    data_model.load_mode = load_mode
+    data_model.rate = rate
+    data_model.arrival = arrival
+    data_model.trace = trace
+    data_model.trace_speedup = trace_speedup
+    data_model.ramp = ramp or []
+    data_model.knee_latency_factor = knee_latency_factor
+
+    return data_model
+
+
+def set_autotune_params(data_model, autotune=False, tune_workers=None, tune_batch_sizes=None, tune_batch_delays=None, slo=None):
+    data_model.autotune = autotune
+    data_model.tune_workers = tune_workers or [1]
+    data_model.tune_batch_sizes = tune_batch_sizes or [1]
+    data_model.tune_batch_delays = tune_batch_delays or [200]
+    data_model.slo = slo or {}
+
+    return data_model
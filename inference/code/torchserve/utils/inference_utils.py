@@ -7,6 +7,8 @@ sys.path.append(REPO_ROOT)
 
 import tsutils as ts
 import system_utils
+import load_generator as lg
+import autotune as at
 import time
 import json
 import subprocess
@@ -105,6 +107,74 @@ def execute_inference_on_inputs(model_inputs, model_name):
             sys.exit(1)
 
 
+def execute_load_on_inputs(model_inputs, model_name, data_model):
+    dm = data_model
+    if not model_inputs:
+        print(f"## Load generation on {model_name} needs input files, set --data \n")
+        error_msg_print()
+        sys.exit(1)
+
+    # one keep-alive connection per client thread, inputs read and encoded before any latency is measured
+    client = ts.create_client(pool_size=max(dm.concurrency, ts.DEFAULT_POOL_SIZE))
+    client.preload(model_inputs)
+    send = lg.client_sender(client)
+
+    if dm.load_mode == "ramp":
+        steps, knee = lg.run_ramp(model_name, model_inputs, dm.ramp, dm.arrival, dm.duration, dm.warmup, dm.concurrency, send,
+            dm.knee_latency_factor)
+        print(lg.format_curve(steps, knee), "\n")
+        for step in steps:
+            step["knee"] = step is knee
+        return steps
+
+    if dm.load_mode == "open":
+        print(f"## Open loop load on {model_name}: {dm.rate} req/sec {dm.arrival} arrivals, {dm.warmup}s warmup, {dm.duration}s \n")
+        schedule = lg.build_schedule(dm.arrival, dm.rate, dm.warmup + dm.duration)
+        summary = lg.run_open_loop(model_name, model_inputs, schedule, dm.warmup, dm.concurrency, send)
+
+    elif dm.load_mode == "trace":
+        schedule = lg.load_trace(dm.trace, speedup=dm.trace_speedup)
+        if not any(offset >= dm.warmup for offset, _ in schedule):
+            print(f"## No request of {dm.trace} falls after the {dm.warmup}s warmup, nothing would be measured \n")
+            error_msg_print()
+            sys.exit(1)
+        print(f"## Replaying {len(schedule)} requests of {dm.trace} on {model_name} at {dm.trace_speedup}x, {dm.warmup}s warmup \n")
+        summary = lg.run_open_loop(model_name, model_inputs, schedule, dm.warmup, dm.concurrency, send)
+
+    else:
+        summary = lg.run_closed_loop(model_name, model_inputs, concurrency=dm.concurrency, duration=dm.duration,
+            num_requests=dm.num_requests, warmup=dm.warmup, send=send)
+
+    print(lg.format_summary(summary), "\n")
+    return [summary]
+
+
+def execute_autotune_on_inputs(model_inputs, model_name, input_mar, data_model):
+    dm = data_model
+    if not model_inputs:
+        print(f"## Autotuning {model_name} needs input files, set --data \n")
+        error_msg_print()
+        sys.exit(1)
+
+    rate = dm.rate if dm.load_mode == "open" else 0
+    # one pooled connection for every client thread of the largest setting, so no setting pays for new connections
+    pool_size = at.max_clients(dm.concurrency, dm.tune_workers, dm.tune_batch_sizes, rate)
+    client = ts.create_client(pool_size=max(pool_size, ts.DEFAULT_POOL_SIZE))
+    client.preload(model_inputs)
+    results, best = at.run_autotune(model_name, input_mar, model_inputs, lg.client_sender(client), dm.tune_workers,
+        dm.tune_batch_sizes, dm.tune_batch_delays, dm.slo, dm.concurrency, dm.duration, dm.warmup, rate, dm.arrival)
+    print(at.format_results(results, dm.slo), "\n")
+
+    # leave the model registered with the chosen settings, or the usual ones when no setting meets the SLO
+    if best is None:
+        print(f"## No setting of {model_name} meets the SLO, the host profile is left unchanged \n")
+    else:
+        at.save_profile(model_name, results, best, dm.slo)
+    ts.unregister_model(model_name)
+    register_model(model_name, input_mar)
+    return results
+
+
 def register_model(model_name, input_mar):
     response = ts.register_model(model_name, input_mar)    
     if response and response.status_code == 200:
@@ -125,7 +195,8 @@ def unregister_model(model_name):
         sys.exit(1)
 
 
-def validate_inference_model(models_to_validate, input_mar, model_name, is_mar_generated, debug):
+def validate_inference_model(models_to_validate, input_mar, model_name, is_mar_generated, debug, data_model=None):
+    summaries = []
     for model in models_to_validate:
         model_name = model["name"]
         model_inputs = model["inputs"]
@@ -136,7 +207,7 @@ def validate_inference_model(models_to_validate, input_mar, model_name, is_mar_g
         if (not is_mar_generated):
             # For pre-existing mar file the model name might be set different while creation
             # Fetch the correct model name for inference requests
-            result = requests.get('http://localhost:8081/models/').json()  
+            result = ts.list_models().json()
             model_name = get_model_name(result, input_mar)
 
         execute_inference_on_inputs(model_inputs, model_name)
@@ -144,6 +215,16 @@ def validate_inference_model(models_to_validate, input_mar, model_name, is_mar_g
         debug and os.system(f"curl http://localhost:8081/models/{model_name}")
         print(f"## {model_handler} Handler is stable. \n")
 
+        # Load generation runs only once the handler answered every input correctly
+        if data_model and data_model.load_mode:
+            summaries.extend(execute_load_on_inputs(model_inputs, model_name, data_model))
+
+        if data_model and data_model.autotune:
+            summaries.extend(execute_autotune_on_inputs(model_inputs, model_name, input_mar, data_model))
+
+    if data_model and data_model.load_report and summaries:
+        lg.save_report(summaries, data_model.load_report)
+
 
 def get_inference_internal(data_model, generate_mar, debug):
     dm = data_model
@@ -160,7 +241,9 @@ def get_inference_internal(data_model, generate_mar, debug):
     ]
 
     set_compute_setting(dm.gpus)
-    
+    ts.set_client_backend(dm.client_backend)
+    print(f"## Talking to TorchServe over {dm.client_backend} \n")
+
     # mar file is generated only if generate_mar is True else it will be None
     generated_mar_file = start_ts_server(dm.gen_folder, dm.ts_model_store, dm.ts_log_file, dm.ts_log_config, dm.ts_config_file, dm.gpus, generate_mar, debug)
 
@@ -168,7 +251,7 @@ def get_inference_internal(data_model, generate_mar, debug):
 
     # Use input provided mar if it exists
     input_mar = generated_mar_file if(generate_mar) else dm.mar_filepath
-    validate_inference_model(models_to_validate, input_mar, dm.model_name, generate_mar, debug)
+    validate_inference_model(models_to_validate, input_mar, dm.model_name, generate_mar, debug, dm)
 
 
 def get_inference_with_mar(data_model, debug=False):
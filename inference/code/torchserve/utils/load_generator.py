@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+import tsutils as ts
+
+PERCENTILES = [50, 90, 99, 99.9]
+LOAD_MODES = ["closed", "open", "trace", "ramp"]
+ARRIVALS = ["fixed", "poisson"]
+# latency at the end of a run over latency at its start above which the queue is taken to grow without bound
+DRIFT_LIMIT = 2.0
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list, None when it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(int(-(-len(sorted_values) * q // 100)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadStats(object):
+    """Latencies and failures of the measured requests of one model, safe to share between threads."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.latencies = []
+        self.sends = []
+        self.errors = 0
+        self.first_send = None
+        self.last_done = None
+        self._lock = threading.Lock()
+
+    def record(self, sent, done, ok):
+        with self._lock:
+            if ok:
+                self.latencies.append(done - sent)
+                self.sends.append(sent)
+            else:
+                self.errors += 1
+            self.first_send = sent if self.first_send is None else min(self.first_send, sent)
+            self.last_done = done if self.last_done is None else max(self.last_done, done)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        elapsed = (self.last_done - self.first_send) if self.latencies else 0.0
+        summary = {
+            "model_name": self.model_name,
+            "requests": len(latencies) + self.errors,
+            "errors": self.errors,
+            "elapsed_s": elapsed,
+            "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+            "max_ms": latencies[-1] * 1000 if latencies else None,
+        }
+        for q in PERCENTILES:
+            value = percentile(latencies, q)
+            summary[f"p{q:g}_ms"] = value * 1000 if value is not None else None
+        summary["latency_drift"] = self.drift()
+        return summary
+
+    def drift(self):
+        """Median latency of the last third of the requests, in send order, over the one of the first third."""
+        ordered = [latency for _, latency in sorted(zip(self.sends, self.latencies))]
+        third = len(ordered) // 3
+        if third == 0:
+            return None
+        first = sorted(ordered[:third])[third // 2]
+        last = sorted(ordered[-third:])[third // 2]
+        return last / first if first > 0 else None
+
+
+def format_summary(summary):
+    def ms(value):
+        return f"{value:.2f}" if value is not None else "-"
+
+    line = f"## {summary['model_name']}: {summary['requests']} requests, {summary['errors']} errors, "
+    if summary.get("offered_rps") is not None:
+        line += f"{summary['offered_rps']:.2f} req/sec offered, "
+    line += f"{summary['throughput_rps']:.2f} req/sec over {summary['elapsed_s']:.1f}s | latency ms mean {ms(summary['mean_ms'])}"
+    for q in PERCENTILES:
+        line += f", p{q:g} {ms(summary[f'p{q:g}_ms'])}"
+    line += f", max {ms(summary['max_ms'])}"
+    if summary.get("latency_drift") is not None and summary["latency_drift"] > DRIFT_LIMIT:
+        line += f" | latency grew {summary['latency_drift']:.1f}x during the run, the server queue is building up"
+    return line
+
+
+def send_request(model_name, input):
+    response = ts.run_inference(model_name, input, verbose=False)
+    return response is not None and response.status_code == 200
+
+
+def client_sender(client):
+    """send function of the load runs that goes through the given tsutils.InferenceClient."""
+    def send(model_name, input):
+        return client.predict(model_name, input).status_code == 200
+    return send
+
+
+def run_closed_loop(model_name, inputs, concurrency=1, duration=60, num_requests=0, warmup=10, send=send_request):
+    """Keeps concurrency requests in flight against the model and measures them after the warmup.
+
+    Every client thread sends its next request as soon as the previous one returns, cycling
+    through the inputs. Requests sent during the first warmup seconds are not measured. The
+    run ends after num_requests measured requests, or after duration measured seconds when
+    num_requests is 0.
+    """
+    stats = LoadStats(model_name)
+    lock = threading.Lock()
+    counters = {"next_input": 0, "measured": 0}
+    start = time.perf_counter()
+    measure_start = start + warmup
+    end = measure_start + duration
+
+    def take():
+        """Input of the next request and whether it is measured, None once the run is over."""
+        now = time.perf_counter()
+        with lock:
+            measured = now >= measure_start
+            if measured:
+                if num_requests > 0:
+                    if counters["measured"] >= num_requests:
+                        return None
+                    counters["measured"] += 1
+                elif now >= end:
+                    return None
+            input = inputs[counters["next_input"] % len(inputs)]
+            counters["next_input"] += 1
+            return input, measured
+
+    def client():
+        while True:
+            work = take()
+            if work is None:
+                return
+            input, measured = work
+            sent = time.perf_counter()
+            try:
+                ok = send(model_name, input)
+            except Exception:
+                ok = False
+            if measured:
+                stats.record(sent, time.perf_counter(), ok)
+
+    print(f"## Closed loop load on {model_name}: {concurrency} concurrent clients, {warmup}s warmup, "
+          + (f"{num_requests} requests" if num_requests > 0 else f"{duration}s") + "\n")
+    sys.stdout.flush()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.summary()
+
+
+def fixed_schedule(rate, seconds):
+    """Send offsets, in seconds from the start, of requests evenly spaced at rate per second."""
+    return [i / rate for i in range(int(seconds * rate))]
+
+
+def poisson_schedule(rate, seconds, seed=0):
+    """Send offsets of a Poisson arrival process with rate per second, exponential gaps."""
+    rng = random.Random(seed)
+    offsets = []
+    offset = rng.expovariate(rate)
+    while offset < seconds:
+        offsets.append(offset)
+        offset += rng.expovariate(rate)
+    return offsets
+
+
+def build_schedule(arrival, rate, seconds):
+    if arrival == "poisson":
+        return poisson_schedule(rate, seconds)
+    return fixed_schedule(rate, seconds)
+
+
+def parse_timestamp(value):
+    """Seconds from a number or numeric string (epoch seconds) or an ISO 8601 date."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def load_trace(trace_file, time_field="timestamp", speedup=1.0):
+    """(offset, input) pairs from a json lines trace, offsets relative to the first record.
+
+    Every line is a json object with a time_field. An "input" field names the file to send,
+    records without it send the next input of the run. speedup > 1 replays the trace faster.
+    """
+    records = []
+    with open(trace_file, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if time_field not in record:
+                raise ValueError(f"trace record without '{time_field}' field in {trace_file}: {line.strip()}")
+            records.append((parse_timestamp(record[time_field]), record.get("input")))
+    records.sort(key=lambda record: record[0])
+    first = records[0][0] if records else 0.0
+    return [((timestamp - first) / speedup, input) for timestamp, input in records]
+
+
+def run_open_loop(model_name, inputs, schedule, warmup=0, concurrency=64, send=send_request):
+    """Sends requests at the offsets of the schedule, whether or not earlier ones returned.
+
+    schedule holds send offsets in seconds, or (offset, input) pairs where input may be None.
+    Latency is measured from the scheduled send time, so a request the client could only send
+    late, because all concurrency client threads were busy, still counts the delay. Requests
+    scheduled in the first warmup seconds are not measured.
+    """
+    schedule = [item if isinstance(item, tuple) else (item, None) for item in schedule]
+    stats = LoadStats(model_name)
+    measured_offsets = [offset for offset, _ in schedule if offset >= warmup]
+
+    def request(scheduled, input, measured):
+        try:
+            ok = send(model_name, input)
+        except Exception:
+            ok = False
+        if measured:
+            stats.record(scheduled, time.perf_counter(), ok)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    start = time.perf_counter()
+    for i, (offset, input) in enumerate(schedule):
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        executor.submit(request, scheduled, input if input else inputs[i % len(inputs)], offset >= warmup)
+    executor.shutdown(wait=True)
+
+    summary = stats.summary()
+    span = (measured_offsets[-1] - warmup) if measured_offsets else 0.0
+    summary["offered_rps"] = len(measured_offsets) / span if span > 0 else None
+    return summary
+
+
+def find_knee(steps, min_goodput=0.9, latency_factor=0):
+    """The last ramp step before the server falls behind, None when even the first one does.
+
+    A step keeps up when it serves min_goodput of the offered rate and its latency does not
+    drift upwards, i.e. the server queue does not grow. Queueing makes tail latency rise well
+    before that, so a p99 limit of latency_factor times the p99 of the first step is only
+    applied when latency_factor is set.
+    """
+    knee = None
+    baseline = steps[0]["p99_ms"] if steps else None
+    for step in steps:
+        keeps_up = (step["offered_rps"] is not None and step["throughput_rps"] >= min_goodput * step["offered_rps"]
+                    and (step["latency_drift"] is None or step["latency_drift"] <= DRIFT_LIMIT))
+        if keeps_up and latency_factor > 0:
+            keeps_up = step["p99_ms"] is not None and baseline is not None and step["p99_ms"] <= latency_factor * baseline
+        if not keeps_up:
+            break
+        knee = step
+    return knee
+
+
+def run_ramp(model_name, inputs, rates, arrival="fixed", duration=60, warmup=10, concurrency=64, send=send_request, latency_factor=0):
+    """One open loop run per rate, in increasing order, and the knee of the latency-throughput curve.
+
+    The ramp stops early once the server serves less than half of the offered rate.
+    """
+    steps = []
+    for rate in sorted(rates):
+        print(f"## Open loop ramp on {model_name}: {rate} req/sec {arrival} arrivals, {warmup}s warmup, {duration}s \n")
+        sys.stdout.flush()
+        step = run_open_loop(model_name, inputs, build_schedule(arrival, rate, warmup + duration), warmup, concurrency, send)
+        step["target_rps"] = rate
+        print(format_summary(step), "\n")
+        steps.append(step)
+        if step["throughput_rps"] < 0.5 * rate:
+            print(f"## {model_name} serves less than half of {rate} req/sec, stopping the ramp \n")
+            break
+    return steps, find_knee(steps, latency_factor=latency_factor)
+
+
+def format_curve(steps, knee):
+    lines = [f"## LATENCY - THROUGHPUT {steps[0]['model_name'] if steps else ''}",
+             f"  {'offered':>10} {'served':>10} {'p50 ms':>10} {'p99 ms':>10} {'p99.9 ms':>10} {'errors':>8} {'drift':>6}"]
+    for step in steps:
+        lines.append(f"  {step['offered_rps'] or 0:>10.2f} {step['throughput_rps']:>10.2f} {step['p50_ms'] or 0:>10.2f} "
+                     f"{step['p99_ms'] or 0:>10.2f} {step['p99.9_ms'] or 0:>10.2f} {step['errors']:>8} "
+                     f"{step['latency_drift'] or 0:>6.2f}" + ("  <- knee" if step is knee else ""))
+    if knee is None:
+        lines.append("## No knee, the server fell behind at the lowest rate")
+    elif knee is steps[-1]:
+        lines.append(f"## No knee, the server kept up with every rate up to {knee['offered_rps']:.2f} req/sec, ramp higher")
+    else:
+        lines.append(f"## Knee at {knee['offered_rps']:.2f} req/sec offered, {knee['throughput_rps']:.2f} served, p99 {knee['p99_ms']:.2f} ms")
+    return "\n".join(lines)
+
+
+def save_report(summaries, output_file):
+    with open(output_file, 'w') as f:
+        json.dump(summaries, f, indent=4)
+    print(f"## Load report written to {output_file} \n")
@@ -2,7 +2,12 @@ import os
 import platform
 import sys
 import time
+import socket
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.filepost import encode_multipart_formdata
+from urllib3.util.retry import Retry
 import marsgen as mg
 import json
 
@@ -18,6 +23,98 @@ torch_model_archiver_command = {
         "Linux": "torch-model-archiver"
     }
 
+DEFAULT_POOL_SIZE = 128
+CLIENT_BACKENDS = ["http", "grpc"]
+client_backend = "http"
+
+
+class InferenceClient(object):
+    """TorchServe REST client with a pooled keep-alive session and payloads held in memory.
+
+    Every request reuses one of pool_size open connections per endpoint instead of a new TCP
+    connection, and an input file is read and encoded once, on its first request or with
+    preload(). Failed connections are retried up to retries times with exponential backoff,
+    requests the server answered are never retried so that their latency stays what it was.
+    The session is shared by all threads of the load generator.
+    """
+
+    def __init__(self, protocol="http", host="localhost", inference_port="8080", management_port="8081",
+            timeout=120, retries=3, backoff=0.1, pool_size=DEFAULT_POOL_SIZE):
+        self.inference_url = f"{protocol}://{host}:{inference_port}"
+        self.management_url = f"{protocol}://{host}:{management_port}"
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=backoff, allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.payloads = {}
+        self._lock = threading.Lock()
+
+    def payload(self, file_name):
+        """Multipart body and content type of the input file, the same "data" field run_inference always sent."""
+        payload = self.payloads.get(file_name)
+        if payload is None:
+            with open(file_name, "rb") as f:
+                payload = encode_multipart_formdata({"data": (file_name, f.read())})
+            with self._lock:
+                self.payloads[file_name] = payload
+        return payload
+
+    def preload(self, file_names):
+        for file_name in file_names:
+            self.payload(file_name)
+
+    def predict(self, model_name, file_name, timeout=None):
+        body, content_type = self.payload(file_name)
+        return self.session.post(f"{self.inference_url}/predictions/{model_name}", data=body,
+            headers={"Content-Type": content_type}, timeout=timeout or self.timeout)
+
+    def ping(self, timeout=None):
+        return self.session.get(f"{self.inference_url}/ping", timeout=timeout or self.timeout)
+
+    def register_model(self, params):
+        return self.session.post(f"{self.management_url}/models", params=params, verify=False)
+
+    def unregister_model(self, model_name):
+        return self.session.delete(f"{self.management_url}/models/{model_name}", verify=False)
+
+    def list_models(self):
+        return self.session.get(f"{self.management_url}/models", timeout=self.timeout)
+
+    def describe_model(self, model_name):
+        return self.session.get(f"{self.management_url}/models/{model_name}", timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+def set_client_backend(backend):
+    """Selects REST ("http") or gRPC ("grpc") for the calls made through get_client() and create_client()."""
+    global client_backend
+    client_backend = backend
+
+
+def create_client(protocol="http", host="localhost", inference_port="8080", management_port="8081", pool_size=DEFAULT_POOL_SIZE):
+    """A new client of the selected backend. The gRPC client talks to the grpc ports of config.properties."""
+    if client_backend == "grpc":
+        import grpc_client
+        return grpc_client.GrpcInferenceClient(host)
+    return InferenceClient(protocol, host, inference_port, management_port, pool_size=pool_size)
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(protocol="http", host="localhost", inference_port="8080", management_port="8081"):
+    """The shared client of the endpoints and the selected backend, created on first use."""
+    key = (client_backend, protocol, host, str(inference_port), str(management_port))
+    with clients_lock:
+        if key not in clients:
+            clients[key] = create_client(protocol, host, inference_port, management_port)
+        return clients[key]
+
+
 def generate_ts_start_cmd(ncs, model_store, models, config_file, log_file, log_config_file, gpus, debug):
     cmd = f"TS_NUMBER_OF_GPU={gpus} {torchserve_command[platform.system()]} --start --ncs --model-store={model_store}"
     if models:
@@ -54,7 +151,7 @@ def start_torchserve(gen_folder, ncs=False, model_store="model_store", models=""
 
 def stop_torchserve(wait_for=10):
     try:
-        requests.get('http://localhost:8080/ping')
+        get_client().ping()
     except Exception as e:
         return
 
@@ -70,6 +167,33 @@ def stop_torchserve(wait_for=10):
         return False
 
 
+def host_profile_path(hostname=None):
+    """Tuned registration settings of this host, written by the autotuner."""
+    dirpath = os.path.dirname(__file__)
+    return os.path.join(dirpath, '../models/profiles', f"{hostname or socket.gethostname()}.json")
+
+
+def load_host_profile(profile_path=None):
+    profile_path = profile_path or host_profile_path()
+    if not os.path.exists(profile_path):
+        return {}
+    with open(profile_path, 'r') as f:
+        return json.loads(f.read())
+
+
+def save_host_profile(model_name, entry, profile_path=None):
+    """Replaces the entry of the model in the host profile, entries of other models are kept."""
+    profile_path = profile_path or host_profile_path()
+    profile = load_host_profile(profile_path)
+    profile[model_name] = entry
+    os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+    tmp_path = f"{profile_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    os.replace(tmp_path, profile_path)
+    print(f"## Tuned settings of {model_name} written to {profile_path} \n")
+
+
 def get_params_for_registration(model_name):
     dirpath = os.path.dirname(__file__)
     initial_workers = batch_size = max_batch_delay = response_timeout = None
@@ -88,38 +212,51 @@ def get_params_for_registration(model_name):
             if "response_timeout" in model_config[model_name]:
                 response_timeout = model_config[model_name]['response_timeout']
 
+    # settings the autotuner picked on this host take precedence over models.json
+    tuned = load_host_profile().get(model_name, {})
+    initial_workers = tuned.get('initial_workers', initial_workers)
+    batch_size = tuned.get('batch_size', batch_size)
+    max_batch_delay = tuned.get('max_batch_delay', max_batch_delay)
+
     return initial_workers, batch_size, max_batch_delay, response_timeout
 
 
-def register_model(model_name, marfile, protocol="http", host="localhost", port="8081"):
+def register_model(model_name, marfile, protocol="http", host="localhost", port="8081", settings=None):
     print(f"\n## Registering {marfile} model \n")
     initial_workers, batch_size, max_batch_delay, response_timeout = get_params_for_registration(model_name)
+    if settings:
+        # explicit settings, e.g. of the autotuner, win over models.json and the host profile
+        initial_workers = settings.get('initial_workers', initial_workers)
+        batch_size = settings.get('batch_size', batch_size)
+        max_batch_delay = settings.get('max_batch_delay', max_batch_delay)
+        response_timeout = settings.get('response_timeout', response_timeout)
 
     params = (
         ("url", marfile),
-        ("initial_workers", initial_workers or 1),
-        ("batch_size", batch_size or 1),
-        ("max_batch_delay", max_batch_delay or 200),
-        ("response_timeout", response_timeout or 2000),
+        ("initial_workers", 1 if initial_workers is None else initial_workers),
+        ("batch_size", 1 if batch_size is None else batch_size),
+        # 0 is a valid max_batch_delay, only missing values get the defaults
+        ("max_batch_delay", 200 if max_batch_delay is None else max_batch_delay),
+        ("response_timeout", 2000 if response_timeout is None else response_timeout),
         ("synchronous", "true"),
     )
 
-    url = f"{protocol}://{host}:{port}/models"
-    response = requests.post(url, params=params, verify=False)
+    response = get_client(protocol, host, management_port=port).register_model(params)
     return response
 
 
-def run_inference(model_name, file_name, protocol="http", host="localhost", port="8080", timeout=120):
-    print(f"## Running inference on {model_name} model \n")
-    url = f"{protocol}://{host}:{port}/predictions/{model_name}"
-    files = {"data": (file_name, open(file_name, "rb"))}
-    response = requests.post(url, files=files, timeout=timeout)
-    print(response)
+def run_inference(model_name, file_name, protocol="http", host="localhost", port="8080", timeout=120, verbose=True):
+    verbose and print(f"## Running inference on {model_name} model \n")
+    response = get_client(protocol, host, inference_port=port).predict(model_name, file_name, timeout)
+    verbose and print(response)
     return response
 
 
 def unregister_model(model_name, protocol="http", host="localhost", port="8081"):
     print(f"## Unregistering {model_name} model \n")
-    url = f"{protocol}://{host}:{port}/models/{model_name}"
-    response = requests.delete(url, verify=False)
-    return response
\ No newline at end of file
+    response = get_client(protocol, host, management_port=port).unregister_model(model_name)
+    return response
+
+
+def list_models(protocol="http", host="localhost", port="8081"):
+    return get_client(protocol, host, management_port=port).list_models()
\ No newline at end of file
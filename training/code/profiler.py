@@ -1,5 +1,6 @@
 import os,sys
 import argparse
+import atexit
 import torch
 import torch.distributed as dist
 from torch.utils.data.distributed import DistributedSampler
@@ -19,14 +20,22 @@ import GPUtil
 import numpy as np
 import matplotlib.pyplot as plt
 import time
+import socket
 from datetime import datetime
 import multiprocessing
 from multiprocessing import Array
-from multiprocessing.managers import SyncManager
 from models.resnet34 import ResNet34, ResidualBlock
 from models.resnet50 import ResNet50, Bottleneck
-from utils.graph import save_time_series_plt
-from utils.monitor import monitor
+from utils.graph import MonitorPlotter, load_monitor_csv, save_cluster_plt
+from utils.monitor import MONITOR_FILE, monitor
+from utils.io_stats import IO_COLUMNS, detect_starvation
+from utils.telemetry import TelemetryCollector
+from utils.sample_cache import SharedSampleCache, cache_path, create_cache, local_world_size, remove_cache
+from utils.file_index import default_index_file, get_index, image_folder
+from utils.step_timer import StepTimer, timed_hook, DATA_WAIT, H2D, FORWARD, BACKWARD, OPTIMIZER
+from utils.torch_profile import TorchProfile
+
+script_start_time = time.time()
 
 def set_random_seeds(random_seed=0):
     # pytorch random number generator is made deterministic
@@ -44,7 +53,10 @@ def set_random_seeds(random_seed=0):
 def init_backend_processes(backend):
     global_rank = int(os.environ["OMPI_COMM_WORLD_RANK"])
     world_size = int(os.environ["OMPI_COMM_WORLD_SIZE"])
-    dist.init_process_group(rank = global_rank, world_size=world_size ,backend="nccl", timeout=timedelta(seconds=15))
+    if torch.cuda.is_available():
+        dist.init_process_group(rank = global_rank, world_size=world_size ,backend="nccl", timeout=timedelta(seconds=15))
+    else:
+        dist.init_process_group(rank = global_rank, world_size=world_size ,backend="gloo", timeout=timedelta(seconds=15))
 
 def train(argv):
     print("TRAINING STARTED")
@@ -77,12 +89,32 @@ def train(argv):
         std=[0.2023, 0.1994, 0.2010],
     )
 
+    index = None
+    if argv.dataset_index:
+        index = get_index(datasetFolder, argv.index_file or default_index_file(argv.output_folder), int(os.environ["OMPI_COMM_WORLD_RANK"]), device)
+
     # 37 gb dataset -> '/nfs/datasets/ILSVRC2014_DET_train', 200gb -> '/nfs/datasets/ILSVRC'
-    train_dataset = tv.datasets.ImageFolder(datasetFolder, transform=transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        normalize,
-    ]))
+    if argv.cache_budget_gb > 0:
+        path = cache_path(argv.cache_dir, datasetFolder)
+        resized_dataset = image_folder(datasetFolder, transform=transforms.Resize((224, 224)), index=index)
+        local_size = local_world_size()
+        if local_rank >= local_size:
+            raise RuntimeError(f"local rank {local_rank} on a node with {local_size} local ranks, set LOCAL_WORLD_SIZE")
+        if local_rank == 0:
+            create_cache(path, len(resized_dataset), int(argv.cache_budget_gb * 2**30),
+                         num_clients=local_size * (workers + 1))
+            atexit.register(remove_cache, path)
+        dist.barrier()
+        train_dataset = SharedSampleCache(resized_dataset, path, transform=transforms.Compose([
+            transforms.ToTensor(),
+            normalize,
+        ]), client=local_rank, clients_per_rank=workers + 1)
+    else:
+        train_dataset = image_folder(datasetFolder, transform=transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            normalize,
+        ]), index=index)
 
 
     cls_to_label_map = {}
@@ -111,8 +143,12 @@ def train(argv):
     else:
         raise AssertionError("Wrong resnet type")
 
-    ddp_model = nn.parallel.DistributedDataParallel(
-        model, device_ids=[local_rank], output_device=local_rank)
+    if torch.cuda.is_available():
+        ddp_model = nn.parallel.DistributedDataParallel(
+            model, device_ids=[local_rank], output_device=local_rank)
+    else:
+        ddp_model = nn.parallel.DistributedDataParallel(
+            model, device_ids=None, output_device=None)
     train_sampler = DistributedSampler(dataset=train_dataset)
     train_dl = dl(train_dataset, batch_size=batch_size, sampler=train_sampler, num_workers=workers, multiprocessing_context="spawn", prefetch_factor=pf) #
 
@@ -121,8 +157,17 @@ def train(argv):
     optimizer = torch.optim.SGD(
         model.parameters(), lr=learning_rate, weight_decay=0.001, momentum=0.9)
 
+    step_timer = StepTimer(output_folder, int(os.environ["OMPI_COMM_WORLD_RANK"]), sync_cuda=argv.step_timing_sync, enabled=argv.step_timing)
+    if argv.step_timing:
+        ddp_model.register_comm_hook(None, timed_hook(step_timer))
+
+    torch_profile = TorchProfile(output_folder, int(os.environ["OMPI_COMM_WORLD_RANK"]), skip_first=argv.profile_skip_first,
+                                 wait=argv.profile_wait, warmup=argv.profile_warmup, active=argv.profile_active,
+                                 repeat=argv.profile_repeat, enabled=argv.torch_profile)
+
     # Train the model
     start_time = datetime.fromtimestamp(datetime.now().timestamp())
+    torch_profile.start()
     if nvtx_profile:
         torch.cuda.cudart().cudaProfilerStart()
         for epoch in range(num_epochs):
@@ -130,13 +175,18 @@ def train(argv):
             # print("TIME",datetime.now().strftime("%Y-%m-%d-%H:%M:%S"))
 
             nvtx.range_push("DATA LOADING")
+            step_timer.start(epoch)
             for i, (images, labels) in enumerate(train_dl):
                 nvtx.range_pop()
+                step_timer.mark(DATA_WAIT)
+                if epoch == 0 and i == 0:
+                    print(f"Time to first batch {time.time() - script_start_time:.2f}s")
                 nvtx.range_push(f"batch-{i}")
                 # Move tensors to the configured device
                 nvtx.range_push("COPY TO DEVICE")
                 images = images.to(device)
                 labels = labels.to(device)
+                step_timer.mark(H2D)
                 nvtx.range_pop()
 
                 nvtx.range_push("FORWARD PASS")
@@ -146,12 +196,17 @@ def train(argv):
                 # print(labels, labels.shape)
                 loss = criterion(outputs, labels)
                 optimizer.zero_grad()
+                step_timer.mark(FORWARD)
                 nvtx.range_pop()
 
                 nvtx.range_push("BACKWARD PASS")
                 # Backward and optimize
                 loss.backward()
+                step_timer.mark(BACKWARD)
                 optimizer.step()
+                step_timer.mark(OPTIMIZER)
+                step_timer.end_step()
+                torch_profile.step()
                 nvtx.range_pop()
                 # del images, labels, outputs
                 # torch.cuda.empty_cache()
@@ -163,33 +218,53 @@ def train(argv):
             torch.cuda.cudart().cudaProfilerStop()
             print('Epoch [{}/{}], Loss: {:.4f}'
                 .format(epoch+1, num_epochs, loss.item()))
+            if isinstance(train_dataset, SharedSampleCache) and local_rank == 0:
+                train_dataset.print_report(epoch)
     else:
         for epoch in range(num_epochs):
             print("EPOCH", epoch)
             # print("TIME",datetime.now().strftime("%Y-%m-%d-%H:%M:%S"))
 
+            step_timer.start(epoch)
             for i, (images, labels) in enumerate(train_dl):
+                step_timer.mark(DATA_WAIT)
+                if epoch == 0 and i == 0:
+                    print(f"Time to first batch {time.time() - script_start_time:.2f}s")
                 # Move tensors to the configured device
                 images = images.to(device)
                 labels = labels.to(device)
+                step_timer.mark(H2D)
                 # Forward pass
                 outputs = ddp_model(images)
                 # print(outputs.min(), outputs.max(), outputs.shape)
                 # print(labels, labels.shape)
                 loss = criterion(outputs, labels)
                 optimizer.zero_grad()
+                step_timer.mark(FORWARD)
                 # Backward and optimize
                 loss.backward()
+                step_timer.mark(BACKWARD)
                 optimizer.step()
+                step_timer.mark(OPTIMIZER)
+                step_timer.end_step()
+                torch_profile.step()
                 # del images, labels, outputs
                 # torch.cuda.empty_cache()
                 # gc.collect()
 
             print('Epoch [{}/{}], Loss: {:.4f}'
                 .format(epoch+1, num_epochs, loss.item()))
+            if isinstance(train_dataset, SharedSampleCache) and local_rank == 0:
+                train_dataset.print_report(epoch)
+    torch_profile.stop()
     end_time = datetime.fromtimestamp(datetime.now().timestamp())
     print("Total training time",end_time - start_time)
+    step_timer.close()
     torch.save(ddp_model.state_dict(), model_filepath)
+    if isinstance(train_dataset, SharedSampleCache):
+        dist.barrier()
+        if local_rank == 0:
+            remove_cache(train_dataset.path)
 
 
 if __name__ == '__main__':
@@ -210,6 +285,29 @@ if __name__ == '__main__':
     
     parser.add_argument("--profile", help="generate nvtx profiler result", action=argparse.BooleanOptionalAction, default=False)
 
+    parser.add_argument("--torch_profile", help="profile a few scheduled steps with torch.profiler and export chrome traces", action=argparse.BooleanOptionalAction, default=False)
+
+    parser.add_argument("--profile_skip_first", type=int, help="steps before the first torch.profiler window", default=10)
+
+    parser.add_argument("--profile_wait", type=int, help="idle steps at the start of every torch.profiler window", default=5)
+
+    parser.add_argument("--profile_warmup", type=int, help="traced but discarded steps of every torch.profiler window", default=2)
+
+    parser.add_argument("--profile_active", type=int, help="recorded steps of every torch.profiler window", default=3)
+
+    parser.add_argument("--profile_repeat", type=int, help="number of torch.profiler windows, 0 repeats until the end of training", default=1)
+
+    parser.add_argument("--monitor_interval", type=float, help="resource monitor sampling interval in seconds", default=15)
+
+
+    parser.add_argument("--plot_refresh", type=float, help="re-render monitor.jpg every N seconds while training, 0 only renders it at the end", default=0)
+
+    parser.add_argument("--cluster_telemetry", help="push the monitor samples of every node to rank 0 and write one merged report", action=argparse.BooleanOptionalAction, default=False)
+
+    parser.add_argument("--telemetry_port", type=int, help="port of the telemetry collector on MASTER_ADDR", default=29600)
+
+    parser.add_argument("--starvation_threshold", type=float, help="share of a monitor interval spent waiting for data above which it is flagged as starved (needs --step_timing)", default=0.3)
+
     parser.add_argument("--output_folder", type=str, help="output folder", default="training_results", required=True)
 
     parser.add_argument("--resnet", type=int, help = "resnet type", default=50 )
@@ -220,6 +318,18 @@ if __name__ == '__main__':
 
     parser.add_argument("--dataset", type=str, help="train dataset", default='/nfs/datasets/ILSVRC/Data/CLS-LOC/train' )
 
+    parser.add_argument("--dataset_index", help="build the dataset from a cached file index instead of scanning the class tree", action=argparse.BooleanOptionalAction, default=False)
+
+    parser.add_argument("--index_file", type=str, help="dataset index file (default: <output_folder>/.dataset_index.json)", default="")
+
+    parser.add_argument("--step_timing", help="record data wait, copy, forward, backward, optimizer and all-reduce time of every step", action=argparse.BooleanOptionalAction, default=False)
+
+    parser.add_argument("--step_timing_sync", help="synchronize CUDA at every phase boundary for exact GPU attribution (slower)", action=argparse.BooleanOptionalAction, default=False)
+
+    parser.add_argument("--cache_budget_gb", type=float, help="node-shared decoded sample cache size in GB, 0 disables the cache", default=0)
+
+    parser.add_argument("--cache_dir", type=str, help="folder for the node-shared sample cache file", default="/dev/shm")
+
     if dist.is_available():
         parser.add_argument('--backend', type=str, help='Distributed backend',
                             choices=[dist.Backend.GLOO,
@@ -228,23 +338,44 @@ if __name__ == '__main__':
     argv = parser.parse_args()
     Path(argv.output_folder).mkdir(parents=True, exist_ok=True)
     multiprocessing.set_start_method("spawn")
-    manager = SyncManager()
-    manager.start()
-    dates = manager.list([])
     gpus = GPUtil.getGPUs()
-    gpu_usages = manager.list([ manager.list([]) for gpu in gpus])
-    cpu_usages = manager.list([])
-    mem_usages = manager.list([])
-    m1 = multiprocessing.Process(target=monitor, args=(dates,gpu_usages, cpu_usages, mem_usages, argv.output_folder))
+    stop_monitor = multiprocessing.Event()
+    collector = None
+    pusher_address = None
+    if argv.cluster_telemetry:
+        if int(os.environ["OMPI_COMM_WORLD_RANK"]) == 0:
+            num_nodes = int(os.environ["OMPI_COMM_WORLD_SIZE"]) // int(os.environ["OMPI_COMM_WORLD_LOCAL_SIZE"])
+            collector = TelemetryCollector(argv.telemetry_port, num_nodes, argv.output_folder)
+        # one sampler per node is enough, every rank of a node sees the same machine
+        if int(os.environ["OMPI_COMM_WORLD_LOCAL_RANK"]) == 0:
+            pusher_address = (os.environ.get("MASTER_ADDR", "localhost"), argv.telemetry_port, socket.gethostname())
+    m1 = multiprocessing.Process(target=monitor, args=(argv.output_folder, argv.monitor_interval, os.getpid(), len(gpus), stop_monitor, argv.dataset, pusher_address))
     t1 = multiprocessing.Process(target=train,args=(argv,))
+    plotter = MonitorPlotter(os.path.join(argv.output_folder, MONITOR_FILE))
     m1.start()
     t1.start()
+    if argv.plot_refresh > 0:
+        while t1.is_alive():
+            t1.join(argv.plot_refresh)
+            plotter.update()
+            plotter.render(f"monitor.jpg", argv.output_folder)
     t1.join()
     print("TRAINING DONE")
-    m1.terminate()
-    # print("CONTENT", dates, gpu_usages[0])
-    save_time_series_plt(dates,gpu_usages,f"gpu.jpg", argv.output_folder)
-    save_time_series_plt(dates,cpu_usages,f"cpu.jpg", argv.output_folder)  
-    save_time_series_plt(dates,mem_usages,f"mem.jpg", argv.output_folder)  
-    manager.shutdown()
+    stop_monitor.set()
+    m1.join()
+    plotter.update()
+    plotter.render(f"monitor.jpg", argv.output_folder)
+    # the charts come from the bounded summary of the plotter, only the starvation check reads its columns in full
+    plotter.render_columns([f"gpu{i}" for i in range(len(gpus))], f"gpu.jpg", argv.output_folder)
+    for column, name in (("cpu", "cpu"), ("mem", "mem"), ("proc_cpu", "proc_cpu"), ("proc_rss_mb", "proc_rss")):
+        plotter.render_columns([column], f"{name}.jpg", argv.output_folder)
+    usage = load_monitor_csv(os.path.join(argv.output_folder, MONITOR_FILE), IO_COLUMNS)
+    starvation = detect_starvation(usage, argv.output_folder, int(os.environ["OMPI_COMM_WORLD_RANK"]), argv.starvation_threshold)
+    plotter.render_io(starvation, f"io.jpg", argv.output_folder)
+    if collector is not None:
+        # the other nodes finish training at the same time, give their last samples a moment
+        collector.wait(timeout=max(60, 4 * argv.monitor_interval))
+        grid, series = collector.report(argv.monitor_interval)
+        save_cluster_plt(grid, series, f"cluster.jpg", argv.output_folder)
+        collector.close()
     sys.exit()
@@ -1,5 +1,7 @@
 import os,sys
 import argparse
+import atexit
+import contextlib
 import torch
 import torch.distributed as dist
 from torch.utils.data.distributed import DistributedSampler
@@ -17,7 +19,22 @@ import multiprocessing
 from multiprocessing import Array
 from multiprocessing.managers import SyncManager
 from torchvision import models
+from utils.packed import PackedDataset
+from utils.sample_cache import SharedSampleCache, cache_path, create_cache, local_world_size, remove_cache
+from utils.pipeline import DeviceNormalize, ToFloatTensor, ToUint8Tensor, uint8_collate
+from utils.file_index import default_index_file, get_index, image_folder, list_classes
+from utils.decode import DECODERS, get_loader, get_resize
+from utils.loader_bench import benchmark_loader, parse_grid
+from utils.synthetic import SyntheticLoader
+from utils.step_timer import StepTimer, timed_hook, DATA_WAIT, H2D, FORWARD, BACKWARD, OPTIMIZER
+from utils.perf import AMP_DTYPES, PerfMode
+from utils.samplers import SAMPLERS, build_sampler
+from utils.staging import StagedLoader, stage_root, start_staging
+from utils.affinity import apply_rank_affinity, loader_worker_init
+from utils.checkpoint import AsyncCheckpointer, latest_checkpoint, load_checkpoint
+from utils.ddp import COMM_HOOKS, accumulation_window, build_optimizer, get_comm_hook, optimizer_state_bytes, peak_memory_bytes, wrap_model
 
+script_start_time = time.time()
 global_rank = int(os.environ["OMPI_COMM_WORLD_RANK"]) if "OMPI_COMM_WORLD_RANK" in os.environ  else int(os.environ["RANK"])
 
 def set_random_seeds(random_seed=0):
@@ -41,6 +58,78 @@ def init_backend_processes(backend):
         dist.init_process_group(rank = global_rank, world_size=world_size ,backend="gloo", timeout=timedelta(seconds=15))
 
 
+def get_train_dataset(argv, global_rank, local_rank, device, sample_transforms):
+    # sample_transforms turn a resized image into the tensor handed to the collate function
+    dataset_folder = argv.data_folder
+    if argv.data_format == "packed":
+        # packed shards are already resized to 224x224
+        return PackedDataset(dataset_folder, transform=transforms.Compose(sample_transforms), image_size=224)
+
+    index = None
+    if argv.dataset_index:
+        index = get_index(dataset_folder, argv.index_file or default_index_file(argv.output_folder), global_rank, device)
+
+    if argv.cache_budget_gb > 0:
+        # resized uint8 images are shared by all ranks and workers of the node, the rest runs per sample
+        path = cache_path(argv.cache_dir, dataset_folder)
+        resized_dataset = image_folder(dataset_folder, transform=get_resize(argv.decoder), index=index,
+                                       loader=get_image_loader(argv))
+        # one stats row per process, --benchmark-loader may sweep beyond --workers
+        clients_per_rank = max(parse_grid(argv.sweep_workers, argv.workers)) + 1
+        local_size = local_world_size()
+        if local_rank >= local_size:
+            raise RuntimeError(f"local rank {local_rank} on a node with {local_size} local ranks, set LOCAL_WORLD_SIZE")
+        if local_rank == 0:
+            num_slots = create_cache(path, len(resized_dataset), int(argv.cache_budget_gb * 2**30),
+                                     num_clients=local_size * clients_per_rank)
+            # the segment outlives the processes otherwise, also when training fails
+            atexit.register(remove_cache, path)
+            print(f"SAMPLE CACHE {path} WITH {num_slots} SLOTS FOR {len(resized_dataset)} SAMPLES")
+        dist.barrier()
+        return SharedSampleCache(resized_dataset, path, transform=transforms.Compose(sample_transforms),
+                                 client=local_rank, clients_per_rank=clients_per_rank)
+
+    preprocess = transforms.Compose([
+        get_resize(argv.decoder),
+    ] + sample_transforms)
+
+    return image_folder(dataset_folder, transform=preprocess, index=index, loader=get_image_loader(argv))
+
+
+def get_image_loader(argv):
+    loader = get_loader(argv.decoder)
+    if argv.stage_dir:
+        # reads the node-local copy of every file that is already staged
+        loader = StagedLoader(loader, argv.data_folder, stage_root(argv.stage_dir, argv.data_folder))
+    return loader
+
+
+def get_train_loader(train_dataset, train_sampler, batch_size, workers, pf, persistent_workers=False, collate_fn=None):
+    kwargs = {}
+    if workers > 0:
+        # only valid together with worker processes
+        kwargs["prefetch_factor"] = pf
+        if persistent_workers:
+            kwargs["persistent_workers"] = True
+    return dl(train_dataset, batch_size=batch_size, sampler=train_sampler, num_workers=workers, pin_memory=True,
+              collate_fn=collate_fn, worker_init_fn=loader_worker_init(), **kwargs)
+
+
+def run_loader_benchmark(argv, global_rank, train_dataset, train_sampler, collate_fn):
+    grid = {
+        "batch_size": parse_grid(argv.sweep_batch_size, argv.batch_size),
+        "workers": parse_grid(argv.sweep_workers, argv.workers),
+        "pf": parse_grid(argv.sweep_pf, argv.pf),
+        "persistent_workers": parse_grid(argv.sweep_persistent_workers, int(argv.persistent_workers)),
+    }
+
+    def build_loader(batch_size, workers, pf, persistent_workers):
+        return get_train_loader(train_dataset, train_sampler, batch_size, workers, pf, persistent_workers, collate_fn)
+
+    benchmark_loader(build_loader, grid, argv.benchmark_batches, argv.benchmark_epochs,
+                     set_epoch=train_sampler.set_epoch, rank=global_rank)
+
+
 def train(argv):
     global_rank = int(os.environ["OMPI_COMM_WORLD_RANK"]) if "OMPI_COMM_WORLD_RANK" in os.environ  else int(os.environ["RANK"])
     local_rank = int(os.environ['OMPI_COMM_WORLD_LOCAL_RANK']) if 'OMPI_COMM_WORLD_LOCAL_RANK' in os.environ else (int(os.environ["LOCAL_RANK"]) if "LOCAL_RANK" in os.environ else 0)
@@ -57,6 +146,8 @@ def train(argv):
     model_filename = argv.output_model_file
     model_filepath = os.path.join(output_folder, model_filename)
 
+    # thread pools have to be sized before the first parallel op
+    apply_rank_affinity(global_rank)
     set_random_seeds(random_seed=random_seed)
     print("TRYING TO INITIALIZE BACKEND")
     init_backend_processes(backend)
@@ -65,19 +156,45 @@ def train(argv):
     device = torch.device(
         f'cuda:{local_rank}' if torch.cuda.is_available() else 'cpu')
     print(device, 'DEVICE')
+    perf = PerfMode(device, argv.perf_mode, argv.amp_dtype, argv.compile)
+    perf.relax_determinism()
+    print(f"COMPUTE MODE for node - {global_rank} {perf.describe()}")
 
-    normalize = transforms.Normalize(
-        mean=[0.4914, 0.4822, 0.4465],
-        std=[0.2023, 0.1994, 0.2010],
-    )
+    mean = [0.4914, 0.4822, 0.4465]
+    std = [0.2023, 0.1994, 0.2010]
+    if argv.uint8_transport:
+        # workers only ship uint8 pixels, normalization runs once per batch on the device
+        sample_transforms = [ToUint8Tensor()]
+        collate_fn = uint8_collate
+        device_normalize = DeviceNormalize(mean, std, device)
+    else:
+        normalize = transforms.Normalize(mean=mean, std=std)
+        to_tensor = ToFloatTensor() if argv.decoder == "torchvision" else transforms.ToTensor()
+        sample_transforms = [to_tensor, normalize]
+        collate_fn = None
+        device_normalize = None
 
-    preprocess = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        normalize,
-    ])
+    stager = None
+    if argv.synthetic:
+        # same shape and class count as the real dataset, without any input pipeline
+        train_dataset = None
+        train_sampler = None
+        num_classes = len(list_classes(dataset_folder)) or 1000
+        print(f"SYNTHETIC DATA WITH {num_classes} CLASSES, {argv.synthetic_steps} STEPS PER EPOCH")
+    else:
+        dataset_start = time.time()
+        train_dataset = get_train_dataset(argv, global_rank, local_rank, device, sample_transforms)
+        print(f"Dataset with {len(train_dataset)} samples built in {time.time() - dataset_start:.2f}s on node - {global_rank}")
+        train_sampler = build_sampler(argv.sampler, train_dataset, local_world_size(), argv.exchange_fraction)
+        if argv.stage_dir and argv.data_format == "imagefolder":
+            stager = start_staging(train_dataset, train_sampler, dataset_folder, stage_root(argv.stage_dir, dataset_folder),
+                                   argv.stage_workers, global_rank)
 
-    train_dataset = tv.datasets.ImageFolder(dataset_folder, transform=preprocess)
+    if argv.benchmark_loader:
+        run_loader_benchmark(argv, global_rank, train_dataset, train_sampler, collate_fn)
+        release_train_dataset(train_dataset, local_rank)
+        release_stage(stager, argv.stage_keep, local_rank)
+        return
 
     if model_type == "resnet34":
         model = models.resnet34().to(device) 
@@ -85,42 +202,197 @@ def train(argv):
         model = models.resnet50().to(device) 
     else:
         raise AssertionError("Wrong resnet type")
+    model = perf.prepare_model(model)
 
-    if torch.cuda.is_available():
-        ddp_model = nn.parallel.DistributedDataParallel(
-            model, device_ids=[local_rank], output_device=local_rank)
-    else:
-        ddp_model = nn.parallel.DistributedDataParallel(
-            model, device_ids=None, output_device=None)
+    ddp_model = wrap_model(model, argv.bucket_cap_mb, argv.gradient_as_bucket_view, argv.static_graph)
 
-    train_sampler = DistributedSampler(dataset=train_dataset)
-    train_dl = dl(train_dataset, batch_size=batch_size, sampler=train_sampler, num_workers=workers, prefetch_factor=pf, pin_memory=True)
+    if argv.synthetic:
+        train_dl = SyntheticLoader(batch_size, num_classes, argv.synthetic_steps, device, uint8=argv.uint8_transport)
+    else:
+        train_dl = get_train_loader(train_dataset, train_sampler, batch_size, workers, pf, argv.persistent_workers, collate_fn)
 
     # Loss and optimizer
     criterion = nn.CrossEntropyLoss()
-    optimizer = torch.optim.SGD(
-        model.parameters(), lr=learning_rate, weight_decay=0.001, momentum=0.9)
+    optimizer = build_optimizer(model.parameters(), learning_rate, argv.zero)
+
+    step_timer = StepTimer(output_folder, global_rank, sync_cuda=argv.step_timing_sync, enabled=argv.step_timing)
+    # DDP accepts a single comm hook, the timing wraps the selected one
+    hook_state, comm_hook, wire_bytes = get_comm_hook(argv.comm_hook, argv.powersgd_rank, argv.powersgd_start_iter)
+    if argv.step_timing:
+        ddp_model.register_comm_hook(hook_state, timed_hook(step_timer, comm_hook, wire_bytes))
+    elif argv.comm_hook != "allreduce":
+        ddp_model.register_comm_hook(hook_state, comm_hook)
+    accumulation = argv.grad_accumulation
+
+    checkpointer = AsyncCheckpointer(output_folder, global_rank, argv.checkpoint_steps, argv.checkpoint_minutes, argv.checkpoint_keep)
+    start_epoch, start_batch, global_step = 0, 0, 0
+    if argv.resume:
+        resume_path = resolve_resume(argv.resume, output_folder, global_rank, device)
+        if resume_path is None:
+            print(f"No checkpoint in {output_folder}, starting from scratch")
+        else:
+            checkpoint = load_resume_checkpoint(resume_path, device, global_rank)
+            ddp_model.module.load_state_dict(checkpoint["model"])
+            # ZeroRedundancyOptimizer takes the consolidated state and keeps its own shard
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            if perf.scaler is not None and checkpoint["scaler"] is not None:
+                perf.scaler.load_state_dict(checkpoint["scaler"])
+            # the position of rank 0, so that every rank runs the same steps and collectives
+            position = torch.tensor([checkpoint["epoch"], checkpoint["batch"], checkpoint["step"]], device=device)
+            dist.broadcast(position, 0)
+            start_epoch, start_batch, global_step = position.tolist()
+            if train_sampler is not None:
+                # every rank consumed the same number of batches of its own shard
+                train_sampler.set_start(start_batch * batch_size)
+            del checkpoint
+    # the compiled module shares its parameters with ddp_model, which is still the one saved
+    train_model = perf.compile(ddp_model)
 
     # Train the model
     start_time = datetime.fromtimestamp(datetime.now().timestamp())
+    total_images = 0
 
-    for epoch in range(num_epochs):
+    for epoch in range(start_epoch, num_epochs):
+        epoch_start = time.time()
+        epoch_images = 0
+        batch_offset = start_batch if epoch == start_epoch else 0
+        if argv.sampler == "locality" and train_sampler is not None:
+            # the default sampler keeps its epoch 0 order, as it always did
+            train_sampler.set_epoch(epoch)
+        steps_per_epoch = len(train_dl)
+        step_timer.start(epoch)
         for i, (images, labels) in enumerate(train_dl):
+            step_timer.mark(DATA_WAIT)
+            if epoch == 0 and i == 0:
+                print(f"Time to first batch for node - {global_rank} {time.time() - script_start_time:.2f}s")
+            epoch_images += images.size(0)
             # Move tensors to the configured device
             images = images.to(device, non_blocking=True)
             labels = labels.to(device, non_blocking=True)
-            # Forward pass
-            outputs = ddp_model(images)
-            loss = criterion(outputs, labels)
-
-            optimizer.zero_grad(set_to_none=True)
-            # Backward and optimize
-            loss.backward()
-            optimizer.step()
+            if device_normalize is not None:
+                images = device_normalize(images)
+            images = perf.prepare_input(images)
+            step_timer.mark(H2D)
+            # gradients are only all-reduced on the last micro-batch of an accumulation window
+            # windows follow the position in the epoch, so a resumed epoch keeps them
+            sync = (batch_offset + i + 1) % accumulation == 0 or i + 1 == steps_per_epoch
+            with contextlib.nullcontext() if sync else ddp_model.no_sync():
+                # Forward pass
+                with perf.autocast():
+                    outputs = train_model(images)
+                    loss = criterion(outputs, labels)
+                    if accumulation > 1:
+                        # the mean over the micro-batches of the window, also when the last one is shorter
+                        loss = loss / accumulation_window(batch_offset + i, accumulation, batch_offset + steps_per_epoch)
+                step_timer.mark(FORWARD)
+
+                if (batch_offset + i) % accumulation == 0:
+                    optimizer.zero_grad(set_to_none=True)
+                # Backward and optimize
+                perf.backward(loss)
+                step_timer.mark(BACKWARD)
+            if sync:
+                perf.step(optimizer)
+                global_step += 1
+            step_timer.mark(OPTIMIZER)
+            if sync and checkpoint_due(checkpointer, global_step, argv.zero, device):
+                # outside the step phases, the stall is reported by the checkpointer
+                position = (epoch, batch_offset + i + 1, batch_offset + steps_per_epoch)
+                checkpointer.save(global_step, lambda: checkpoint_state(ddp_model, optimizer, perf, global_step, position, argv.zero, global_rank))
+            step_timer.end_step()
+        total_images += epoch_images
+        if isinstance(train_dataset, SharedSampleCache) and local_rank == 0:
+            train_dataset.print_report(epoch)
+        print(f"Epoch {epoch} throughput for node - {global_rank} {epoch_images / (time.time() - epoch_start):.2f} images/sec")
+        if stager is not None and not stager.done():
+            print(stager.report())
     end_time = datetime.fromtimestamp(datetime.now().timestamp())
     print(f"Total training time for node - {global_rank}",end_time - start_time)
+    print(f"Throughput for node - {global_rank} {total_images / (end_time - start_time).total_seconds():.2f} images/sec")
+    print(f"Peak memory for node - {global_rank} {peak_memory_bytes(device) / 2**20:.1f} MB, "
+          f"optimizer state {optimizer_state_bytes(optimizer) / 2**20:.1f} MB")
+    step_timer.close()
+    checkpointer.close()
+    if argv.zero:
+        # collective, every rank sends its shard of the optimizer state to rank 0
+        optimizer.consolidate_state_dict(to=0)
     if global_rank == 0:
         torch.save(ddp_model.module.state_dict(), model_filepath)
+        if argv.zero:
+            torch.save(optimizer.state_dict(), os.path.splitext(model_filepath)[0] + "_optimizer.pth")
+    release_train_dataset(train_dataset, local_rank)
+    release_stage(stager, argv.stage_keep, local_rank)
+
+
+def resolve_resume(resume, output_folder, global_rank, device):
+    """The checkpoint path of rank 0, the output folder does not have to be shared."""
+    path = [None]
+    if global_rank == 0:
+        path[0] = latest_checkpoint(output_folder) if resume == "latest" else resume
+    dist.broadcast_object_list(path, 0, device=device)
+    return path[0]
+
+
+def load_resume_checkpoint(path, device, global_rank):
+    """Loads the checkpoint on every rank, all ranks fail together when any of them cannot."""
+    checkpoint = None
+    try:
+        checkpoint = load_checkpoint(path, device)
+    except Exception as e:
+        print(f"Cannot load checkpoint {path} on node - {global_rank}: {e}")
+        sys.stdout.flush()
+    loaded = torch.tensor([int(checkpoint is not None)], device=device)
+    dist.all_reduce(loaded, op=dist.ReduceOp.MIN)
+    if not loaded.item():
+        raise RuntimeError(f"Checkpoint {path} could not be loaded on every rank, is the output folder shared by all nodes?")
+    return checkpoint
+
+
+def checkpoint_due(checkpointer, step, zero, device):
+    due = checkpointer.due(step)
+    if zero and checkpointer.every_seconds:
+        # the optimizer consolidation is collective, every rank follows the clock of rank 0
+        flag = torch.tensor([int(due)], device=device)
+        dist.broadcast(flag, 0)
+        due = bool(flag.item())
+    return due
+
+
+def checkpoint_state(ddp_model, optimizer, perf, step, position, zero, global_rank):
+    if zero:
+        optimizer.consolidate_state_dict(to=0)
+    if global_rank != 0:
+        return None
+    epoch, batch, epoch_batches = position
+    if batch == epoch_batches:
+        # resume at the start of the next epoch
+        epoch, batch = epoch + 1, 0
+    return {
+        "model": ddp_model.module.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scaler": perf.scaler.state_dict() if perf.scaler is not None else None,
+        "epoch": epoch,
+        "batch": batch,
+        "step": step,
+    }
+
+
+def release_train_dataset(train_dataset, local_rank):
+    if isinstance(train_dataset, SharedSampleCache):
+        dist.barrier()
+        if local_rank == 0:
+            remove_cache(train_dataset.path)
+
+
+def release_stage(stager, keep, local_rank):
+    """Stops the copies, and unless keep removes the stage folder once no rank of the node reads it."""
+    if stager is None:
+        return
+    stager.stop()
+    if not keep:
+        dist.barrier()
+        if local_rank == 0:
+            stager.remove()
 
 
 if __name__ == '__main__':
@@ -140,9 +412,71 @@ if __name__ == '__main__':
 
     parser.add_argument("--pf", type=int, help = "prefetch factor", default=2 )
 
+    parser.add_argument("--persistent-workers", help="keep the data loader workers alive between epochs",
+                        action=argparse.BooleanOptionalAction, default=False)
+
     parser.add_argument("--data-folder", type=str, help="train dataset", default='', required= True )
     parser.add_argument("--output-folder", type=str, help="output folder", default="training_results", required=True)
     parser.add_argument("--output-model-file", type=str, help="output Model filename.", default="resnet.pth")
+    parser.add_argument("--data-format", type=str, help="imagefolder reads the raw images, packed reads shards written by utils/packed.py",
+                        choices=["imagefolder", "packed"], default="imagefolder")
+    parser.add_argument("--cache-budget-gb", type=float, help="node-shared decoded sample cache size in GB, 0 disables the cache", default=0)
+    parser.add_argument("--cache-dir", type=str, help="folder for the node-shared sample cache file", default="/dev/shm")
+    parser.add_argument("--dataset-index", help="build the dataset from a cached file index instead of scanning the class tree",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--index-file", type=str, help="dataset index file (default: <output-folder>/.dataset_index.json)", default="")
+    parser.add_argument("--decoder", type=str, help="image decoder, pil-draft decodes JPEGs at the smallest scale that is still >= 224x224",
+                        choices=DECODERS, default="pil")
+    parser.add_argument("--benchmark-loader", help="only iterate the data loader, without a model, and report its throughput",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--benchmark-batches", type=int, help="batches per epoch for --benchmark-loader, 0 for full epochs", default=50)
+    parser.add_argument("--benchmark-epochs", type=int, help="epochs per configuration for --benchmark-loader", default=2)
+    parser.add_argument("--sweep-workers", type=str, help="comma separated workers values to sweep with --benchmark-loader", default="")
+    parser.add_argument("--sweep-pf", type=str, help="comma separated prefetch factors to sweep with --benchmark-loader", default="")
+    parser.add_argument("--sweep-batch-size", type=str, help="comma separated batch sizes to sweep with --benchmark-loader", default="")
+    parser.add_argument("--sweep-persistent-workers", type=str, help="comma separated 0/1 values to sweep with --benchmark-loader", default="")
+    parser.add_argument("--synthetic", help="train on one device resident random batch instead of the dataset, to isolate compute and communication from I/O",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--synthetic-steps", type=int, help="steps per epoch with --synthetic", default=100)
+    parser.add_argument("--step-timing", help="record data wait, copy, forward, backward, optimizer and all-reduce time of every step",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--step-timing-sync", help="synchronize CUDA at every phase boundary for exact GPU attribution (slower)",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--perf-mode", help="autocast (bf16 on CPU, fp16 or bf16 on CUDA), channels_last and relaxed cuDNN determinism",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--amp-dtype", type=str, help="autocast dtype in --perf-mode, auto is fp16 on CUDA and bf16 on CPU",
+                        choices=AMP_DTYPES, default="auto")
+    parser.add_argument("--compile", help="torch.compile the model in --perf-mode (torch >= 2.0)",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--bucket-cap-mb", type=float, help="DDP gradient bucket size in MB", default=25)
+    parser.add_argument("--gradient-as-bucket-view", help="let DDP gradients alias the all-reduce buckets instead of copying them",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--static-graph", help="tell DDP the set of used parameters never changes between steps",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--comm-hook", type=str, help="DDP communication hook, fp16/bf16 compress gradients, powersgd is low rank compression",
+                        choices=COMM_HOOKS, default="allreduce")
+    parser.add_argument("--powersgd-rank", type=int, help="matrix approximation rank of --comm-hook powersgd", default=1)
+    parser.add_argument("--powersgd-start-iter", type=int, help="plain all-reduce iterations before PowerSGD compression starts (> 1)", default=10)
+    parser.add_argument("--grad-accumulation", type=int, help="micro-batches per optimizer step, gradients are only all-reduced on the last one",
+                        default=1)
+    parser.add_argument("--zero", help="shard the SGD momentum state across the ranks with ZeroRedundancyOptimizer",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--stage-dir", type=str, help="node-local folder (disk or tmpfs) the rank's shard is copied to in the background, empty disables staging",
+                        default="")
+    parser.add_argument("--stage-workers", type=int, help="copy threads per rank for --stage-dir", default=8)
+    parser.add_argument("--stage-keep", help="keep the staged copy for the next run instead of removing it when training ends",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--sampler", type=str, help="distributed deals the whole dataset over all ranks in the same order every epoch, locality keeps every node on a stable partition",
+                        choices=SAMPLERS, default="distributed")
+    parser.add_argument("--exchange-fraction", type=float, help="fraction of a node partition handed to the next node between epochs with --sampler locality",
+                        default=0.0)
+    parser.add_argument("--checkpoint-steps", type=int, help="write a checkpoint every N optimizer steps, 0 disables", default=0)
+    parser.add_argument("--checkpoint-minutes", type=float, help="write a checkpoint every N minutes, 0 disables", default=0)
+    parser.add_argument("--checkpoint-keep", type=int, help="newest checkpoints kept in the output folder", default=3)
+    parser.add_argument("--resume", type=str, help="checkpoint to resume from, 'latest' picks the newest one in the output folder",
+                        default="")
+    parser.add_argument("--uint8-transport", help="ship uint8 batches from the loader workers and normalize them on the device",
+                        action=argparse.BooleanOptionalAction, default=False)
 
     if dist.is_available():
         parser.add_argument('--backend', type=str, help='Distributed backend',
@@ -150,6 +484,15 @@ if __name__ == '__main__':
                                      dist.Backend.NCCL, dist.Backend.MPI],
                             default=dist.Backend.NCCL)
     argv = parser.parse_args()
+    if argv.benchmark_loader and argv.synthetic:
+        # the synthetic loader has no input pipeline to measure
+        parser.error("--benchmark-loader measures the data loader, it cannot be combined with --synthetic")
+    if argv.data_format == "packed":
+        # packed shards are decoded and resized once by utils/packed.py, these only apply to raw images
+        ignored = [flag for flag, used in (("--cache-budget-gb", argv.cache_budget_gb > 0), ("--dataset-index", argv.dataset_index),
+                                           ("--decoder", argv.decoder != "pil"), ("--stage-dir", bool(argv.stage_dir))) if used]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} only apply to --data-format imagefolder")
     print("ARGUMENTS",argv)
     Path(argv.output_folder).mkdir(parents=True, exist_ok=True)
     dataset_dir = os.listdir(argv.data_folder)
@@ -0,0 +1,50 @@
+import os,sys
+import torch
+
+# set by utils/launcher.py for every rank it starts
+COMPUTE_CORES_ENV = "NAI_COMPUTE_CORES"
+WORKER_CORES_ENV = "NAI_WORKER_CORES"
+INTEROP_THREADS_ENV = "NAI_INTEROP_THREADS"
+
+
+def format_cores(cores):
+    return ",".join(str(core) for core in cores)
+
+
+def parse_cores(value):
+    return [int(core) for core in value.split(',') if core != '']
+
+
+def apply_rank_affinity(rank=0):
+    """Pins the rank to its compute cores and sizes the torch thread pools to them.
+
+    Does nothing unless the rank was started by utils/launcher.py.
+    """
+    cores = parse_cores(os.environ.get(COMPUTE_CORES_ENV, ""))
+    if not cores:
+        return False
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    interop = int(os.environ.get(INTEROP_THREADS_ENV, "1"))
+    try:
+        torch.set_num_interop_threads(interop)
+    except RuntimeError:
+        # only possible before the first inter-op parallel work
+        pass
+    print(f"CPU AFFINITY for node - {rank} compute cores {format_cores(cores)}, {len(cores)} intra-op threads, "
+          f"{torch.get_num_interop_threads()} inter-op threads, loader worker cores {os.environ.get(WORKER_CORES_ENV) or 'shared'}")
+    sys.stdout.flush()
+    return True
+
+
+def pin_loader_worker(worker_id):
+    """DataLoader worker_init_fn: one core and one thread per loader worker."""
+    cores = parse_cores(os.environ.get(WORKER_CORES_ENV, ""))
+    if cores:
+        os.sched_setaffinity(0, [cores[worker_id % len(cores)]])
+    torch.set_num_threads(1)
+
+
+def loader_worker_init():
+    """The worker_init_fn for the DataLoader of a launched rank, None otherwise."""
+    return pin_loader_worker if os.environ.get(COMPUTE_CORES_ENV) else None
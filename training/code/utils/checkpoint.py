@@ -0,0 +1,132 @@
+import os,sys
+import glob
+import re
+import threading
+import time
+import numpy as np
+import torch
+
+CHECKPOINT_FILE = "checkpoint_step{:09d}.pt"
+CHECKPOINT_PATTERN = re.compile(r"checkpoint_step(\d+)\.pt$")
+
+
+def list_checkpoints(output_folder):
+    """Complete checkpoints in the folder, oldest first."""
+    paths = [p for p in glob.glob(os.path.join(output_folder, "checkpoint_step*.pt")) if CHECKPOINT_PATTERN.search(p)]
+    return sorted(paths, key=lambda p: int(CHECKPOINT_PATTERN.search(p).group(1)))
+
+
+def latest_checkpoint(output_folder):
+    checkpoints = list_checkpoints(output_folder)
+    return checkpoints[-1] if checkpoints else None
+
+
+class AsyncCheckpointer(object):
+    """Periodic checkpoints that only stall training for a copy to host memory.
+
+    save() copies the state into host buffers that are reused between checkpoints and hands
+    them to a writer thread, which writes a temporary file and renames it into place, so a
+    checkpoint file is always complete. Only the newest keep checkpoints are kept. At most one
+    write is in flight, a checkpoint due while the previous one is still being written waits for
+    it and that wait counts as stall. A failed write is raised by the next save() or close().
+    A disabled checkpointer is never due.
+    """
+
+    def __init__(self, output_folder, rank=0, every_steps=0, every_minutes=0, keep=3, enabled=True):
+        self.output_folder = output_folder
+        self.rank = rank
+        self.every_steps = every_steps
+        self.every_seconds = every_minutes * 60
+        self.keep = keep
+        self.enabled = enabled and (every_steps > 0 or every_minutes > 0)
+        self.stalls = []
+        self.writes = []
+        self._last_time = time.time()
+        self._buffers = None
+        self._thread = None
+        self._error = None
+
+    def due(self, step):
+        """Whether a checkpoint is due after global step (1-based)."""
+        if not self.enabled:
+            return False
+        if self.every_steps and step % self.every_steps == 0:
+            return True
+        return bool(self.every_seconds) and time.time() - self._last_time >= self.every_seconds
+
+    def _to_host(self, value, buffer=None):
+        if torch.is_tensor(value):
+            if buffer is None or buffer.shape != value.shape or buffer.dtype != value.dtype:
+                buffer = torch.empty(value.shape, dtype=value.dtype, pin_memory=value.is_cuda)
+            buffer.copy_(value.detach(), non_blocking=value.is_cuda)
+            return buffer
+        if isinstance(value, dict):
+            buffer = buffer if isinstance(buffer, dict) else {}
+            return {k: self._to_host(v, buffer.get(k)) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            buffer = buffer if isinstance(buffer, (list, tuple)) and len(buffer) == len(value) else [None] * len(value)
+            return type(value)(self._to_host(v, b) for v, b in zip(value, buffer))
+        return value
+
+    def save(self, step, state_fn):
+        """Snapshots the state and writes it in the background, called by every rank.
+
+        state_fn() returns the state to save (a dict of state dicts and plain values) on rank 0
+        and None elsewhere, collectives it runs count into the stall of every rank.
+        """
+        stall_start = time.perf_counter()
+        # the buffers may still be being written
+        self._join()
+        state = state_fn()
+        if state is not None:
+            self._buffers = self._to_host(state, self._buffers)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            self._thread = threading.Thread(target=self._write, args=(step, self._buffers), daemon=True)
+            self._thread.start()
+        stall = time.perf_counter() - stall_start
+        self.stalls.append(stall)
+        self._last_time = time.time()
+        print(f"CHECKPOINT step {step} for node - {self.rank} stall {stall * 1000:.1f} ms")
+        sys.stdout.flush()
+
+    def _write(self, step, snapshot):
+        write_start = time.perf_counter()
+        path = os.path.join(self.output_folder, CHECKPOINT_FILE.format(step))
+        try:
+            torch.save(snapshot, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            for old in list_checkpoints(self.output_folder)[:-self.keep] if self.keep > 0 else []:
+                os.remove(old)
+        except Exception as e:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+            self._error = RuntimeError(f"writing checkpoint {path} failed: {e}")
+            self._error.__cause__ = e
+            return
+        self.writes.append(time.perf_counter() - write_start)
+
+    def _join(self):
+        """Waits for the write in flight and raises its error, if it failed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        self._join()
+        if self.stalls:
+            stalls = np.array(self.stalls) * 1000
+            writes = f", background write mean {np.mean(self.writes):.2f}s" if self.writes else ""
+            print(f"CHECKPOINTS for node - {self.rank} {len(stalls)} taken, stall mean {stalls.mean():.1f} ms "
+                  f"max {stalls.max():.1f} ms" + writes)
+            sys.stdout.flush()
+
+
+def load_checkpoint(path, device):
+    checkpoint = torch.load(path, map_location=device)
+    print(f"RESUMING from {path} at epoch {checkpoint['epoch']} batch {checkpoint['batch']}")
+    sys.stdout.flush()
+    return checkpoint
@@ -0,0 +1,133 @@
+import os,sys
+import argparse
+import contextlib
+import itertools
+import json
+import socket
+import tempfile
+import time
+from datetime import timedelta
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torchvision import models
+from utils.ddp import COMM_HOOKS, accumulation_window, get_comm_hook, wrap_model
+from utils.loader_bench import parse_grid
+from utils.synthetic import SyntheticLoader
+from utils.step_timer import StepTimer, timed_hook, DATA_WAIT, H2D, FORWARD, BACKWARD, OPTIMIZER
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def _worker(rank, world_size, port, config, args, output_folder):
+    os.environ["MASTER_ADDR"] = "localhost"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(args.threads)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size, timeout=timedelta(seconds=60))
+    torch.manual_seed(0)
+    device = torch.device("cpu")
+    model = getattr(models, args.model)()
+    ddp_model = wrap_model(model, config["bucket_cap_mb"], config["gradient_as_bucket_view"], config["static_graph"])
+    step_timer = StepTimer(output_folder, rank)
+    hook_state, comm_hook, wire_bytes = get_comm_hook(config["comm_hook"], args.powersgd_rank, args.powersgd_start_iter)
+    ddp_model.register_comm_hook(hook_state, timed_hook(step_timer, comm_hook, wire_bytes))
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.9)
+    accumulation = config["grad_accumulation"]
+    loader = SyntheticLoader(args.batch_size, 1000, args.warmup + args.steps, device)
+    step_timer.start(0)
+    for i, (images, labels) in enumerate(loader):
+        if i == args.warmup:
+            start_time = time.perf_counter()
+        step_timer.mark(DATA_WAIT)
+        step_timer.mark(H2D)
+        sync = (i + 1) % accumulation == 0 or i + 1 == len(loader)
+        with contextlib.nullcontext() if sync else ddp_model.no_sync():
+            loss = criterion(ddp_model(images), labels) / accumulation_window(i, accumulation, len(loader))
+            step_timer.mark(FORWARD)
+            if i % accumulation == 0:
+                optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            step_timer.mark(BACKWARD)
+        if sync:
+            optimizer.step()
+        step_timer.mark(OPTIMIZER)
+        step_timer.end_step()
+    elapsed = time.perf_counter() - start_time
+    step_timer.flush()
+    if rank == 0:
+        with open(os.path.join(output_folder, "result.json"), 'w') as f:
+            json.dump({"images_per_sec": args.steps * args.batch_size * world_size / elapsed}, f)
+    dist.destroy_process_group()
+
+
+def run_config(config, args):
+    """Runs one DDP configuration with args.procs gloo processes, returns its measurements."""
+    with tempfile.TemporaryDirectory() as output_folder:
+        mp.spawn(_worker, args=(args.procs, _free_port(), config, args, output_folder), nprocs=args.procs)
+        with open(os.path.join(output_folder, "result.json")) as f:
+            result = json.load(f)
+        allreduce, sent = [], []
+        with open(os.path.join(output_folder, "step_times_rank0.jsonl")) as f:
+            for line in f:
+                step = json.loads(line)
+                # warmup steps are dropped, the DDP buckets and PowerSGD settle in them
+                if step["step"] >= args.warmup and step["allreduce_bytes"]:
+                    allreduce.append(step["allreduce"])
+                    sent.append(step["allreduce_bytes"])
+    result["allreduce_p50_ms"] = float(np.percentile(allreduce, 50)) if allreduce else 0.0
+    result["allreduce_p95_ms"] = float(np.percentile(allreduce, 95)) if allreduce else 0.0
+    result["mb_per_sync"] = float(np.mean(sent)) / 2**20 if sent else 0.0
+    return result
+
+
+def benchmark(args):
+    grid = itertools.product(parse_grid(args.sweep_bucket_cap_mb, 25, float),
+                             parse_grid(args.sweep_comm_hook, "allreduce", str),
+                             parse_grid(args.sweep_grad_accumulation, 1),
+                             parse_grid(args.sweep_gradient_as_bucket_view, 0),
+                             parse_grid(args.sweep_static_graph, 0))
+    results = []
+    for bucket_cap_mb, comm_hook, grad_accumulation, bucket_view, static_graph in grid:
+        config = {"bucket_cap_mb": bucket_cap_mb, "comm_hook": comm_hook, "grad_accumulation": grad_accumulation,
+                  "gradient_as_bucket_view": bool(bucket_view), "static_graph": bool(static_graph)}
+        name = " ".join(f"{k}={v}" for k, v in config.items())
+        try:
+            result = run_config(config, args)
+        except Exception as e:
+            # e.g. bf16 all-reduce is not supported by every gloo build
+            print(f"COMM BENCHMARK {name} : failed ({str(e).strip().splitlines()[-1] if str(e).strip() else e})")
+            sys.stdout.flush()
+            continue
+        results.append((result["images_per_sec"], name))
+        print(f"COMM BENCHMARK {name} : {result['images_per_sec']:.2f} images/sec, "
+              f"all-reduce wait p50 {result['allreduce_p50_ms']:.2f} ms p95 {result['allreduce_p95_ms']:.2f} ms, "
+              f"{result['mb_per_sync']:.2f} MB sent per synchronizing step")
+        sys.stdout.flush()
+    if results:
+        best_ips, best = max(results)
+        print(f"BEST COMM CONFIG {best} : {best_ips:.2f} images/sec")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark DDP communication settings with gloo processes on localhost')
+    parser.add_argument("--procs", type=int, help="processes (ranks) on localhost", default=2)
+    parser.add_argument("--threads", type=int, help="torch threads per process", default=1)
+    parser.add_argument("--model", type=str, help="torchvision model", default="resnet50")
+    parser.add_argument("--batch-size", type=int, help="batch size per process", default=8)
+    parser.add_argument("--steps", type=int, help="measured steps per configuration", default=20)
+    parser.add_argument("--warmup", type=int, help="unmeasured steps before them", default=12)
+    parser.add_argument("--powersgd-rank", type=int, help="matrix approximation rank for powersgd", default=1)
+    parser.add_argument("--powersgd-start-iter", type=int, help="plain all-reduce iterations before PowerSGD compression starts", default=10)
+    parser.add_argument("--sweep-bucket-cap-mb", type=str, help="comma separated bucket sizes in MB", default="")
+    parser.add_argument("--sweep-comm-hook", type=str, help=f"comma separated hooks out of {','.join(COMM_HOOKS)}", default="")
+    parser.add_argument("--sweep-grad-accumulation", type=str, help="comma separated micro-batches per optimizer step", default="")
+    parser.add_argument("--sweep-gradient-as-bucket-view", type=str, help="comma separated 0/1 values", default="")
+    parser.add_argument("--sweep-static-graph", type=str, help="comma separated 0/1 values", default="")
+    benchmark(parser.parse_args())
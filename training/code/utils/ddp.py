@@ -0,0 +1,99 @@
+import os,sys
+import resource
+import torch
+import torch.nn as nn
+from torch.distributed.optim import ZeroRedundancyOptimizer
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks, powerSGD_hook
+
+COMM_HOOKS = ["allreduce", "fp16", "bf16", "powersgd"]
+
+
+def wrap_model(model, bucket_cap_mb=25, gradient_as_bucket_view=False, static_graph=False):
+    """DistributedDataParallel on the GPU the model is on, or on the CPU. The defaults are DDP's own."""
+    kwargs = {"bucket_cap_mb": bucket_cap_mb, "gradient_as_bucket_view": gradient_as_bucket_view,
+              "static_graph": static_graph}
+    device = next(model.parameters()).device
+    if device.type == "cuda":
+        return nn.parallel.DistributedDataParallel(model, device_ids=[device.index], output_device=device.index, **kwargs)
+    return nn.parallel.DistributedDataParallel(model, device_ids=None, output_device=None, **kwargs)
+
+
+def accumulation_window(position, accumulation, total):
+    """Micro-batches in the accumulation window of the batch at position, the last window of an epoch can be shorter."""
+    start = position - position % accumulation
+    return min(start + accumulation, total) - start
+
+
+def _buffer_bytes(bucket):
+    buffer = bucket.buffer()
+    return buffer.numel() * buffer.element_size()
+
+
+def _half_bytes(bucket):
+    return bucket.buffer().numel() * 2
+
+
+def _powersgd_bytes(state):
+    def wire_bytes(bucket):
+        if state.iter < state.start_powerSGD_iter:
+            return _buffer_bytes(bucket)
+        total = 0
+        for grad in bucket.gradients():
+            if grad.ndim <= 1:
+                total += grad.numel() * grad.element_size()
+                continue
+            rows, cols = grad.shape[0], grad.numel() // grad.shape[0]
+            rank = min(rows, cols, state.matrix_approximation_rank)
+            # the same rule as powerSGD_hook: compress only when P and Q are small enough
+            if rows * cols > (rows + cols) * rank * state.min_compression_rate:
+                total += (rows + cols) * rank * grad.element_size()
+            else:
+                total += grad.numel() * grad.element_size()
+        return total
+
+    return wire_bytes
+
+
+def get_comm_hook(name, powersgd_rank=1, powersgd_start_iter=10):
+    """(state, hook, wire_bytes) of a DDP communication hook.
+
+    wire_bytes(bucket) estimates the bytes a bucket puts on the wire with that hook, which is
+    less than the gradient size for the compressing hooks.
+    """
+    if name == "allreduce":
+        return None, default_hooks.allreduce_hook, _buffer_bytes
+    if name == "fp16":
+        return None, default_hooks.fp16_compress_hook, _half_bytes
+    if name == "bf16":
+        return None, default_hooks.bf16_compress_hook, _half_bytes
+    if name == "powersgd":
+        state = powerSGD_hook.PowerSGDState(process_group=None, matrix_approximation_rank=powersgd_rank,
+                                            start_powerSGD_iter=powersgd_start_iter)
+        return state, powerSGD_hook.powerSGD_hook, _powersgd_bytes(state)
+    raise AssertionError(f"Unknown comm hook {name}")
+
+
+def build_optimizer(params, lr, zero=False):
+    """SGD with momentum, with zero=True its state is sharded across the ranks by ZeroRedundancyOptimizer.
+
+    Every rank then keeps the momentum buffers of its own parameter shard only, updates that
+    shard and broadcasts it, so the parameters after a step are the same as with plain SGD.
+    """
+    if zero:
+        return ZeroRedundancyOptimizer(params, optimizer_class=torch.optim.SGD, lr=lr, weight_decay=0.001, momentum=0.9)
+    return torch.optim.SGD(params, lr=lr, weight_decay=0.001, momentum=0.9)
+
+
+def optimizer_state_bytes(optimizer):
+    """Bytes of optimizer state tensors held by this rank."""
+    local = optimizer.optim if isinstance(optimizer, ZeroRedundancyOptimizer) else optimizer
+    return sum(value.numel() * value.element_size() for state in local.state.values()
+               for value in state.values() if torch.is_tensor(value))
+
+
+def peak_memory_bytes(device):
+    """Peak CUDA memory allocated on device, or the peak RSS of the process on CPU."""
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device)
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
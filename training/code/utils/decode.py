@@ -0,0 +1,90 @@
+import os,sys
+import argparse
+import time
+import numpy as np
+import torch
+import torchvision.io as io
+import torchvision.transforms as transforms
+from PIL import Image
+from torchvision.datasets.folder import default_loader
+
+DECODERS = ["pil", "pil-draft", "torchvision"]
+
+
+class DraftLoader(object):
+    """PIL loader that lets libjpeg decode with a scaled IDCT (1/2, 1/4 or 1/8).
+
+    draft() picks the smallest scale whose result is still at least `size` in both dimensions,
+    so the following Resize only has to shrink the remaining factor. Non-JPEG files are decoded
+    at full resolution as before.
+    """
+
+    def __init__(self, size=(224, 224)):
+        self.size = size
+
+    def __call__(self, path):
+        with open(path, 'rb') as f:
+            img = Image.open(f)
+            if img.format == "JPEG":
+                img.draft('RGB', self.size)
+            return img.convert('RGB')
+
+
+def torchvision_loader(path):
+    """Decodes to a CHW uint8 tensor with torchvision.io, without going through PIL."""
+    data = io.read_file(path)
+    try:
+        return io.decode_jpeg(data, mode=io.ImageReadMode.RGB)
+    except RuntimeError:
+        # not a JPEG, decode_image handles PNG as well
+        return io.decode_image(data, mode=io.ImageReadMode.RGB)
+
+
+def get_loader(decoder, size=(224, 224)):
+    if decoder == "pil":
+        return default_loader
+    if decoder == "pil-draft":
+        return DraftLoader(size)
+    if decoder == "torchvision":
+        return torchvision_loader
+    raise AssertionError(f"Unknown decoder {decoder}")
+
+
+def get_resize(decoder, size=(224, 224)):
+    if decoder == "torchvision":
+        # tensors are not antialiased by default, PIL always is
+        return transforms.Resize(size, antialias=True)
+    return transforms.Resize(size)
+
+
+def benchmark(data_folder, repeat, size=(224, 224)):
+    files = sorted(os.path.join(data_folder, f) for f in os.listdir(data_folder)
+                   if os.path.isfile(os.path.join(data_folder, f)))
+    print(f"## {len(files)} images, {repeat} decodes each, target {size[0]}x{size[1]}")
+    print(f"{'image':<24}" + "".join(f"{decoder:>16}" for decoder in DECODERS))
+    totals = {decoder: [] for decoder in DECODERS}
+    for path in files:
+        row = f"{os.path.basename(path):<24}"
+        for decoder in DECODERS:
+            loader = get_loader(decoder, size)
+            resize = get_resize(decoder, size)
+            latencies = np.empty(repeat)
+            for i in range(repeat):
+                start = time.perf_counter()
+                resize(loader(path))
+                latencies[i] = time.perf_counter() - start
+            totals[decoder].append(latencies)
+            row += f"{np.median(latencies) * 1000:>13.2f} ms"
+        print(row)
+    print(f"{'p50 all':<24}" + "".join(f"{np.median(np.concatenate(totals[d])) * 1000:>13.2f} ms" for d in DECODERS))
+    print(f"{'p99 all':<24}" + "".join(f"{np.percentile(np.concatenate(totals[d]), 99) * 1000:>13.2f} ms" for d in DECODERS))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='per-image decode and resize latency of the decoder backends')
+    parser.add_argument("--data-folder", type=str, help="folder with images, eg: inference/data", required=True)
+    parser.add_argument("--repeat", type=int, help="decodes per image and backend", default=20)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads", default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    benchmark(args.data_folder, args.repeat)
@@ -0,0 +1,180 @@
+import os,sys
+import argparse
+import json
+import threading
+import time
+import torch
+import torch.distributed as dist
+import torchvision as tv
+from torchvision.datasets.folder import IMG_EXTENSIONS
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_FILE = ".dataset_index.json"
+
+
+def default_index_file(output_folder):
+    return os.path.join(output_folder, DEFAULT_INDEX_FILE)
+
+
+def prebuilt_index_file(dataset_folder):
+    """Where this module's CLI writes an index ahead of time, training only reads it."""
+    return os.path.join(dataset_folder, DEFAULT_INDEX_FILE)
+
+
+def list_classes(dataset_folder):
+    return sorted(entry.name for entry in os.scandir(dataset_folder) if entry.is_dir())
+
+
+def build_index(dataset_folder):
+    """Walks the class tree once, in the same order as ImageFolder, and records every image."""
+    start_time = time.time()
+    classes = list_classes(dataset_folder)
+    dirs = {}
+    paths, targets, sizes, mtimes = [], [], [], []
+    for class_index, class_name in enumerate(classes):
+        class_dir = os.path.join(dataset_folder, class_name)
+        for root, _, fnames in sorted(os.walk(class_dir, followlinks=True)):
+            dirs[os.path.relpath(root, dataset_folder)] = os.stat(root).st_mtime_ns
+            for fname in sorted(fnames):
+                if not fname.lower().endswith(IMG_EXTENSIONS):
+                    continue
+                path = os.path.join(root, fname)
+                stat = os.stat(path)
+                paths.append(os.path.relpath(path, dataset_folder))
+                targets.append(class_index)
+                sizes.append(stat.st_size)
+                mtimes.append(stat.st_mtime_ns)
+    print(f"## Indexed {len(paths)} images in {len(classes)} classes in {time.time() - start_time:.1f}s")
+    return {
+        "version": INDEX_VERSION,
+        "classes": classes,
+        "dirs": dirs,
+        "paths": paths,
+        "targets": targets,
+        "sizes": sizes,
+        "mtimes": mtimes,
+    }
+
+
+def save_index(index, index_file):
+    # rename is atomic, readers never see a partially written index
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+
+
+def is_valid(index, dataset_folder):
+    """Cheap validation, only the directories are stat-ed.
+
+    Adding, removing or renaming a file changes the mtime of its directory, in-place rewrites of
+    an image are not detected. The top level is checked by its class list because the index file
+    itself may live there.
+    """
+    if index.get("version") != INDEX_VERSION:
+        return False
+    if list_classes(dataset_folder) != index["classes"]:
+        return False
+    for rel_dir, mtime in index["dirs"].items():
+        try:
+            if os.stat(os.path.join(dataset_folder, rel_dir)).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def load_index(index_file, dataset_folder):
+    """Returns the index if it exists and still matches the dataset, otherwise None."""
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if is_valid(index, dataset_folder) else None
+
+
+def load_or_build_index(dataset_folder, index_file):
+    """A valid index from index_file or, read only, the dataset folder, otherwise a new one saved to index_file."""
+    candidates = [index_file]
+    if prebuilt_index_file(dataset_folder) != index_file:
+        candidates.append(prebuilt_index_file(dataset_folder))
+    for candidate in candidates:
+        index = load_index(candidate, dataset_folder)
+        if index is not None:
+            return index
+    print(f"## Building dataset index {index_file}")
+    index = build_index(dataset_folder)
+    try:
+        save_index(index, index_file)
+    except OSError as e:
+        print(f"## Could not write dataset index {index_file}, it is rebuilt on the next run: {e}")
+    return index
+
+
+def get_index(dataset_folder, index_file, global_rank, device=None, poll_interval=2):
+    """Rank 0 loads or builds the index and sends it to the other ranks over the process group.
+
+    The index file only has to be visible to rank 0. A build can take much longer than the
+    process group timeout, so rank 0 builds in a thread while all ranks exchange a ready flag
+    every poll_interval seconds, no collective ever waits for the build itself.
+    """
+    if not (dist.is_available() and dist.is_initialized()):
+        return load_or_build_index(dataset_folder, index_file)
+    result = [None]
+    builder = None
+    if global_rank == 0:
+        def build():
+            result[0] = load_or_build_index(dataset_folder, index_file)
+        builder = threading.Thread(target=build, daemon=True)
+        builder.start()
+    while True:
+        ready = torch.tensor([0 if builder is not None and builder.is_alive() else 1], device=device)
+        dist.all_reduce(ready, op=dist.ReduceOp.MIN)
+        if ready.item():
+            break
+        time.sleep(poll_interval)
+    dist.broadcast_object_list(result, 0, device=device)
+    if result[0] is None:
+        raise RuntimeError(f"rank 0 failed to load or build the dataset index of {dataset_folder}")
+    return result[0]
+
+
+class IndexedImageFolder(tv.datasets.ImageFolder):
+    """ImageFolder that takes its classes and samples from an index instead of scanning the tree."""
+
+    def __init__(self, root, index, transform=None, target_transform=None, loader=tv.datasets.folder.default_loader):
+        self._index = index
+        super().__init__(root, transform=transform, target_transform=target_transform, loader=loader)
+        # only needed while the samples are built, keep it out of the pickled loader workers
+        del self._index
+
+    def find_classes(self, directory):
+        classes = self._index["classes"]
+        return classes, {cls_name: i for i, cls_name in enumerate(classes)}
+
+    def make_dataset(self, directory, class_to_idx, extensions=None, is_valid_file=None, allow_empty=False):
+        samples = [(os.path.join(directory, path), target)
+                   for path, target in zip(self._index["paths"], self._index["targets"])]
+        if not samples and not allow_empty:
+            # like ImageFolder on an empty tree
+            raise FileNotFoundError(f"Found no valid file in the index of {directory}.")
+        return samples
+
+
+def image_folder(dataset_folder, transform=None, index=None, **kwargs):
+    if index is None:
+        return tv.datasets.ImageFolder(dataset_folder, transform=transform, **kwargs)
+    return IndexedImageFolder(dataset_folder, index, transform=transform, **kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='build the dataset file index ahead of training')
+    parser.add_argument("--data-folder", type=str, help="ImageFolder dataset", required=True)
+    parser.add_argument("--index-file", type=str, help="index file, defaults to <data-folder>/" + DEFAULT_INDEX_FILE, default="")
+    args = parser.parse_args()
+    index_file = args.index_file or prebuilt_index_file(args.data_folder)
+    if load_index(index_file, args.data_folder) is not None:
+        print(f"## {index_file} is up to date")
+    else:
+        save_index(build_index(args.data_folder), index_file)
@@ -1,23 +1,262 @@
 import os,sys
+from datetime import datetime
+import numpy as np
 from matplotlib.dates import DateFormatter
 import matplotlib.pyplot as plt
 
-def save_time_series_plt(dates,y, name="timeseries.jpg", output_folder="training_results"):
-    # start = datetime(2019, 8, 1)
-    # dates = [ start + timedelta(0,i) for i in range(0,3000,15) ]
-    # y = [np.random.randint(0,100) for i in range(0,3000,15) ]
-    # plt.gcf().autofmt_xdate
-    if not y:
+
+def load_monitor_csv(path, columns=None):
+    """Reads a CSV written by utils/monitor.py into numpy columns, only the named ones (and time) if given."""
+    with open(path) as f:
+        header = f.readline().strip().split(',')
+        keep = [i for i, column in enumerate(header) if columns is None or column == "time" or column in columns]
+        rows = []
+        for line in f:
+            values = line.strip().split(',')
+            # a run killed mid-write can leave a truncated last line
+            if len(values) == len(header):
+                rows.append([float(values[i]) for i in keep])
+    data = np.array(rows, dtype=np.float64).reshape(-1, len(keep))
+    return {header[i]: data[:, j] for j, i in enumerate(keep)}
+
+
+def minmax_indices(y, buckets=1000):
+    """Indices of the minimum and maximum of y in each of at most buckets equal slices, in order.
+
+    Keeps every peak and dip of the series with at most 2 * buckets points. NaNs are skipped.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    rows = -(-n // size)
+    padded = np.full(rows * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(rows, size)
+    offsets = np.arange(rows) * size
+    lo = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1) + offsets
+    hi = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1) + offsets
+    return np.unique(np.minimum(np.concatenate([lo, hi]), n - 1))
+
+
+class StreamingMinMax(object):
+    """Bounded min/max summary of an unbounded stream of samples with several columns.
+
+    Samples fall into buckets time buckets; once the stream outgrows them the bucket width
+    doubles and neighbouring buckets are merged, so memory and render time stay constant no
+    matter how long the run is. Every bucket keeps the minimum and maximum (with their times)
+    of every column.
+    """
+
+    def __init__(self, num_columns, buckets=1000):
+        self.buckets = buckets + buckets % 2
+        self.start = None
+        self.width = None
+        shape = (self.buckets, num_columns)
+        self.min_value = np.full(shape, np.inf)
+        self.min_time = np.zeros(shape)
+        self.max_value = np.full(shape, -np.inf)
+        self.max_time = np.zeros(shape)
+        self.filled = np.zeros(self.buckets, dtype=bool)
+
+    def _coarsen(self):
+        half = self.buckets // 2
+        for values, times, init, better in ((self.min_value, self.min_time, np.inf, np.less),
+                                            (self.max_value, self.max_time, -np.inf, np.greater)):
+            take_odd = better(values[1::2], values[0::2])
+            merged_values = np.where(take_odd, values[1::2], values[0::2])
+            merged_times = np.where(take_odd, times[1::2], times[0::2])
+            values.fill(init)
+            values[:half] = merged_values
+            times[:half] = merged_times
+        filled = self.filled[0::2] | self.filled[1::2]
+        self.filled[:] = False
+        self.filled[:half] = filled
+        self.width *= 2
+
+    def add(self, times, values):
+        """times: (n,) increasing timestamps, values: (n, num_columns)."""
+        if len(times) == 0:
+            return
+        if self.start is None:
+            self.start = times[0]
+            self.width = max((times[-1] - times[0]) / self.buckets, 1e-3)
+        while (times[-1] - self.start) // self.width >= self.buckets:
+            self._coarsen()
+        idx = np.maximum((times - self.start) // self.width, 0).astype(np.int64)
+        lo = np.where(np.isnan(values), np.inf, values)
+        hi = np.where(np.isnan(values), -np.inf, values)
+        columns = np.arange(values.shape[1])
+        bounds = np.flatnonzero(np.diff(idx)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(idx)]):
+            bucket = idx[start]
+            arg = lo[start:end].argmin(axis=0)
+            value, when = lo[start:end][arg, columns], times[start:end][arg]
+            better = value < self.min_value[bucket]
+            self.min_value[bucket] = np.where(better, value, self.min_value[bucket])
+            self.min_time[bucket] = np.where(better, when, self.min_time[bucket])
+            arg = hi[start:end].argmax(axis=0)
+            value, when = hi[start:end][arg, columns], times[start:end][arg]
+            better = value > self.max_value[bucket]
+            self.max_value[bucket] = np.where(better, value, self.max_value[bucket])
+            self.max_time[bucket] = np.where(better, when, self.max_time[bucket])
+            self.filled[bucket] = True
+
+    def series(self, column):
+        """(times, values) of one column, the bucket minima and maxima in time order."""
+        # a bucket where the column was NaN throughout has no minimum or maximum to show
+        filled = self.filled & np.isfinite(self.min_value[:, column])
+        times = np.concatenate([self.min_time[filled, column], self.max_time[filled, column]])
+        values = np.concatenate([self.min_value[filled, column], self.max_value[filled, column]])
+        times, first = np.unique(times, return_index=True)
+        return times, values[first]
+
+
+class MonitorPlotter(object):
+    """Follows a CSV written by utils/monitor.py and renders downsampled plots of it.
+
+    update() only parses the lines appended since the previous call, so the chart can be
+    refreshed while the run is going on and the whole file is never held in memory.
+    """
+
+    def __init__(self, path, buckets=1000, chunk_bytes=1 << 22):
+        self.path = path
+        self.buckets = buckets
+        self.chunk_bytes = chunk_bytes
+        self.columns = None
+        self.summary = None
+        self._offset = 0
+        self._partial = b""
+
+    def update(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            while True:
+                chunk = f.read(self.chunk_bytes)
+                if not chunk:
+                    break
+                self._offset += len(chunk)
+                lines = (self._partial + chunk).split(b"\n")
+                # the last piece is an unfinished line, or empty
+                self._partial = lines.pop()
+                if self.columns is None and lines:
+                    self.columns = lines.pop(0).decode().strip().split(',')
+                    self.summary = StreamingMinMax(len(self.columns) - 1, self.buckets)
+                rows = [line.split(b',') for line in lines]
+                rows = np.array([row for row in rows if len(row) == len(self.columns)], dtype=np.float64)
+                if len(rows):
+                    self.summary.add(rows[:, 0], rows[:, 1:])
+
+    def series(self, column):
+        """(dates, values) of a column."""
+        times, values = self.summary.series(self.columns.index(column) - 1)
+        return [datetime.fromtimestamp(t) for t in times], values
+
+    def ready(self):
+        return self.summary is not None and self.summary.filled.any()
+
+    def _plot(self, ax, column, label=None):
+        if column in self.columns:
+            ax.plot(*self.series(column), label=label or column)
+
+    def render(self, name="monitor.jpg", output_folder="training_results"):
+        """Host usage in the first panel, then one panel per GPU with its load and memory."""
+        if not self.ready():
+            return
+        gpus = [c for c in self.columns if c.startswith("gpu") and not c.endswith("_mem")]
+        fig, axes = plt.subplots(1 + len(gpus), 1, sharex=True, figsize=(10, 2.5 * (1 + len(gpus))), squeeze=False)
+        axes = axes[:, 0]
+        for column in ("cpu", "mem", "proc_cpu"):
+            self._plot(axes[0], column)
+        axes[0].set_ylabel("host %")
+        axes[0].legend()
+        for ax, gpu in zip(axes[1:], gpus):
+            self._plot(ax, gpu, "load")
+            self._plot(ax, f"{gpu}_mem", "memory")
+            ax.set_ylabel(f"{gpu} %")
+            ax.legend()
+        _save_figure(fig, axes[-1], name, output_folder)
+
+    def render_columns(self, columns, name, output_folder="training_results"):
+        """The columns as lines of one chart, with a legend when there are several."""
+        if not self.ready() or not columns:
+            return
+        fig, ax = plt.subplots()
+        for column in columns:
+            self._plot(ax, column)
+        if len(columns) > 1:
+            ax.legend()
+        _save_figure(fig, ax, name, output_folder)
+
+    def render_io(self, starvation=None, name="io.jpg", output_folder="training_results"):
+        """CPU/GPU usage, dataset mount I/O and the loader data wait on one shared time axis.
+
+        Monitor intervals flagged as data starved are shaded in every panel.
+        """
+        if not self.ready():
+            return
+        panels = 5 if starvation is not None else 4
+        fig, axes = plt.subplots(panels, 1, sharex=True, figsize=(10, 2.5 * panels))
+        for column in ["cpu"] + [c for c in self.columns if c.startswith("gpu") and not c.endswith("_mem")]:
+            self._plot(axes[0], column)
+        axes[0].set_ylabel("usage %")
+        axes[0].legend()
+        self._plot(axes[1], "disk_read_mbs", "storage read")
+        self._plot(axes[1], "tree_read_mbs", "process read()")
+        self._plot(axes[1], "net_recv_mbs", "net recv")
+        axes[1].set_ylabel("MB/s")
+        axes[1].legend()
+        self._plot(axes[2], "disk_read_iops")
+        axes[2].set_ylabel("read IOPS")
+        self._plot(axes[3], "cache_hit")
+        axes[3].set_ylabel("page cache hit %")
+        if starvation is not None:
+            times = starvation["time"]
+            idx = minmax_indices(starvation["data_wait_fraction"], self.buckets)
+            axes[4].plot([datetime.fromtimestamp(t) for t in times[idx]], starvation["data_wait_fraction"][idx] * 100)
+            axes[4].set_ylabel("data wait %")
+            # one span per run of consecutive starved intervals keeps the artist count bounded too
+            starved = np.r_[False, starvation["starved"], False].astype(np.int8)
+            changes = np.flatnonzero(np.diff(starved))
+            for first, last in zip(changes[0::2], changes[1::2] - 1):
+                start = times[first - 1] if first > 0 else times[first]
+                for ax in axes:
+                    ax.axvspan(datetime.fromtimestamp(start), datetime.fromtimestamp(times[last]), color='red', alpha=0.2)
+        _save_figure(fig, axes[-1], name, output_folder)
+
+
+def _save_figure(fig, last_axis, name, output_folder):
+    last_axis.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d-%H:%M:%S"))
+    plt.setp(last_axis.get_xticklabels(), rotation=30, ha='right')
+    fig.tight_layout()
+    # write next to the old image first so a viewer refreshing the file never reads half of it
+    path = os.path.curdir + f"/{output_folder}/{name}"
+    root, ext = os.path.splitext(path)
+    fig.savefig(root + ".tmp" + ext)
+    os.replace(root + ".tmp" + ext, path)
+    plt.close(fig)
+
+
+def save_cluster_plt(grid, series, name="cluster.jpg", output_folder="training_results", buckets=1000):
+    """One panel per node of a merged cluster timeline from utils/telemetry.py: CPU, mean GPU load, network."""
+    if len(grid) == 0 or not series:
         return
-    date_form = DateFormatter("%Y-%m-%d-%H:%M:%S")
-    plt.gca().xaxis.set_major_formatter(date_form)
-    plt.xticks(rotation=30, ha='right')
-    plt.tight_layout()
-    if type(y[0]) == int or type(y[0])== float :
-        plt.plot(dates, y)
-    else:
-        for i,ydash in enumerate(y):
-            plt.plot(dates, ydash, label=f'gpu{i}')
-        plt.legend()
-    plt.savefig(os.path.curdir + f"/{output_folder}/{name}")
-    plt.close()
+    fig, axes = plt.subplots(len(series), 1, sharex=True, figsize=(10, 2.5 * len(series)), squeeze=False)
+    axes = axes[:, 0]
+    for ax, (node, columns) in zip(axes, series.items()):
+        lines = {"cpu": columns["cpu"], "net MB/s": columns.get("net_recv_mbs")}
+        gpus = [v for c, v in columns.items() if c.startswith("gpu") and not c.endswith("_mem")]
+        if gpus:
+            with np.errstate(all='ignore'):
+                lines["gpu"] = np.nanmean(np.vstack(gpus), axis=0) if np.isfinite(np.vstack(gpus)).any() else gpus[0]
+        for label, y in lines.items():
+            if y is None:
+                continue
+            idx = minmax_indices(y, buckets)
+            ax.plot([datetime.fromtimestamp(t) for t in grid[idx]], y[idx], label=label)
+        ax.set_ylabel(node)
+        ax.legend()
+    _save_figure(fig, axes[-1], name, output_folder)
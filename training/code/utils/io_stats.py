@@ -0,0 +1,141 @@
+import os,sys
+import json
+import numpy as np
+import psutil
+
+IO_COLUMNS = ["disk_read_mbs", "disk_read_iops", "net_recv_mbs", "cache_hit", "tree_read_mbs"]
+STARVATION_FILE = "starvation_rank{}.csv"
+
+
+def find_mount(path):
+    """(mount point, device, fstype) of the mount that holds path."""
+    path = os.path.realpath(path)
+    best = None
+    for partition in psutil.disk_partitions(all=True):
+        mountpoint = partition.mountpoint
+        if path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/'):
+            if best is None or len(mountpoint) > len(best.mountpoint):
+                best = partition
+    if best is None:
+        return "/", "", ""
+    return best.mountpoint, best.device, best.fstype
+
+
+def read_nfs_stats(mountpoint):
+    """(bytes read by applications, bytes read from the server, READ ops) of an NFS mount."""
+    with open("/proc/self/mountstats") as f:
+        lines = f.read().splitlines()
+    in_mount = False
+    app_read = server_read = read_ops = 0
+    for line in lines:
+        if line.startswith("device "):
+            in_mount = f" mounted on {mountpoint} with fstype nfs" in line
+            continue
+        if not in_mount:
+            continue
+        fields = line.split()
+        if fields and fields[0] == "bytes:":
+            # normalread normalwrite directread directwrite serverread serverwrite readpages writepages
+            app_read = int(fields[1]) + int(fields[3])
+            server_read = int(fields[5])
+        elif fields and fields[0] == "READ:":
+            read_ops = int(fields[1])
+    return app_read, server_read, read_ops
+
+
+class IOSampler(object):
+    """Read throughput, IOPS and page-cache hit rate of the dataset mount, plus network receive.
+
+    For NFS mounts the kernel counts the bytes read by applications and the bytes fetched from
+    the server, so the hit rate is exact. For block devices the hit rate is estimated from the
+    process tree as 1 - bytes read from storage / bytes returned by read().
+    """
+
+    def __init__(self, dataset_path):
+        self.mountpoint, device, fstype = find_mount(dataset_path)
+        self.nfs = fstype.startswith("nfs")
+        self.device = os.path.basename(device)
+        self._prev = None
+
+    def _counters(self, tree_read_chars, tree_read_bytes):
+        if self.nfs:
+            app_read, server_read, read_ops = read_nfs_stats(self.mountpoint)
+            storage_bytes, storage_ops = server_read, read_ops
+        else:
+            disks = psutil.disk_io_counters(perdisk=True)
+            # overlay and tmpfs mounts have no device of their own, count all disks then
+            disk = disks[self.device] if self.device in disks else psutil.disk_io_counters()
+            storage_bytes, storage_ops = disk.read_bytes, disk.read_count
+            app_read, server_read = tree_read_chars, tree_read_bytes
+        net = psutil.net_io_counters()
+        return np.array([storage_bytes, storage_ops, net.bytes_recv, app_read, server_read, tree_read_chars],
+                        dtype=np.float64)
+
+    def sample(self, timestamp, tree_read_chars, tree_read_bytes):
+        """Rates since the previous call in IO_COLUMNS order, tree_* are the cumulative reads of the process tree."""
+        counters = self._counters(tree_read_chars, tree_read_bytes)
+        if self._prev is None:
+            self._prev = (timestamp, counters)
+            return [0.0, 0.0, 0.0, float('nan'), 0.0]
+        prev_time, prev = self._prev
+        self._prev = (timestamp, counters)
+        elapsed = max(timestamp - prev_time, 1e-6)
+        delta = np.maximum(counters - prev, 0)
+        hit = 100 * max(1 - delta[4] / delta[3], 0.0) if delta[3] > 0 else float('nan')
+        return [delta[0] / elapsed / 2**20, delta[1] / elapsed, delta[2] / elapsed / 2**20, hit,
+                delta[5] / elapsed / 2**20]
+
+
+def load_step_times(output_folder, rank):
+    """(start time, data wait in seconds) of every step recorded by utils/step_timer.py."""
+    starts, waits = [], []
+    path = os.path.join(output_folder, f"step_times_rank{rank}.jsonl")
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                step = json.loads(line)
+                starts.append(step["time"])
+                waits.append(step["data_wait"] / 1000)
+    return np.array(starts), np.array(waits)
+
+
+def detect_starvation(usage, output_folder, rank=0, threshold=0.3):
+    """Correlates monitor intervals with the per-batch data wait of the training loop.
+
+    For every monitor interval the share of wall time the rank spent waiting for the loader is
+    computed, intervals above threshold are flagged as starved. The result is written to
+    starvation_rank{rank}.csv next to the monitor output and returned as a dict of columns,
+    None when the run recorded no step times.
+    """
+    starts, waits = load_step_times(output_folder, rank)
+    times = usage["time"]
+    if len(starts) == 0 or len(times) < 2:
+        return None
+    # the rates of a monitor sample cover the interval that ends at its timestamp
+    edges = np.insert(times, 0, times[0] - (times[1] - times[0]))
+    bucket = np.searchsorted(edges, starts, side='left') - 1
+    valid = (bucket >= 0) & (bucket < len(times))
+    wait_per_interval = np.bincount(bucket[valid], weights=waits[valid], minlength=len(times))
+    wait_fraction = np.minimum(wait_per_interval / np.diff(edges), 1.0)
+    starved = wait_fraction > threshold
+    with open(os.path.join(output_folder, STARVATION_FILE.format(rank)), 'w') as f:
+        f.write("time,data_wait_fraction,starved," + ",".join(IO_COLUMNS) + "\n")
+        for i in range(len(times)):
+            io = ",".join(f"{usage[c][i]:.3f}" for c in IO_COLUMNS)
+            f.write(f"{times[i]:.3f},{wait_fraction[i]:.3f},{int(starved[i])},{io}\n")
+    if starved.any():
+        hits = usage['cache_hit'][starved]
+        hit = np.nanmean(hits) if np.isfinite(hits).any() else float('nan')
+        print(f"DATA STARVATION node - {rank} in {starved.sum()}/{len(times)} monitor intervals "
+              f"(data wait > {threshold * 100:.0f}% of wall time)")
+        print(f"  while starved: disk read {usage['disk_read_mbs'][starved].mean():.1f} MB/s, "
+              f"{usage['disk_read_iops'][starved].mean():.0f} IOPS, "
+              f"net {usage['net_recv_mbs'][starved].mean():.1f} MB/s, page cache hit {hit:.1f}%")
+        if not starved.all():
+            print(f"  otherwise:     disk read {usage['disk_read_mbs'][~starved].mean():.1f} MB/s, "
+                  f"{usage['disk_read_iops'][~starved].mean():.0f} IOPS, "
+                  f"net {usage['net_recv_mbs'][~starved].mean():.1f} MB/s")
+    else:
+        print(f"NO DATA STARVATION node - {rank}")
+    sys.stdout.flush()
+    return {"time": times, "data_wait_fraction": wait_fraction, "starved": starved}
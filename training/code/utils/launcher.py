@@ -0,0 +1,156 @@
+import os,sys
+import argparse
+import glob
+import re
+import shutil
+import socket
+import subprocess
+import threading
+from utils.affinity import COMPUTE_CORES_ENV, WORKER_CORES_ENV, INTEROP_THREADS_ENV, format_cores
+from utils.loader_bench import parse_grid
+
+THROUGHPUT = re.compile(r"^Throughput for node - (\d+) ([0-9.]+) images/sec")
+
+
+def parse_cpulist(value):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cores = []
+    for part in value.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.extend(range(int(first), int(last) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+
+def numa_cores():
+    """{numa node: cores} restricted to the cores this process may run on, one node without NUMA info."""
+    allowed = os.sched_getaffinity(0)
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        node = int(re.search(r"node(\d+)", path).group(1))
+        with open(path) as f:
+            cores = [core for core in parse_cpulist(f.read()) if core in allowed]
+        if cores:
+            nodes[node] = cores
+    return nodes or {0: sorted(allowed)}
+
+
+def split_cores(nproc, loader_workers):
+    """Per rank: the NUMA nodes it lives on, its compute cores and the cores of its loader workers.
+
+    The cores, ordered NUMA node by NUMA node, are cut into nproc contiguous slices, so a rank
+    only spans two NUMA nodes when the ranks do not divide the nodes evenly. The loader workers
+    get the last cores of the slice, one each, as long as at least one compute core remains.
+    """
+    nodes = numa_cores()
+    ordered = [(node, core) for node, cores in sorted(nodes.items()) for core in cores]
+    per_rank = len(ordered) // nproc
+    if per_rank == 0:
+        raise AssertionError(f"{nproc} ranks for {len(ordered)} cores")
+    ranks = []
+    for rank in range(nproc):
+        slice_ = ordered[rank * per_rank:(rank + 1) * per_rank]
+        cores = [core for _, core in slice_]
+        workers = min(loader_workers, len(cores) - 1)
+        ranks.append({
+            "numa": sorted({node for node, _ in slice_}),
+            "compute": cores[:len(cores) - workers],
+            "workers": cores[len(cores) - workers:] if workers > 0 else [],
+        })
+    return ranks
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def _relay(rank, stream, results):
+    for line in iter(stream.readline, ''):
+        sys.stdout.write(f"[rank {rank}] {line}")
+        sys.stdout.flush()
+        match = THROUGHPUT.match(line)
+        if match:
+            results[rank] = float(match.group(2))
+
+
+def launch(nproc, command, loader_workers, interop_threads, membind):
+    """Starts nproc ranks of command on this host and returns the images/sec every rank reported."""
+    layout = split_cores(nproc, loader_workers)
+    port = _free_port()
+    numactl = shutil.which("numactl") if membind else None
+    procs = []
+    results = {}
+    threads = []
+    for rank, cores in enumerate(layout):
+        env = {k: v for k, v in os.environ.items() if not k.startswith("OMPI_COMM_WORLD")}
+        env.update({
+            "RANK": str(rank), "WORLD_SIZE": str(nproc), "LOCAL_RANK": str(rank), "LOCAL_WORLD_SIZE": str(nproc),
+            "MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port),
+            "OMP_NUM_THREADS": str(len(cores["compute"])), "MKL_NUM_THREADS": str(len(cores["compute"])),
+            COMPUTE_CORES_ENV: format_cores(cores["compute"]), WORKER_CORES_ENV: format_cores(cores["workers"]),
+            INTEROP_THREADS_ENV: str(interop_threads),
+        })
+        argv = list(command)
+        if numactl:
+            # keep the memory of the rank on its own NUMA nodes
+            argv = [numactl, f"--membind={format_cores(cores['numa'])}"] + argv
+        print(f"## rank {rank}: numa {format_cores(cores['numa'])}, compute cores {format_cores(cores['compute'])}, "
+              f"loader worker cores {format_cores(cores['workers']) or '-'}")
+        all_cores = cores["compute"] + cores["workers"]
+        proc = subprocess.Popen(argv, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                preexec_fn=lambda cores=all_cores: os.sched_setaffinity(0, cores))
+        procs.append(proc)
+        thread = threading.Thread(target=_relay, args=(rank, proc.stdout, results), daemon=True)
+        thread.start()
+        threads.append(thread)
+    codes = [proc.wait() for proc in procs]
+    for thread in threads:
+        thread.join()
+    if any(codes):
+        raise RuntimeError(f"ranks exited with {codes}")
+    return results
+
+
+def loader_workers_of(command):
+    """The --workers value of the training command, training.py's default otherwise."""
+    if "--workers" in command:
+        return int(command[command.index("--workers") + 1])
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='start several CPU ranks of training.py on this host with split cores and NUMA nodes')
+    parser.add_argument("--nproc", type=int, help="ranks to start", default=2)
+    parser.add_argument("--scaling", type=str, help="comma separated rank counts, runs the command once per count and reports scaling efficiency", default="")
+    parser.add_argument("--interop-threads", type=int, help="torch inter-op threads per rank", default=1)
+    parser.add_argument("--membind", help="bind the memory of every rank to its NUMA nodes with numactl when it is installed",
+                        action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="training command, e.g. -- python3 training.py --data-folder ...")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    loader_workers = loader_workers_of(command)
+
+    counts = parse_grid(args.scaling, args.nproc)
+    totals = {}
+    for nproc in counts:
+        print(f"## {nproc} ranks, {loader_workers} loader workers per rank")
+        sys.stdout.flush()
+        results = launch(nproc, command, loader_workers, args.interop_threads, args.membind)
+        totals[nproc] = sum(results.values())
+        print(f"## {nproc} ranks: {totals[nproc]:.2f} images/sec")
+    if len(totals) > 1:
+        base_count = min(totals)
+        base = totals[base_count] / base_count
+        print(f"## SCALING {socket.gethostname()} ({sum(len(c) for c in numa_cores().values())} cores, {len(numa_cores())} NUMA nodes)")
+        print(f"  {'ranks':>6} {'images/sec':>12} {'per rank':>10} {'speedup':>8} {'efficiency':>10}")
+        for nproc, total in sorted(totals.items()):
+            print(f"  {nproc:>6} {total:>12.2f} {total / nproc:>10.2f} {total / totals[base_count]:>8.2f} "
+                  f"{total / (nproc * base) * 100:>9.1f}%")
+
+
+if __name__ == '__main__':
+    main()
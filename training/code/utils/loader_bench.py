@@ -0,0 +1,93 @@
+import os,sys
+import itertools
+import time
+import numpy as np
+import psutil
+
+
+def parse_grid(value, default, cast=int):
+    """'1,2,4' -> [1, 2, 4], an empty value keeps the configured default."""
+    if not value:
+        return [default]
+    return [cast(v) for v in value.split(',') if v != '']
+
+
+def _children_cpu_seconds(proc, seen):
+    """CPU seconds the child processes spent since the last call with the same seen dict.
+
+    Children are keyed by pid and start time, so persistent workers only count the time since
+    the previous call and the fresh workers of a new epoch count all of theirs.
+    """
+    total = 0.0
+    for child in proc.children(recursive=True):
+        try:
+            times = child.cpu_times()
+            key = (child.pid, child.create_time())
+        except psutil.NoSuchProcess:
+            continue
+        cpu = times.user + times.system
+        total += cpu - seen.get(key, 0.0)
+        seen[key] = cpu
+    return total
+
+
+def measure_loader(loader, max_batches, epochs=1, set_epoch=None):
+    """Iterates the loader without a model and measures what the training loop would wait for.
+
+    Returns images/sec, the per-batch wait times in seconds and the CPU seconds the loader
+    worker processes spent per epoch, persistent or not.
+    """
+    proc = psutil.Process()
+    batches_per_epoch = len(loader) if not max_batches else min(max_batches, len(loader))
+    waits = np.empty(batches_per_epoch * epochs)
+    images = 0
+    n = 0
+    worker_cpu = 0.0
+    seen = {}
+    start_time = time.perf_counter()
+    for epoch in range(epochs):
+        if set_epoch is not None:
+            set_epoch(epoch)
+        it = iter(loader)
+        for _ in range(batches_per_epoch):
+            wait_start = time.perf_counter()
+            batch = next(it, None)
+            if batch is None:
+                break
+            waits[n] = time.perf_counter() - wait_start
+            n += 1
+            images += batch[0].size(0)
+        # read before the iterator is dropped, non persistent workers exit with it
+        worker_cpu += _children_cpu_seconds(proc, seen)
+        del it
+    elapsed = time.perf_counter() - start_time
+    return images / elapsed, waits[:n], worker_cpu / epochs
+
+
+def benchmark_loader(build_loader, grid, max_batches, epochs, set_epoch=None, rank=0):
+    """Runs measure_loader for every combination in grid and prints the best configuration.
+
+    build_loader(batch_size, workers, pf, persistent_workers) has to return the DataLoader
+    exactly as train() would build it.
+    """
+    results = []
+    for batch_size, workers, pf, persistent in itertools.product(
+            grid["batch_size"], grid["workers"], grid["pf"], grid["persistent_workers"]):
+        if workers == 0 and (persistent or pf != grid["pf"][0]):
+            # prefetch and persistence only apply to worker processes
+            continue
+        loader = build_loader(batch_size, workers, pf, bool(persistent))
+        ips, waits, worker_cpu = measure_loader(loader, max_batches, epochs, set_epoch)
+        del loader
+        p50, p95, p99 = np.percentile(waits, [50, 95, 99]) * 1000 if len(waits) else (0, 0, 0)
+        config = {"batch_size": batch_size, "workers": workers, "pf": pf, "persistent_workers": bool(persistent)}
+        results.append((ips, config))
+        print(f"LOADER BENCHMARK node - {rank} batch_size={batch_size} workers={workers} pf={pf} "
+              f"persistent_workers={bool(persistent)} : {ips:.2f} images/sec, "
+              f"wait p50 {p50:.2f} ms p95 {p95:.2f} ms p99 {p99:.2f} ms, worker cpu {worker_cpu:.2f}s/epoch")
+        sys.stdout.flush()
+    best_ips, best = max(results, key=lambda result: result[0])
+    print(f"BEST LOADER CONFIG node - {rank} " + " ".join(f"--{k.replace('_', '-')} {v}" for k, v in best.items()
+                                                       if k != "persistent_workers")
+          + (" --persistent-workers" if best["persistent_workers"] else "") + f" : {best_ips:.2f} images/sec")
+    return best
@@ -0,0 +1,89 @@
+import os,sys
+import argparse
+from collections import OrderedDict
+import numpy as np
+from utils.file_index import build_index
+from utils.samplers import SAMPLERS, LocalityDistributedSampler, ResumableDistributedSampler
+
+
+class PageCache(object):
+    """LRU cache of whole files with a byte budget, a stand-in for the page cache of one node."""
+
+    def __init__(self, capacity_bytes):
+        self.capacity = capacity_bytes
+        self.used = 0
+        self.files = OrderedDict()
+
+    def read(self, index, size):
+        """Bytes read from storage for the file, 0 on a hit."""
+        if index in self.files:
+            self.files.move_to_end(index)
+            return 0
+        self.files[index] = size
+        self.used += size
+        while self.used > self.capacity and self.files:
+            _, evicted = self.files.popitem(last=False)
+            self.used -= evicted
+        return size
+
+
+def simulate(sampler_name, sizes, nodes, ranks_per_node, epochs, cache_bytes, exchange_fraction, seed=0):
+    """Bytes every node reads from storage per epoch when the ranks of the node follow the sampler."""
+    world_size = nodes * ranks_per_node
+    dataset = range(len(sizes))
+    samplers = []
+    for rank in range(world_size):
+        if sampler_name == "locality":
+            samplers.append(LocalityDistributedSampler(dataset, ranks_per_node=ranks_per_node, exchange_fraction=exchange_fraction,
+                                                       num_replicas=world_size, rank=rank, seed=seed))
+        else:
+            samplers.append(ResumableDistributedSampler(dataset, num_replicas=world_size, rank=rank, seed=seed))
+    caches = [PageCache(cache_bytes) for _ in range(nodes)]
+    storage = np.zeros((epochs, nodes))
+    for epoch in range(epochs):
+        if sampler_name == "locality":
+            # like training.py, which keeps the default sampler on its epoch 0 order
+            for sampler in samplers:
+                sampler.set_epoch(epoch)
+        for node in range(nodes):
+            ranks = [iter(samplers[node * ranks_per_node + r]) for r in range(ranks_per_node)]
+            # the ranks of a node read in lockstep, one sample each per step
+            for step in zip(*ranks):
+                for index in step:
+                    storage[epoch, node] += caches[node].read(index, sizes[index])
+    return storage
+
+
+def benchmark(sizes, nodes, ranks_per_node, epochs, cache_gb, exchange_fraction):
+    dataset_bytes = float(np.sum(sizes))
+    print(f"## {len(sizes)} files, {dataset_bytes / 2**30:.2f} GB, {nodes} nodes x {ranks_per_node} ranks, "
+          f"{cache_gb:.2f} GB page cache per node, exchange fraction {exchange_fraction}")
+    for name in SAMPLERS:
+        storage = simulate(name, sizes, nodes, ranks_per_node, epochs, cache_gb * 2**30, exchange_fraction)
+        for epoch in range(epochs):
+            total = storage[epoch].sum()
+            print(f"## {name:<12} epoch {epoch} storage read {total / 2**30:.2f} GB "
+                  f"({total / dataset_bytes * 100:.1f}% of the dataset), per node "
+                  + " ".join(f"{b / 2**30:.2f}" for b in storage[epoch]) + " GB")
+        later = storage[1:].sum() / max(epochs - 1, 1)
+        print(f"## {name:<12} mean storage read after epoch 0 {later / 2**30:.2f} GB per epoch")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='simulate the bytes every node reads from shared storage per epoch for each sampler')
+    parser.add_argument("--data-folder", type=str, help="ImageFolder dataset whose file sizes are used", default="")
+    parser.add_argument("--num-files", type=int, help="synthetic file count without --data-folder", default=100000)
+    parser.add_argument("--mean-file-kb", type=float, help="mean synthetic file size in KB", default=110)
+    parser.add_argument("--nodes", type=int, help="nodes", default=4)
+    parser.add_argument("--ranks-per-node", type=int, help="ranks per node", default=1)
+    parser.add_argument("--epochs", type=int, help="epochs", default=4)
+    parser.add_argument("--cache-gb", type=float, help="page cache per node in GB", default=4)
+    parser.add_argument("--exchange-fraction", type=float, help="fraction of a node partition handed on between epochs", default=0.0)
+    args = parser.parse_args()
+
+    if args.data_folder:
+        sizes = np.array(build_index(args.data_folder)["sizes"], dtype=np.int64)
+    else:
+        sizes = np.random.default_rng(0).exponential(args.mean_file_kb * 1024, args.num_files).astype(np.int64) + 1
+    benchmark(sizes, args.nodes, args.ranks_per_node, args.epochs, args.cache_gb, args.exchange_fraction)
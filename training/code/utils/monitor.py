@@ -1,38 +1,112 @@
-
 import os,sys
+import csv
 import psutil
 import GPUtil
-import numpy as np
 import time
-from datetime import datetime
+from utils.io_stats import IO_COLUMNS, IOSampler
+from utils.telemetry import TelemetryPusher
+
+MONITOR_FILE = "monitor_out.csv"
+PROCS_FILE = "monitor_procs.csv"
+
+
+BASE_COLUMNS = ["time", "cpu", "mem", "proc_cpu", "proc_rss_mb"] + IO_COLUMNS
+
+
+def monitor_columns(num_gpus):
+    return (BASE_COLUMNS
+            + [f"gpu{i}" for i in range(num_gpus)]
+            + [f"gpu{i}_mem" for i in range(num_gpus)])
+
+
+class ProcessTree(object):
+    """CPU, RSS and reads of a process and all its descendants, e.g. the training ranks and loader workers.
+
+    read_chars and read_bytes accumulate what the tree read through read() and from storage,
+    they keep growing when processes exit.
+    """
+
+    def __init__(self, root_pid, exclude=()):
+        self.root = psutil.Process(root_pid)
+        self.exclude = set(exclude)
+        self.procs = {}
+        self.io = {}
+        self.read_chars = 0
+        self.read_bytes = 0
+
+    def sample(self):
+        try:
+            current = [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        samples = []
+        for proc in current:
+            if proc.pid in self.exclude:
+                continue
+            # keep the Process objects, cpu_percent() is measured since the previous call on the same object
+            proc = self.procs.setdefault(proc.pid, proc)
+            try:
+                with proc.oneshot():
+                    cpu, rss = proc.cpu_percent(None), proc.memory_info().rss
+                    try:
+                        io = proc.io_counters()
+                        read_bytes, read_chars = io.read_bytes, getattr(io, "read_chars", io.read_bytes)
+                    except psutil.AccessDenied:
+                        read_bytes = read_chars = 0
+                samples.append((proc.pid, proc.name(), cpu, rss, read_bytes, read_chars))
+            except psutil.NoSuchProcess:
+                pass
+        for pid, _, _, _, read_bytes, read_chars in samples:
+            prev_bytes, prev_chars = self.io.get(pid, (0, 0))
+            self.read_bytes += max(read_bytes - prev_bytes, 0)
+            self.read_chars += max(read_chars - prev_chars, 0)
+        self.io = {pid: (read_bytes, read_chars) for pid, _, _, _, read_bytes, read_chars in samples}
+        self.procs = {pid: proc for pid, proc in self.procs.items() if pid in self.io}
+        return samples
+
+
+def monitor(output_folder, interval, root_pid, num_gpus, stop_event, dataset_path="/", collector=None):
+    """Samples system, I/O, process tree and GPU usage every interval seconds until stop_event is set.
 
-def monitor(dates, gpu_usages, cpu_usages, mem_usages, output_folder):
+    Samples are streamed as CSV through one open file, per-process samples of the tree go to a
+    second CSV. The I/O columns describe the mount of dataset_path. With
+    collector=(host, port, node) every sample is also pushed to the cluster collector.
+    """
     print("MONITORING STARTED")
     sys.stdout.flush()
-    while 1:
-        cpu_usage = psutil.cpu_percent()
-        cpu_usages.append(cpu_usage)
-        mem_usage = psutil.virtual_memory().percent
-        mem_usages.append(mem_usage)
-        #os.path.expanduser('~') + f"/experiments/{output_folder}/{name}"
-        with open(os.path.curdir + f"/{output_folder}/monitor_out.txt", 'a') as f:
-            f.write('\n')
-            timestamp = datetime.now()
-            dates.append(timestamp)
-            f.write(timestamp.strftime("%Y-%m-%d-%H:%M:%S"))
-            f.write('\n')
-            f.write(f"CPU {cpu_usage}% ",)
-            f.write(f"MEMORY {mem_usage}% ")
-            f.write("GPU")
-            f.write('\n')
-            gpus = GPUtil.getGPUs()
-            f.write(' ID  GPU  MEM')
-            f.write('\n')
-            f.write('--------------')
-            f.write('\n')
-            for gpu in gpus: 
-                gpu_usages[int(gpu.id)].append(gpu.load*100)   
-                f.write(' {0:2d} {1:3.0f}% {2:3.0f}%'.format(gpu.id, gpu.load*100, gpu.memoryUtil*100))
-                f.write('\n')
-            # GPUtil.showUtilization()
-        time.sleep(15)
+    columns = monitor_columns(num_gpus)
+    tree = ProcessTree(root_pid, exclude=[os.getpid()])
+    io_sampler = IOSampler(dataset_path)
+    psutil.cpu_percent(None)
+    tree.sample()
+    io_sampler.sample(time.time(), tree.read_chars, tree.read_bytes)
+    pusher = TelemetryPusher(*collector, columns) if collector else None
+    with open(os.path.join(output_folder, MONITOR_FILE), 'w', buffering=1, newline='') as f, \
+            open(os.path.join(output_folder, PROCS_FILE), 'w', buffering=1, newline='') as procs_file:
+        # process names can hold commas, the writer quotes them
+        writer = csv.writer(f, lineterminator="\n")
+        procs_writer = csv.writer(procs_file, lineterminator="\n")
+        writer.writerow(columns)
+        procs_writer.writerow(["time", "pid", "name", "cpu", "rss_mb", "read_mb", "read_chars_mb"])
+        next_tick = time.time()
+        while not stop_event.is_set():
+            timestamp = time.time()
+            procs = tree.sample()
+            record = [timestamp, psutil.cpu_percent(None), psutil.virtual_memory().percent,
+                      sum(p[2] for p in procs), sum(p[3] for p in procs) / 2**20]
+            record += io_sampler.sample(timestamp, tree.read_chars, tree.read_bytes)
+            if num_gpus:
+                # GPUtil runs nvidia-smi, call it once per tick
+                gpus = GPUtil.getGPUs()[:num_gpus]
+                record += [gpu.load * 100 for gpu in gpus] + [0.0] * (num_gpus - len(gpus))
+                record += [gpu.memoryUtil * 100 for gpu in gpus] + [0.0] * (num_gpus - len(gpus))
+            if pusher is not None:
+                pusher.push(record)
+            writer.writerow([f"{v:.3f}" for v in record])
+            procs_writer.writerows([f"{timestamp:.3f}", pid, name, f"{cpu:.1f}", f"{rss / 2**20:.1f}",
+                                    f"{read_bytes / 2**20:.1f}", f"{read_chars / 2**20:.1f}"]
+                                   for pid, name, cpu, rss, read_bytes, read_chars in procs)
+            next_tick += interval
+            stop_event.wait(max(next_tick - time.time(), 0))
+    if pusher is not None:
+        pusher.close()
@@ -0,0 +1,163 @@
+import os,sys
+import argparse
+import bisect
+import json
+import time
+import numpy as np
+import torch
+import torchvision as tv
+import torchvision.transforms as transforms
+from torch.utils.data import Dataset
+from torch.utils.data import DataLoader as dl
+
+INDEX_FILE = "index.json"
+LABELS_FILE = "labels.npy"
+SHARD_FILE = "shard_{:05d}.npy"
+
+
+def _to_array(image):
+    # module level so that it can be pickled into spawned loader workers
+    return np.asarray(image, dtype=np.uint8)
+
+
+def convert(dataset_folder, output_folder, shard_size=1024, image_size=224, workers=1):
+    """Decode and resize an ImageFolder tree once into uint8 NHWC shards plus a label index."""
+    os.makedirs(output_folder, exist_ok=True)
+    dataset = tv.datasets.ImageFolder(dataset_folder, transform=transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        _to_array,
+    ]))
+    # every loader batch becomes exactly one shard, the last one may be smaller
+    loader = dl(dataset, batch_size=shard_size, shuffle=False, num_workers=workers)
+
+    shards = []
+    labels = []
+    start_time = time.time()
+    for i, (images, targets) in enumerate(loader):
+        filename = SHARD_FILE.format(i)
+        tmp_path = os.path.join(output_folder, filename + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.save(f, images.numpy())
+        os.replace(tmp_path, os.path.join(output_folder, filename))
+        shards.append({"file": filename, "count": int(images.size(0))})
+        labels.append(targets.numpy().astype(np.int64))
+        print(f"## Wrote {filename} ({sum(s['count'] for s in shards)}/{len(dataset)} images)")
+        sys.stdout.flush()
+
+    np.save(os.path.join(output_folder, LABELS_FILE), np.concatenate(labels) if labels else np.zeros(0, dtype=np.int64))
+    index = {
+        "source": os.path.abspath(dataset_folder),
+        "image_size": image_size,
+        "num_samples": len(dataset),
+        "classes": dataset.classes,
+        "class_to_idx": dataset.class_to_idx,
+        "shards": shards,
+    }
+    # the index is written last so that a folder with an index is always complete
+    with open(os.path.join(output_folder, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+    elapsed = time.time() - start_time
+    print(f"## Packed {len(dataset)} images into {len(shards)} shards in {elapsed:.1f}s")
+
+
+class PackedDataset(Dataset):
+    """Dataset over shards written by convert(), samples are sliced from memory-mapped arrays.
+
+    Shards are opened lazily so that every DataLoader worker maps them on its own instead of
+    inheriting (or pickling) the mappings of the main process. With image_size set, shards
+    packed at another size are rejected.
+    """
+
+    def __init__(self, root, transform=None, target_transform=None, image_size=None):
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            index = json.load(f)
+        if image_size is not None and index["image_size"] != image_size:
+            raise ValueError(f"{root} holds {index['image_size']}x{index['image_size']} images, "
+                             f"expected {image_size}x{image_size}, repack it with --image-size {image_size}")
+        self.root = root
+        self.transform = transform
+        self.target_transform = target_transform
+        self.image_size = index["image_size"]
+        self.classes = index["classes"]
+        self.class_to_idx = index["class_to_idx"]
+        self.shard_files = [shard["file"] for shard in index["shards"]]
+        self.offsets = np.cumsum([0] + [shard["count"] for shard in index["shards"]]).tolist()
+        self.targets = np.load(os.path.join(root, LABELS_FILE)).tolist()
+        self._shards = None
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def _open_shards(self):
+        self._shards = [np.load(os.path.join(self.root, f), mmap_mode='r') for f in self.shard_files]
+
+    def __getitem__(self, index):
+        if self._shards is None:
+            self._open_shards()
+        shard = bisect.bisect_right(self.offsets, index) - 1
+        # copy out of the read-only mapping, transforms expect a writable array
+        sample = np.array(self._shards[shard][index - self.offsets[shard]])
+        target = self.targets[index]
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return sample, target
+
+
+def measure_throughput(dataset, batch_size, workers, pf, max_batches):
+    kwargs = {"prefetch_factor": pf} if workers > 0 else {}
+    loader = dl(dataset, batch_size=batch_size, shuffle=True, num_workers=workers, **kwargs)
+    images = 0
+    start_time = time.time()
+    for i, (batch, _) in enumerate(loader):
+        images += batch.size(0)
+        if max_batches and i + 1 >= max_batches:
+            break
+    return images / (time.time() - start_time)
+
+
+def benchmark(dataset_folder, packed_folder, batch_size, workers, pf, max_batches):
+    normalize = transforms.Normalize(
+        mean=[0.4914, 0.4822, 0.4465],
+        std=[0.2023, 0.1994, 0.2010],
+    )
+    image_folder = tv.datasets.ImageFolder(dataset_folder, transform=transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        normalize,
+    ]))
+    packed = PackedDataset(packed_folder, transform=transforms.Compose([
+        transforms.ToTensor(),
+        normalize,
+    ]), image_size=224)
+    folder_ips = measure_throughput(image_folder, batch_size, workers, pf, max_batches)
+    print(f"## imagefolder {folder_ips:.2f} images/sec")
+    packed_ips = measure_throughput(packed, batch_size, workers, pf, max_batches)
+    print(f"## packed {packed_ips:.2f} images/sec")
+    print(f"## speedup {packed_ips / folder_ips:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert an ImageFolder dataset into packed uint8 shards')
+    parser.add_argument("--data-folder", type=str, help="ImageFolder dataset to convert", required=True)
+    parser.add_argument("--output-folder", type=str, help="folder for the packed shards", required=True)
+    parser.add_argument("--shard-size", type=int, help="images per shard", default=1024)
+    parser.add_argument("--image-size", type=int, help="height and width of the stored images", default=224)
+    parser.add_argument("--workers", type=int, help="decode workers", default=4)
+    parser.add_argument("--benchmark", help="compare loader throughput of the ImageFolder and the packed dataset",
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--batch-size", type=int, help="benchmark batch size", default=16)
+    parser.add_argument("--pf", type=int, help="benchmark prefetch factor", default=2)
+    parser.add_argument("--batches", type=int, help="benchmark batches per dataset, 0 for a full pass", default=0)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.data_folder, args.output_folder, args.batch_size, args.workers, args.pf, args.batches)
+    else:
+        convert(args.data_folder, args.output_folder, args.shard_size, args.image_size, args.workers)
@@ -0,0 +1,81 @@
+import os,sys
+import contextlib
+import torch
+
+AMP_DTYPES = ["auto", "fp16", "bf16"]
+
+
+class PerfMode(object):
+    """Mixed precision, channels_last and torch.compile for the training step.
+
+    CPU autocasts to bf16. CUDA autocasts to fp16 with a GradScaler, or to bf16 which needs no
+    scaling. A disabled PerfMode leaves every call as the plain fp32 NCHW eager code path.
+    """
+
+    def __init__(self, device, enabled=False, amp_dtype="auto", compile_model=False):
+        self.enabled = enabled
+        self.device = device
+        self.compile_model = enabled and compile_model
+        if self.compile_model and not hasattr(torch, "compile"):
+            # decided here so that describe() reports the mode that actually runs
+            print(f"torch.compile is not available in torch {torch.__version__}, running eager")
+            sys.stdout.flush()
+            self.compile_model = False
+        cuda = device.type == "cuda"
+        if amp_dtype == "auto":
+            amp_dtype = "fp16" if cuda else "bf16"
+        if not cuda and amp_dtype == "fp16":
+            # CPU autocast only supports bf16
+            amp_dtype = "bf16"
+        self.dtype = torch.float16 if amp_dtype == "fp16" else torch.bfloat16
+        self.scaler = torch.cuda.amp.GradScaler() if enabled and cuda and self.dtype == torch.float16 else None
+
+    def describe(self):
+        if not self.enabled:
+            return "fp32 NCHW eager"
+        precision = "fp16" if self.dtype == torch.float16 else "bf16"
+        return (f"{precision} autocast{' + GradScaler' if self.scaler is not None else ''} channels_last "
+                + ("compiled" if self.compile_model else "eager"))
+
+    def relax_determinism(self):
+        """Lets cuDNN pick the fastest algorithms and allows TF32 matmuls, only in perf mode."""
+        if not self.enabled:
+            return
+        torch.backends.cudnn.deterministic = False
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+
+    def prepare_model(self, model):
+        if not self.enabled:
+            return model
+        return model.to(memory_format=torch.channels_last)
+
+    def compile(self, model):
+        """torch.compile when requested and available (torch >= 2.0), the model itself otherwise."""
+        if not self.compile_model:
+            return model
+        return torch.compile(model)
+
+    def prepare_input(self, images):
+        if not self.enabled:
+            return images
+        return images.contiguous(memory_format=torch.channels_last)
+
+    def autocast(self):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=self.dtype)
+
+    def backward(self, loss):
+        if self.scaler is not None:
+            self.scaler.scale(loss).backward()
+        else:
+            loss.backward()
+
+    def step(self, optimizer):
+        if self.scaler is not None:
+            self.scaler.step(optimizer)
+            self.scaler.update()
+        else:
+            optimizer.step()
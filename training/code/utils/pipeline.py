@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+import torch.utils.data
+import torchvision.transforms.functional as F
+
+
+class ToUint8Tensor(object):
+    """Converts a PIL image or an HWC uint8 array into a CHW uint8 tensor, without scaling."""
+
+    def __call__(self, pic):
+        if isinstance(pic, torch.Tensor):
+            return pic
+        if isinstance(pic, np.ndarray):
+            return torch.from_numpy(pic).permute(2, 0, 1)
+        return F.pil_to_tensor(pic)
+
+
+class ToFloatTensor(object):
+    """ToTensor that also accepts CHW uint8 tensors, as produced by the torchvision decoder."""
+
+    def __call__(self, pic):
+        if isinstance(pic, torch.Tensor):
+            return F.convert_image_dtype(pic, torch.float)
+        return F.to_tensor(pic)
+
+
+def uint8_collate(batch):
+    """Stacks uint8 samples into one contiguous batch.
+
+    Inside a loader worker the batch is allocated in shared memory directly, like the default
+    collate does, so it is handed to the main process without another copy.
+    """
+    shape = (len(batch),) + tuple(batch[0][0].shape)
+    if torch.utils.data.get_worker_info() is not None:
+        images = torch.empty(shape, dtype=torch.uint8).share_memory_()
+    else:
+        images = torch.empty(shape, dtype=torch.uint8)
+    for i, (image, _) in enumerate(batch):
+        images[i].copy_(image)
+    labels = torch.tensor([label for _, label in batch], dtype=torch.int64)
+    return images, labels
+
+
+class DeviceNormalize(object):
+    """Float conversion and mean/std normalization of a whole uint8 batch on the target device."""
+
+    def __init__(self, mean, std, device):
+        # (x / 255 - mean) / std == (x - 255 * mean) / (255 * std)
+        self.mean = torch.tensor(mean, device=device).view(1, -1, 1, 1) * 255
+        self.std = torch.tensor(std, device=device).view(1, -1, 1, 1) * 255
+
+    def __call__(self, images):
+        return images.float().sub_(self.mean).div_(self.std)
@@ -0,0 +1,257 @@
+import os,sys
+import fcntl
+import hashlib
+import socket
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.utils.data
+from torch.utils.data import Dataset
+
+CACHE_MAGIC = 0x6e61696361636865
+# magic, num_samples, num_slots, num_clients, height, width, channels, clock hand
+HEADER_FIELDS = 8
+HAND = 7
+HIT, MISS, EVICT = 0, 1, 2
+# set by the launchers: Open MPI, torchrun, MPICH and Intel MPI
+LOCAL_SIZE_VARIABLES = ["OMPI_COMM_WORLD_LOCAL_SIZE", "LOCAL_WORLD_SIZE", "MPI_LOCALNRANKS"]
+_local_world_size = None
+# set by the launchers: Slurm, Open MPI 5 and 4, torchrun, and the rendezvous port as a last resort
+JOB_ID_VARIABLES = ["SLURM_JOB_ID", "PMIX_NAMESPACE", "OMPI_MCA_orte_ess_jobid", "TORCHELASTIC_RUN_ID", "MASTER_PORT"]
+
+
+def job_id():
+    """Id of the running job, the same on all of its ranks, empty when no launcher sets one."""
+    for name in JOB_ID_VARIABLES:
+        value = os.environ.get(name, "")
+        if value and value != "none":
+            return value
+    return ""
+
+
+def cache_path(cache_dir, dataset_folder):
+    # one file per dataset and job, two jobs on a node never share or remove each other's cache
+    key = hashlib.sha1(f"{os.path.abspath(dataset_folder)}:{job_id()}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"nai-dl-bench-{key}.cache")
+
+
+def local_world_size():
+    """Ranks on this host, from the launcher environment or by counting the hostnames of the process group.
+
+    The count is a collective, without one of LOCAL_SIZE_VARIABLES every rank has to call this.
+    """
+    global _local_world_size
+    if _local_world_size is None:
+        for name in LOCAL_SIZE_VARIABLES:
+            if name in os.environ:
+                _local_world_size = int(os.environ[name])
+                break
+        else:
+            if dist.is_available() and dist.is_initialized():
+                hosts = [None] * dist.get_world_size()
+                dist.all_gather_object(hosts, socket.gethostname())
+                _local_world_size = hosts.count(socket.gethostname())
+            else:
+                _local_world_size = 1
+    return _local_world_size
+
+
+def remove_cache(path):
+    """Unlinks the cache file, the /dev/shm memory is freed once no process maps it any more."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _layout(num_samples, num_slots, num_clients, sample_shape):
+    # (name, dtype, shape) of every array in the file, in file order
+    return [
+        ("header", np.int64, (HEADER_FIELDS,)),
+        ("sample_slot", np.int64, (num_samples,)),
+        ("slot_owner", np.int64, (num_slots,)),
+        ("slot_seq", np.int64, (num_slots,)),
+        ("slot_ref", np.uint8, (num_slots,)),
+        ("stats", np.int64, (num_clients, 3)),
+        ("data", np.uint8, (num_slots,) + tuple(sample_shape)),
+    ]
+
+
+def _offsets(layout):
+    offsets = []
+    offset = 0
+    for name, dtype, shape in layout:
+        # keep every array 64 byte aligned
+        offset = (offset + 63) // 64 * 64
+        offsets.append(offset)
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return offsets, offset
+
+
+def _map(path, layout):
+    offsets, _ = _offsets(layout)
+    return {name: np.memmap(path, dtype=dtype, mode='r+', offset=offset, shape=shape)
+            for (name, dtype, shape), offset in zip(layout, offsets)}
+
+
+def create_cache(path, num_samples, budget_bytes, sample_shape=(224, 224, 3), num_clients=1):
+    """Create the node-wide cache file, called by a single process per node.
+
+    Fails when the file exists, it belongs to another job or to one that was killed before it
+    could remove it.
+    """
+    sample_bytes = int(np.prod(sample_shape))
+    num_slots = max(1, min(num_samples, budget_bytes // sample_bytes))
+    layout = _layout(num_samples, num_slots, num_clients, sample_shape)
+    _, size = _offsets(layout)
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        raise RuntimeError(f"sample cache {path} already exists, another job is using it or a killed run left it "
+                           f"behind, remove it if no job is running") from None
+    with os.fdopen(fd, 'wb') as f:
+        # sparse file, tmpfs pages are only allocated once a slot is written
+        f.truncate(size)
+    arrays = _map(path, layout)
+    arrays["sample_slot"][:] = -1
+    arrays["slot_owner"][:] = -1
+    arrays["header"][:] = [CACHE_MAGIC, num_samples, num_slots, num_clients, *sample_shape, 0]
+    for array in arrays.values():
+        array.flush()
+    return num_slots
+
+
+class SharedSampleCache(Dataset):
+    """Wraps a dataset and keeps its preprocessed uint8 samples once per node in a memory-mapped file.
+
+    With the file under /dev/shm every rank and DataLoader worker on the host maps the same pages,
+    a hit is served straight from the mapping without decoding. Once the byte budget is used up,
+    slots are recycled with the CLOCK policy. Readers are lock-free and validate a per-slot
+    sequence number, writers serialize on an flock of the cache file.
+    """
+
+    def __init__(self, dataset, path, pre_transform=None, transform=None, client=0, clients_per_rank=1):
+        self.dataset = dataset
+        self.path = path
+        self.pre_transform = pre_transform
+        self.transform = transform
+        self.client = client
+        self.clients_per_rank = clients_per_rank
+        self.classes = dataset.classes
+        self.class_to_idx = dataset.class_to_idx
+        self.targets = dataset.targets
+        self._arrays = None
+        self._lock_fd = None
+        self._last_stats = np.zeros(3, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        state["_lock_fd"] = None
+        return state
+
+    def _open(self):
+        header = np.fromfile(self.path, dtype=np.int64, count=HEADER_FIELDS)
+        if header[0] != CACHE_MAGIC:
+            raise RuntimeError(f"{self.path} is not a sample cache")
+        num_samples, num_slots, num_clients = (int(v) for v in header[1:4])
+        sample_shape = tuple(int(v) for v in header[4:7])
+        self.num_slots = num_slots
+        self.sample_bytes = int(np.prod(sample_shape))
+        self._arrays = _map(self.path, _layout(num_samples, num_slots, num_clients, sample_shape))
+        self._lock_fd = os.open(self.path, os.O_RDWR)
+
+    def _stats_row(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker = 0 if worker_info is None else worker_info.id + 1
+        row = self.client * self.clients_per_rank + worker
+        if worker >= self.clients_per_rank or row >= len(self._arrays["stats"]):
+            raise RuntimeError(f"local rank {self.client} worker {worker} has no stats row in {self.path}, "
+                               f"it was created for {len(self._arrays['stats'])} processes")
+        return row
+
+    def _lookup(self, index):
+        arrays = self._arrays
+        slot = arrays["sample_slot"][index]
+        if slot < 0:
+            return None
+        seq = arrays["slot_seq"][slot]
+        if seq % 2 or arrays["slot_owner"][slot] != index:
+            return None
+        sample = np.array(arrays["data"][slot])
+        # a writer recycled the slot while we were copying
+        if arrays["slot_seq"][slot] != seq:
+            return None
+        arrays["slot_ref"][slot] = 1
+        return sample
+
+    def _insert(self, index, sample):
+        arrays = self._arrays
+        evicted = 0
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            if arrays["sample_slot"][index] >= 0:
+                return evicted
+            header = arrays["header"]
+            hand = int(header[HAND])
+            while True:
+                owner = arrays["slot_owner"][hand]
+                if owner < 0 or not arrays["slot_ref"][hand]:
+                    break
+                arrays["slot_ref"][hand] = 0
+                hand = (hand + 1) % self.num_slots
+            slot = hand
+            header[HAND] = (hand + 1) % self.num_slots
+            if owner >= 0:
+                arrays["sample_slot"][owner] = -1
+                evicted = 1
+            arrays["slot_seq"][slot] += 1
+            arrays["slot_owner"][slot] = index
+            arrays["data"][slot] = sample
+            arrays["slot_seq"][slot] += 1
+            arrays["slot_ref"][slot] = 1
+            arrays["sample_slot"][index] = slot
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        return evicted
+
+    def __getitem__(self, index):
+        if self._arrays is None:
+            self._open()
+        stats = self._arrays["stats"][self._stats_row()]
+        sample = self._lookup(index)
+        if sample is not None:
+            target = self.targets[index]
+            stats[HIT] += 1
+        else:
+            image, target = self.dataset[index]
+            if self.pre_transform is not None:
+                image = self.pre_transform(image)
+            if isinstance(image, torch.Tensor):
+                image = image.permute(1, 2, 0)
+            sample = np.asarray(image, dtype=np.uint8)
+            stats[EVICT] += self._insert(index, sample)
+            stats[MISS] += 1
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample, target
+
+    def report(self):
+        """Node-wide hits, misses and evictions since the previous call, and the resident bytes."""
+        if self._arrays is None:
+            self._open()
+        totals = np.asarray(self._arrays["stats"]).sum(axis=0)
+        delta = totals - self._last_stats
+        self._last_stats = totals
+        resident = int((np.asarray(self._arrays["slot_owner"]) >= 0).sum()) * self.sample_bytes
+        return int(delta[HIT]), int(delta[MISS]), int(delta[EVICT]), resident
+
+    def print_report(self, epoch):
+        hits, misses, evictions, resident = self.report()
+        lookups = max(hits + misses, 1)
+        print(f"Epoch {epoch} sample cache - hit rate {100 * hits / lookups:.1f}% ({hits}/{lookups}), "
+              f"evictions {evictions}, resident {resident / 2**20:.1f} MiB")
+        sys.stdout.flush()
@@ -0,0 +1,96 @@
+import os,sys
+import math
+import numpy as np
+from torch.utils.data.distributed import DistributedSampler
+
+SAMPLERS = ["distributed", "locality"]
+
+
+class ResumableDistributedSampler(DistributedSampler):
+    """DistributedSampler that can continue an epoch part way through, for --resume.
+
+    set_start(n) makes the next iteration skip the first n indices of this rank. Later
+    iterations are complete again, and without set_start the order is exactly the one of
+    DistributedSampler.
+    """
+
+    def __init__(self, dataset, **kwargs):
+        super().__init__(dataset, **kwargs)
+        self.start_index = 0
+
+    def set_start(self, start_index):
+        self.start_index = start_index
+
+    def _indices(self):
+        return list(super().__iter__())
+
+    def __iter__(self):
+        indices = self._indices()[self.start_index:]
+        self.start_index = 0
+        return iter(indices)
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+
+class LocalityDistributedSampler(ResumableDistributedSampler):
+    """Keeps every node on a stable partition of the dataset so its page cache stays useful.
+
+    The dataset is split once, with a seeded permutation, into one partition per node. Every
+    epoch a partition is shuffled and dealt to the ranks of its node. With exchange_fraction > 0
+    each node hands that fraction of its partition to the next node (in a ring) before every
+    epoch, so over time every sample still meets every node. Ranks are assumed to be placed
+    node by node, rank // ranks_per_node is the node. set_epoch() has to be called every epoch.
+    """
+
+    def __init__(self, dataset, ranks_per_node=1, exchange_fraction=0.0, **kwargs):
+        super().__init__(dataset, **kwargs)
+        self.ranks_per_node = ranks_per_node
+        self.num_nodes = max(self.num_replicas // ranks_per_node, 1)
+        self.node = self.rank // ranks_per_node
+        self.local_rank = self.rank % ranks_per_node
+        self.exchange_fraction = exchange_fraction
+        rng = np.random.default_rng(self.seed)
+        self._partitions = np.array_split(rng.permutation(len(self.dataset)), self.num_nodes)
+        self._partitions_epoch = 0
+
+    def partitions(self, epoch):
+        """The partition of every node in epoch, the exchanges are replayed from the last epoch asked for."""
+        if epoch < self._partitions_epoch:
+            rng = np.random.default_rng(self.seed)
+            self._partitions = np.array_split(rng.permutation(len(self.dataset)), self.num_nodes)
+            self._partitions_epoch = 0
+        while self._partitions_epoch < epoch:
+            self._partitions_epoch += 1
+            if self.exchange_fraction > 0 and self.num_nodes > 1:
+                rng = np.random.default_rng((self.seed, self._partitions_epoch))
+                shuffled = [rng.permutation(p) for p in self._partitions]
+                counts = [int(len(p) * self.exchange_fraction) for p in shuffled]
+                # node n keeps the tail of its partition and receives the head of node n - 1
+                self._partitions = [np.concatenate([shuffled[n][counts[n]:], shuffled[n - 1][:counts[n - 1]]])
+                                    for n in range(self.num_nodes)]
+        return self._partitions
+
+    def _indices(self):
+        # every rank needs num_samples indices so that all ranks run the same number of steps
+        per_node = self.num_samples * self.ranks_per_node
+        partitions = self.partitions(self.epoch)
+        if self.shuffle:
+            partitions = [np.random.default_rng((self.seed, self.epoch, node)).permutation(p)
+                          for node, p in enumerate(partitions)]
+        # exchanges leave some partitions longer than a node can read in an epoch, their surplus
+        # fills the nodes that are short, in node order, instead of being dropped
+        surplus = np.concatenate([p[per_node:] for p in partitions])
+        start = sum(max(per_node - len(p), 0) for p in partitions[:self.node])
+        partition = partitions[self.node][:per_node]
+        room = per_node - len(partition)
+        partition = np.concatenate([partition, surplus[start:start + room]])
+        if len(partition) < per_node:
+            partition = np.resize(partition, per_node)
+        return partition[self.local_rank:per_node:self.ranks_per_node].tolist()
+
+
+def build_sampler(name, dataset, ranks_per_node=1, exchange_fraction=0.0):
+    if name == "locality":
+        return LocalityDistributedSampler(dataset, ranks_per_node=ranks_per_node, exchange_fraction=exchange_fraction)
+    return ResumableDistributedSampler(dataset)
@@ -0,0 +1,236 @@
+import os,sys
+import argparse
+import hashlib
+import shutil
+import threading
+import time
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader as dl
+from utils.file_index import image_folder
+from utils.loader_bench import measure_loader
+
+
+def stage_root(stage_dir, dataset_folder):
+    key = hashlib.sha1(os.path.abspath(dataset_folder).encode()).hexdigest()[:16]
+    return os.path.join(stage_dir, f"nai-dl-bench-{key}")
+
+
+class StagedLoader(object):
+    """Image loader that reads the node-local copy of a file once it is staged, the original otherwise.
+
+    Staged files only appear through a rename, so a file that exists is complete. A staged file
+    removed between the check and the read is read from the original.
+    """
+
+    def __init__(self, loader, source_root, stage_root):
+        self.loader = loader
+        self.source_root = source_root
+        self.stage_root = stage_root
+
+    def __call__(self, path):
+        staged = os.path.join(self.stage_root, os.path.relpath(path, self.source_root))
+        if os.path.exists(staged):
+            try:
+                return self.loader(staged)
+            except FileNotFoundError:
+                pass
+        return self.loader(path)
+
+
+class Stager(object):
+    """Copies files from shared storage to a node-local folder with a pool of threads, in read order.
+
+    Files are copied in the order they are given, which is the order the rank reads them, so
+    training can start right away and reads more and more local copies while the rest is copied
+    in the background. Files another rank of the node already staged are skipped. Nothing is
+    copied when the files left to stage do not fit in the free space of the stage folder, and
+    files that fail to copy are counted, the loader keeps reading them from shared storage.
+    """
+
+    def __init__(self, source_root, stage_root, rel_paths, workers=8, rank=0):
+        self.source_root = source_root
+        self.stage_root = stage_root
+        self.rel_paths = rel_paths
+        self.workers = workers
+        self.rank = rank
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.skipped_files = 0
+        self.failed_files = 0
+        self.error = None
+        self.elapsed = 0.0
+        self._next = 0
+        self._stop = False
+        self._lock = threading.Lock()
+        self._threads = []
+        self._finished = threading.Event()
+        self._start_time = None
+
+    def start(self):
+        self._start_time = time.time()
+        # the space check stats every file on the shared storage, training does not wait for it
+        threading.Thread(target=self._supervise, daemon=True).start()
+        return self
+
+    def _bytes_to_copy(self):
+        total = 0
+        for rel_path in self.rel_paths:
+            try:
+                size = os.path.getsize(os.path.join(self.source_root, rel_path))
+            except OSError:
+                # counted as failed when its copy is attempted
+                continue
+            dst = os.path.join(self.stage_root, rel_path)
+            if not (os.path.exists(dst) and os.path.getsize(dst) == size):
+                total += size
+        return total
+
+    def _supervise(self):
+        try:
+            os.makedirs(self.stage_root, exist_ok=True)
+            needed = self._bytes_to_copy()
+            free = shutil.disk_usage(self.stage_root).free
+        except OSError as e:
+            needed, free = None, None
+            self.error = str(e)
+        if needed is not None and needed > free:
+            self.error = (f"{needed / 2**30:.2f} GB left to stage but only {free / 2**30:.2f} GB free "
+                          f"in {self.stage_root}, nothing staged")
+        if self.error is None:
+            self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            for thread in self._threads:
+                thread.join()
+        self.elapsed = time.time() - self._start_time
+        self._finished.set()
+        print(self.report())
+        sys.stdout.flush()
+
+    def _take(self):
+        with self._lock:
+            if self._stop or self._next >= len(self.rel_paths):
+                return None
+            self._next += 1
+            return self.rel_paths[self._next - 1]
+
+    def _copy(self, rel_path):
+        src = os.path.join(self.source_root, rel_path)
+        dst = os.path.join(self.stage_root, rel_path)
+        size = os.path.getsize(src)
+        if os.path.exists(dst) and os.path.getsize(dst) == size:
+            return None
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return size
+
+    def _run(self):
+        while True:
+            rel_path = self._take()
+            if rel_path is None:
+                return
+            try:
+                size = self._copy(rel_path)
+            except OSError as e:
+                with self._lock:
+                    self.failed_files += 1
+                    self.error = self.error or f"{rel_path}: {e}"
+                continue
+            with self._lock:
+                if size is None:
+                    self.skipped_files += 1
+                else:
+                    self.copied_files += 1
+                    self.copied_bytes += size
+
+    def wait(self):
+        """Waits until every file is staged, raises when staging was skipped or some files failed."""
+        self._finished.wait()
+        if self.error is not None:
+            raise RuntimeError(f"staging to {self.stage_root} failed: {self.report()}")
+
+    def stop(self):
+        """Stops handing out files and waits for the copies in flight."""
+        with self._lock:
+            self._stop = True
+        self._finished.wait()
+
+    def remove(self):
+        shutil.rmtree(self.stage_root, ignore_errors=True)
+
+    def done(self):
+        return self._finished.is_set()
+
+    def report(self):
+        elapsed = self.elapsed or time.time() - self._start_time
+        report = (f"STAGING node - {self.rank} {'done' if self.done() else 'running'}: {self.copied_files} files copied "
+                  f"({self.copied_bytes / 2**30:.2f} GB), {self.skipped_files} already staged, {elapsed:.1f}s, "
+                  f"{self.copied_bytes / 2**20 / max(elapsed, 1e-6):.1f} MB/s, "
+                  f"{self.copied_files / max(elapsed, 1e-6):.1f} files/s")
+        if self.failed_files:
+            report += f", {self.failed_files} failed ({self.error})"
+        elif self.error is not None:
+            report += f" ({self.error})"
+        return report
+
+
+def start_staging(dataset, sampler, dataset_folder, stage_folder, workers, rank):
+    """Stages the files of the rank's shard in the order of its first epoch."""
+    samples = dataset.samples if hasattr(dataset, "samples") else dataset.dataset.samples
+    rel_paths = []
+    seen = set()
+    for index in list(iter(sampler)):
+        if index not in seen:
+            seen.add(index)
+            rel_paths.append(os.path.relpath(samples[index][0], dataset_folder))
+    print(f"STAGING node - {rank} {len(rel_paths)} files to {stage_folder} with {workers} threads")
+    sys.stdout.flush()
+    return Stager(dataset_folder, stage_folder, rel_paths, workers, rank).start()
+
+
+def benchmark(data_folder, stage_dir, workers, copy_workers, batch_size, max_batches, keep=False):
+    transform = transforms.Compose([transforms.Resize((224, 224)), transforms.ToTensor()])
+    folder = stage_root(stage_dir, data_folder)
+
+    def loader(staged):
+        dataset = image_folder(data_folder, transform=transform)
+        if staged:
+            dataset.loader = StagedLoader(dataset.loader, data_folder, folder)
+        kwargs = {"prefetch_factor": 2} if workers > 0 else {}
+        return dl(dataset, batch_size=batch_size, shuffle=True, num_workers=workers, **kwargs)
+
+    # for cold numbers drop the page cache before the run (echo 3 > /proc/sys/vm/drop_caches)
+    source_ips, _, _ = measure_loader(loader(False), max_batches)
+    print(f"## shared storage {source_ips:.2f} images/sec")
+    dataset = image_folder(data_folder)
+    stager = Stager(data_folder, folder, [os.path.relpath(path, data_folder) for path, _ in dataset.samples], copy_workers)
+    try:
+        stager.start()
+        stager.wait()
+        staged_ips, _, _ = measure_loader(loader(True), max_batches)
+    finally:
+        if not keep:
+            stager.remove()
+    print(f"## staged {staged_ips:.2f} images/sec")
+    print(f"## speedup {staged_ips / source_ips:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='stage an ImageFolder dataset to node-local storage and compare loader throughput')
+    parser.add_argument("--data-folder", type=str, help="ImageFolder dataset on shared storage", required=True)
+    parser.add_argument("--stage-dir", type=str, help="node-local folder (disk or tmpfs)", default="/dev/shm")
+    parser.add_argument("--copy-workers", type=int, help="copy threads", default=8)
+    parser.add_argument("--workers", type=int, help="data loader workers", default=4)
+    parser.add_argument("--batch-size", type=int, help="batch size", default=16)
+    parser.add_argument("--batches", type=int, help="batches per measurement, 0 for a full pass", default=0)
+    parser.add_argument("--keep", help="keep the staged copy instead of removing it at the end",
+                        action=argparse.BooleanOptionalAction, default=False)
+    args = parser.parse_args()
+    benchmark(args.data_folder, args.stage_dir, args.workers, args.copy_workers, args.batch_size, args.batches, args.keep)
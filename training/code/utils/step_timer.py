@@ -0,0 +1,148 @@
+import os,sys
+import json
+import time
+import numpy as np
+import torch
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+
+PHASES = ["data_wait", "h2d", "forward", "backward", "optimizer", "allreduce"]
+DATA_WAIT, H2D, FORWARD, BACKWARD, OPTIMIZER, ALLREDUCE = range(len(PHASES))
+# per step columns: wall clock start, epoch, the phases in seconds, all-reduced bytes
+START, EPOCH, BYTES = len(PHASES), len(PHASES) + 1, len(PHASES) + 2
+COLUMNS = len(PHASES) + 3
+
+
+class StepTimer(object):
+    """Records the phase durations of every training step into a preallocated array.
+
+    mark(phase) closes the phase that started at the previous mark, so a step costs a handful of
+    perf_counter calls and array stores. Full buffers are appended to a per-rank JSONL file.
+    The all-reduce phase is filled by the DDP comm hook from timed_hook(): the time between
+    the launch of the last gradient bucket and the completion of the last all-reduce, i.e. the
+    communication the backward pass could not hide. It overlaps the backward phase.
+    A disabled timer turns every call into a no-op.
+    """
+
+    def __init__(self, output_folder="", rank=0, capacity=4096, sync_cuda=False, enabled=True):
+        self.enabled = enabled
+        self.rank = rank
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.path = os.path.join(output_folder, f"step_times_rank{rank}.jsonl")
+        self.summary_path = os.path.join(output_folder, f"step_summary_rank{rank}.json")
+        self.records = np.zeros((capacity if enabled else 0, COLUMNS))
+        self.n = 0
+        self.steps = 0
+        self.epoch = 0
+        self._last = 0
+        self._file = None
+        self._totals = {phase: [] for phase in PHASES}
+        self._last_launch = 0
+        self._last_done = 0
+        self._bytes = 0
+
+    def start(self, epoch=None):
+        """Starts the data wait of the next step."""
+        if not self.enabled:
+            return
+        if epoch is not None:
+            self.epoch = epoch
+        self._last = time.perf_counter()
+        self.records[self.n, START] = time.time()
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        self.records[self.n, phase] += now - self._last
+        self._last = now
+
+    def end_step(self):
+        if not self.enabled:
+            return
+        record = self.records[self.n]
+        record[EPOCH] = self.epoch
+        record[ALLREDUCE] = max(self._last_done - self._last_launch, 0)
+        record[BYTES] = self._bytes
+        self._last_launch = self._last_done = 0
+        self._bytes = 0
+        self.n += 1
+        self.steps += 1
+        if self.n == len(self.records):
+            self.flush()
+        # the next data wait starts right away
+        self._last = time.perf_counter()
+        self.records[self.n, START] = time.time()
+
+    def comm_done(self, launch, done, nbytes):
+        # called from the communication thread when a bucket finished
+        self._last_launch = max(self._last_launch, launch)
+        self._last_done = max(self._last_done, done)
+        self._bytes += nbytes
+
+    def flush(self):
+        if not self.enabled or self.n == 0:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'w')
+        lines = []
+        for record in self.records[:self.n]:
+            entry = {"step": self.steps - self.n + len(lines), "epoch": int(record[EPOCH]), "time": record[START]}
+            entry.update({phase: round(record[i] * 1000, 4) for i, phase in enumerate(PHASES)})
+            entry["allreduce_bytes"] = int(record[BYTES])
+            lines.append(json.dumps(entry))
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+        for i, phase in enumerate(PHASES):
+            self._totals[phase].append(self.records[:self.n, i].copy())
+        self.records[:self.n] = 0
+        self.n = 0
+
+    def summary(self):
+        """p50/p95/p99 and mean per phase in ms over all recorded steps."""
+        self.flush()
+        result = {}
+        for phase in PHASES:
+            values = np.concatenate(self._totals[phase]) * 1000 if self._totals[phase] else np.zeros(1)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[phase] = {"p50": p50, "p95": p95, "p99": p99, "mean": float(values.mean())}
+        return result
+
+    def close(self):
+        if not self.enabled:
+            return
+        summary = self.summary()
+        with open(self.summary_path, 'w') as f:
+            json.dump({"rank": self.rank, "steps": self.steps, "phases_ms": summary}, f, indent=2)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        print(f"STEP TIMES node - {self.rank} over {self.steps} steps (ms)")
+        print(f"  {'phase':<10} {'p50':>10} {'p95':>10} {'p99':>10} {'mean':>10}")
+        for phase, stats in summary.items():
+            print(f"  {phase:<10} {stats['p50']:>10.3f} {stats['p95']:>10.3f} {stats['p99']:>10.3f} {stats['mean']:>10.3f}")
+        sys.stdout.flush()
+
+
+def timed_hook(timer, hook=default_hooks.allreduce_hook, wire_bytes=None):
+    """Wraps a DDP comm hook so that every bucket reports its launch and completion to the timer.
+
+    wire_bytes(bucket) gives the bytes the hook sends for a bucket, by default the size of the
+    tensor the hook returns, which is the uncompressed gradient size.
+    """
+
+    def hook_fn(state, bucket):
+        nbytes = wire_bytes(bucket) if wire_bytes is not None else None
+        launch = time.perf_counter()
+        fut = hook(state, bucket)
+
+        def done(fut):
+            tensor = fut.value()
+            size = nbytes if nbytes is not None else tensor.numel() * tensor.element_size()
+            timer.comm_done(launch, time.perf_counter(), size)
+            return tensor
+
+        return fut.then(done)
+
+    return hook_fn
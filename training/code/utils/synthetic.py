@@ -0,0 +1,28 @@
+import torch
+
+
+class SyntheticLoader(object):
+    """Stands in for the training DataLoader and yields one device resident random batch.
+
+    The batch is generated once, with its own generator so the global RNG and with it the model
+    initialization stay the same as in a real-data run, and is reused for every step. Nothing is
+    read, decoded or copied, so the step time is compute and communication only.
+    """
+
+    def __init__(self, batch_size, num_classes, steps, device, uint8=False, image_size=224, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+        shape = (batch_size, 3, image_size, image_size)
+        if uint8:
+            images = torch.randint(0, 256, shape, dtype=torch.uint8, generator=generator)
+        else:
+            images = torch.randn(shape, generator=generator)
+        self.images = images.to(device)
+        self.labels = torch.randint(0, num_classes, (batch_size,), generator=generator).to(device)
+        self.steps = steps
+
+    def __len__(self):
+        return self.steps
+
+    def __iter__(self):
+        for _ in range(self.steps):
+            yield self.images, self.labels
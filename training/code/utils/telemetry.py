@@ -0,0 +1,225 @@
+import os,sys
+import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+
+CLUSTER_FILE = "cluster_monitor.csv"
+REPORT_FILE = "cluster_report.txt"
+# every message is a 4 byte length followed by the payload, the first payload of a connection is
+# a JSON hello with the node name, its columns and its clock, all others are packed float64 records
+_LENGTH = struct.Struct("<I")
+# columns compared across nodes in the report
+REPORT_COLUMNS = ["cpu", "proc_cpu", "gpu", "disk_read_mbs", "net_recv_mbs", "cache_hit"]
+
+
+def _recv_exact(conn, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def _recv_message(conn):
+    """Payload of the next message, None when the connection closed, also in the middle of a message."""
+    header = _recv_exact(conn, _LENGTH.size)
+    if header is None:
+        return None
+    return _recv_exact(conn, _LENGTH.unpack(header)[0])
+
+
+class TelemetryPusher(object):
+    """Pushes monitor samples of one node to the collector on rank 0.
+
+    Connection attempts never block the monitor for long: until the collector is reachable
+    samples are kept in a bounded queue and sent once the connection is up. Failed attempts are
+    retried after a delay that doubles up to max_retry_interval seconds, so an unreachable
+    collector does not cost the connect timeout on every sample.
+    """
+
+    def __init__(self, host, port, node, columns, backlog=4096, max_retry_interval=30):
+        self.address = (host, port)
+        self.node = node
+        self.columns = columns
+        self.pending = deque(maxlen=backlog)
+        self.max_retry_interval = max_retry_interval
+        self._record = struct.Struct(f"<{len(columns)}d")
+        self._sock = None
+        self._retry_interval = 1
+        self._next_attempt = 0.0
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self._next_attempt:
+            return False
+        hello = json.dumps({"node": self.node, "columns": self.columns, "clock": time.time()}).encode()
+        try:
+            sock = socket.create_connection(self.address, timeout=1)
+            sock.sendall(_LENGTH.pack(len(hello)) + hello)
+        except OSError:
+            self._next_attempt = now + self._retry_interval
+            self._retry_interval = min(self._retry_interval * 2, self.max_retry_interval)
+            return False
+        self._retry_interval = 1
+        self._sock = sock
+        return True
+
+    def push(self, record):
+        self.pending.append(self._record.pack(*record))
+        if self._sock is None and not self._connect():
+            return
+        try:
+            self._sock.sendall(b"".join(_LENGTH.pack(len(p)) + p for p in self.pending))
+            self.pending.clear()
+        except OSError:
+            self._sock.close()
+            self._sock = None
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class TelemetryCollector(object):
+    """Receives the samples of every node on rank 0 and merges them into one timeline.
+
+    Node clocks are aligned with the offset measured at connection time (the network latency
+    of the hello is not corrected). Each connection is served by its own thread.
+    """
+
+    def __init__(self, port, num_nodes, output_folder):
+        self.num_nodes = num_nodes
+        self.output_folder = output_folder
+        self.nodes = {}
+        self._done = set()
+        self._lock = threading.Lock()
+        self._server = socket.create_server(("", port), backlog=num_nodes)
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        node = None
+        try:
+            with conn:
+                hello = _recv_message(conn)
+                if hello is None:
+                    return
+                hello = json.loads(hello)
+                node = hello["node"]
+                offset = time.time() - hello["clock"]
+                record = struct.Struct(f"<{len(hello['columns'])}d")
+                with self._lock:
+                    # a pusher that lost its connection reconnects and continues the same series
+                    entry = self.nodes.setdefault(node, {"columns": hello["columns"], "rows": []})
+                    entry["offset"] = offset
+                    self._done.discard(node)
+                    rows = entry["rows"]
+                while True:
+                    payload = _recv_message(conn)
+                    if payload is None or len(payload) != record.size:
+                        break
+                    rows.append(record.unpack(payload))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"CLUSTER TELEMETRY: dropped the connection of node {node}: {e}")
+            sys.stdout.flush()
+        finally:
+            if node is not None:
+                with self._lock:
+                    self._done.add(node)
+
+    def wait(self, timeout):
+        """Waits until every node closed its connection, at most timeout seconds."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if len(self._done) >= self.num_nodes:
+                    return True
+            time.sleep(0.5)
+        return False
+
+    def close(self):
+        self._server.close()
+
+    def timeline(self, interval):
+        """One grid of interval spaced timestamps and, per node, every column sampled on it.
+
+        A grid point takes the last sample of a node at or before it, or NaN when the node has no
+        sample in the preceding 1.5 intervals.
+        """
+        with self._lock:
+            nodes = {name: dict(node, rows=np.array(node["rows"], dtype=np.float64).reshape(-1, len(node["columns"])))
+                     for name, node in self.nodes.items()}
+        nodes = {name: node for name, node in nodes.items() if len(node["rows"])}
+        if not nodes:
+            return np.zeros(0), {}
+        for node in nodes.values():
+            node["rows"][:, 0] += node["offset"]
+        start = min(node["rows"][0, 0] for node in nodes.values())
+        end = max(node["rows"][-1, 0] for node in nodes.values())
+        grid = np.arange(start, end + interval / 2, interval)
+        series = {}
+        for name, node in sorted(nodes.items()):
+            times = node["rows"][:, 0]
+            idx = np.searchsorted(times, grid, side='right') - 1
+            stale = (idx < 0) | (grid - times[np.maximum(idx, 0)] > 1.5 * interval)
+            values = node["rows"][np.maximum(idx, 0)]
+            values[stale] = np.nan
+            series[name] = {column: values[:, i] for i, column in enumerate(node["columns"]) if column != "time"}
+        return grid, series
+
+    def report(self, interval):
+        """Writes the merged timeline as one CSV and a per-node comparison, returns the timeline."""
+        grid, series = self.timeline(interval)
+        if not series:
+            print("CLUSTER TELEMETRY: no samples received")
+            return grid, series
+        names = list(series)
+        headers = ["time"] + [f"{name}:{column}" for name in names for column in series[name]]
+        columns = [grid] + [series[name][column] for name in names for column in series[name]]
+        data = np.column_stack(columns)
+        with open(os.path.join(self.output_folder, CLUSTER_FILE), 'w') as f:
+            f.write(",".join(headers) + "\n")
+            for row in data:
+                f.write(",".join(f"{v:.3f}" for v in row) + "\n")
+
+        lines = [f"CLUSTER TELEMETRY {len(names)}/{self.num_nodes} nodes, {len(grid)} samples every {interval}s",
+                 f"  {'node':<24}" + "".join(f"{c:>15}" for c in REPORT_COLUMNS)]
+        means = {}
+        for name in names:
+            gpus = [v for c, v in series[name].items() if c.startswith("gpu") and not c.endswith("_mem")]
+            node_means = {}
+            for column in REPORT_COLUMNS:
+                values = np.concatenate(gpus) if column == "gpu" and gpus else series[name].get(column)
+                finite = values[np.isfinite(values)] if values is not None else np.zeros(0)
+                node_means[column] = finite.mean() if len(finite) else float('nan')
+            means[name] = node_means
+            lines.append(f"  {name:<24}" + "".join(f"{node_means[c]:>15.2f}" for c in REPORT_COLUMNS))
+        # a node more than 20% away from the median of the others stands out, e.g. a straggler or a slow NIC
+        for column in REPORT_COLUMNS:
+            values = np.array([means[name][column] for name in names])
+            median = np.nanmedian(values) if np.isfinite(values).any() else float('nan')
+            if len(names) < 2 or not median > 0:
+                continue
+            for name, value in zip(names, values):
+                if abs(value - median) > 0.2 * median:
+                    lines.append(f"  OUTLIER {name} {column} mean {value:.2f} vs node median {median:.2f}")
+        with open(os.path.join(self.output_folder, REPORT_FILE), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        print("\n".join(lines))
+        sys.stdout.flush()
+        return grid, series
@@ -0,0 +1,56 @@
+import os,sys
+import torch
+from torch.profiler import ProfilerActivity, profile, schedule
+
+
+class TorchProfile(object):
+    """torch.profiler over a wait/warmup/active/repeat schedule of training steps.
+
+    Every completed window writes a Chrome/Perfetto trace and an operator table for the rank to
+    the output folder. Only the active steps are traced, the rest of the run pays nothing.
+    A disabled profile turns every call into a no-op.
+    """
+
+    def __init__(self, output_folder="", rank=0, skip_first=10, wait=5, warmup=2, active=3, repeat=1,
+                 record_shapes=True, with_stack=False, enabled=True):
+        self.enabled = enabled
+        self.output_folder = output_folder
+        self.rank = rank
+        self.windows = 0
+        self.prof = None
+        if not enabled:
+            return
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        self.prof = profile(
+            activities=activities,
+            schedule=schedule(skip_first=skip_first, wait=wait, warmup=warmup, active=active, repeat=repeat),
+            on_trace_ready=self._trace_ready,
+            record_shapes=record_shapes,
+            with_stack=with_stack,
+        )
+
+    def _trace_ready(self, prof):
+        name = f"torch_trace_rank{self.rank}_window{self.windows}"
+        prof.export_chrome_trace(os.path.join(self.output_folder, name + ".json"))
+        with open(os.path.join(self.output_folder, f"torch_ops_rank{self.rank}.txt"), 'a') as f:
+            f.write(f"window {self.windows} (step {prof.step_num})\n")
+            f.write(prof.key_averages().table(sort_by=self.sort_by, row_limit=40))
+            f.write('\n\n')
+        print(f"TORCH PROFILE node - {self.rank} wrote {name}.json")
+        sys.stdout.flush()
+        self.windows += 1
+
+    def start(self):
+        if self.enabled:
+            self.prof.start()
+
+    def step(self):
+        if self.enabled:
+            self.prof.step()
+
+    def stop(self):
+        if self.enabled:
+            self.prof.stop()